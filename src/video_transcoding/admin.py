@@ -25,11 +25,13 @@ def short_description(name: Union[str, Promise]) -> Callable[[C], C]:
 
 # noinspection PyUnresolvedReferences
 class VideoAdmin(admin.ModelAdmin):
-    list_display = ('basename', 'source', 'status_display')
+    list_display = ('basename', 'source', 'status_display',
+                    'progress_display')
     list_filter = ('status',)
     search_fields = ('source', '=basename')
     actions = ['transcode']
-    readonly_fields = ('created', 'modified', 'video_player')
+    readonly_fields = ('created', 'modified', 'progress_display',
+                       'video_player')
 
     class Media:
         js = ('https://cdn.jsdelivr.net/npm/hls.js@1',)
@@ -38,6 +40,23 @@ class VideoAdmin(admin.ModelAdmin):
     def status_display(self, obj: models.Video) -> str:
         return obj.get_status_display()
 
+    @short_description(_("Progress"))
+    def progress_display(self, obj: models.Video) -> str:
+        if obj.status != obj.PROCESS or not obj.progress:
+            return ""
+        state = obj.progress
+        parts = [str(state.get('stage', ''))]
+        if state.get('chunks'):
+            parts.append(_("%(done)s/%(chunks)s chunks") % {
+                'done': state.get('done', 0), 'chunks': state['chunks']})
+        running = list(state.get('ffmpeg', {}).values())
+        if running:
+            fps = sum(p['fps'] for p in running)
+            speed = sum(p['speed'] for p in running)
+            parts.append(f"{len(running)} ffmpeg, {fps:.0f} fps, "
+                         f"{speed:.2f}x")
+        return ', '.join(parts)
+
     # noinspection PyUnusedLocal
     @short_description(_('Send transcode task'))
     def transcode(self,
@@ -48,7 +67,7 @@ class VideoAdmin(admin.ModelAdmin):
 
     @short_description(_('Video player'))
     def video_player(self, obj: models.Video) -> str:
-        if obj.basename is None:
+        if obj.basename is None or not obj.is_playable:
             return ""
         edge = random.choice(defaults.VIDEO_EDGES)
         source = obj.format_video_url(edge)
@@ -72,7 +91,7 @@ class VideoAdmin(admin.ModelAdmin):
                  form_url: str = '',
                  extra_context: Any = None
                  ) -> HttpResponse:
-        fields, self.fields = self.fields, ('source', 'preset')
+        fields, self.fields = self.fields, ('source', 'preset', 'priority')
         try:
             return super().add_view(request, form_url, extra_context)
         finally:
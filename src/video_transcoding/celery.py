@@ -1,13 +1,14 @@
 import os
 import signal
-from typing import Any
+from typing import Any, Dict, Optional
+from urllib.parse import urlparse
 
 from celery import Celery
-from celery import signals
+from celery import signals, states
 from celery.utils.log import get_logger
 from django.conf import settings
 
-from video_transcoding import defaults
+from video_transcoding import defaults, metrics
 
 app = Celery(defaults.CELERY_APP_NAME)
 app.config_from_object(defaults.VIDEO_TRANSCODING_CELERY_CONF)
@@ -34,3 +35,55 @@ def send_term_to_children(**kwargs: Any) -> None:
         os.killpg(os.getpid(), signal.SIGUSR1)
     except ProcessLookupError:
         logger.error("failed to send SIGUSR1 to %s", os.getpid())
+
+
+# noinspection PyUnusedLocal
+@signals.task_prerun.connect
+def count_started_task(sender: Any, **kwargs: Any) -> None:
+    metrics.add('tasks_in_progress', 1, task=type(sender).__name__)
+
+
+# noinspection PyUnusedLocal
+@signals.task_postrun.connect
+def count_finished_task(sender: Any, retval: Any = None,
+                        state: Optional[str] = None, **kwargs: Any) -> None:
+    task = type(sender).__name__
+    if state == states.SUCCESS:
+        # tasks return error message instead of raising an exception
+        status = 'success' if retval is None else 'error'
+    else:
+        status = (state or 'unknown').lower()
+    metrics.add('tasks_in_progress', -1, task=task)
+    metrics.increment('tasks_total', task=task, status=status)
+
+
+def get_queue_depths() -> Dict[str, int]:
+    """
+    :return: ready messages count for each configured task queue.
+    """
+    depths = {}
+    with app.connection_for_read() as conn:
+        channel = conn.default_channel
+        for queue in app.conf.task_queues or ():
+            ok = channel.queue_declare(queue=queue.name, passive=True)
+            depths[queue.name] = ok.message_count
+    return depths
+
+
+# noinspection PyUnusedLocal
+@signals.worker_init.connect
+def start_metrics_exporter(**kwargs: Any) -> None:
+    uri = defaults.VIDEO_METRICS_URI
+    if urlparse(uri).scheme != 'prometheus':
+        return
+    logger = get_logger(app.__module__)
+    metrics.start_exporter(uri, get_queue_depths)
+    logger.info("Started metrics exporter at %s", uri)
+
+
+# noinspection PyUnusedLocal
+@signals.worker_process_shutdown.connect
+def mark_metrics_process_dead(pid: int, **kwargs: Any) -> None:
+    if not os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        return
+    metrics.get_prometheus_client().multiprocess.mark_process_dead(pid)
@@ -5,6 +5,13 @@ from kombu import Queue
 
 CELERY_APP_NAME = 'video_transcoding'
 
+# Transcoding cost thresholds in 1080p-minutes for priority queues
+# (comma-separated), jobs above all thresholds are sent to default queue.
+VIDEO_PRIORITY_TIERS = [float(t) for t in
+                        e('VIDEO_PRIORITY_TIERS', '').split(',') if t]
+# Analyze new sources to compute transcoding cost for priority routing
+VIDEO_PRIORITY_PROBE = bool(int(e('VIDEO_PRIORITY_PROBE', 0)))
+
 try:
     VIDEO_TRANSCODING_CELERY_CONF = getattr(
         settings, 'VIDEO_TRANSCODING_CELERY_CONF',
@@ -36,6 +43,14 @@ except AttributeError:
                 routing_key=CELERY_APP_NAME,
                 queue_arguments=queue_arguments
             ),
+            # Priority queues for cheap transcoding jobs
+            *[
+                Queue(
+                    f'{CELERY_APP_NAME}.{i}',
+                    routing_key=f'{CELERY_APP_NAME}.{i}',
+                    queue_arguments=queue_arguments
+                ) for i in range(len(VIDEO_PRIORITY_TIERS))
+            ],
         ]
     }
 
@@ -58,9 +73,79 @@ VIDEO_URL = e('VIDEO_URL', '{edge}/results/{filename}/index.m3u8')
 # HTTP Request timeouts
 VIDEO_CONNECT_TIMEOUT = float(e('VIDEO_CONNECT_TIMEOUT', 1))
 VIDEO_REQUEST_TIMEOUT = float(e('VIDEO_REQUEST_TIMEOUT', 1))
+# Response timeout for uploads to WebDAV storage
+VIDEO_UPLOAD_TIMEOUT = float(e('VIDEO_UPLOAD_TIMEOUT', 60))
+
+# WebDAV connection pool size per host
+VIDEO_WEBDAV_POOL_SIZE = int(e('VIDEO_WEBDAV_POOL_SIZE', 10))
+# Number of retries for idempotent WebDAV requests
+VIDEO_WEBDAV_MAX_RETRIES = int(e('VIDEO_WEBDAV_MAX_RETRIES', 3))
+# Exponential backoff factor between WebDAV retries, seconds
+VIDEO_WEBDAV_RETRY_BACKOFF = float(e('VIDEO_WEBDAV_RETRY_BACKOFF', 0.5))
+# Enable TCP keep-alive for pooled WebDAV connections
+VIDEO_WEBDAV_TCP_KEEPALIVE = bool(int(e('VIDEO_WEBDAV_TCP_KEEPALIVE', 1)))
+
+# S3 endpoint for s3:// workspaces
+VIDEO_S3_ENDPOINT_URL = e('VIDEO_S3_ENDPOINT_URL', 'https://s3.amazonaws.com')
+# Lifetime of presigned S3 URLs passed to ffmpeg, seconds
+VIDEO_S3_PRESIGNED_URL_EXPIRES = int(e('VIDEO_S3_PRESIGNED_URL_EXPIRES',
+                                       6 * 3600))
+# Local directory for files written by ffmpeg before upload to S3
+VIDEO_S3_STAGING_DIR = e('VIDEO_S3_STAGING_DIR', '/tmp/video_transcoding/s3')
+# Max number of pooled S3 connections
+VIDEO_S3_MAX_POOL_CONNECTIONS = int(e('VIDEO_S3_MAX_POOL_CONNECTIONS', 10))
+# S3 multipart upload part size, bytes
+VIDEO_S3_MULTIPART_CHUNK_SIZE = int(e('VIDEO_S3_MULTIPART_CHUNK_SIZE',
+                                      8 * 1024 * 1024))
+
+# Local directory for caching temporary files, empty to disable caching
+VIDEO_LOCAL_CACHE_DIR = e('VIDEO_LOCAL_CACHE_DIR', '')
+# Max size of local cache directory, bytes
+VIDEO_LOCAL_CACHE_SIZE = int(e('VIDEO_LOCAL_CACHE_SIZE', 10 * 1024 ** 3))
+
+# Max number of source analysis results cached in worker memory, 0 to disable
+VIDEO_PROBE_CACHE_SIZE = int(e('VIDEO_PROBE_CACHE_SIZE', 0))
+# Django cache alias for sharing analysis results between workers
+VIDEO_PROBE_CACHE_ALIAS = e('VIDEO_PROBE_CACHE_ALIAS', '')
+# Analysis results expiration time for shared cache, seconds
+VIDEO_PROBE_CACHE_TIMEOUT = float(e('VIDEO_PROBE_CACHE_TIMEOUT', 24 * 3600))
+
+# Probe transcoded chunks to verify metadata computed from ffmpeg output
+VIDEO_VERIFY_RESULTS = bool(int(e('VIDEO_VERIFY_RESULTS', 0)))
+
+# Max number of preset snapshots cached in worker memory, 0 to disable
+VIDEO_PRESET_CACHE_SIZE = int(e('VIDEO_PRESET_CACHE_SIZE', 32))
+# Django cache alias for sharing preset snapshots between workers
+VIDEO_PRESET_CACHE_ALIAS = e('VIDEO_PRESET_CACHE_ALIAS', '')
 
 # Processing segment duration
 VIDEO_CHUNK_DURATION = int(e('VIDEO_CHUNK_DURATION', 60))
+# Choose split points at source keyframes to balance chunks encoding cost
+VIDEO_SPLIT_KEYFRAMES = bool(int(e('VIDEO_SPLIT_KEYFRAMES', 0)))
+# Transcoding strategy: "resumable" transcodes all chunks in a single task,
+# "distributed" sends a separate celery task for each chunk.
+VIDEO_TRANSCODING_STRATEGY = e('VIDEO_TRANSCODING_STRATEGY', 'resumable')
+# Number of chunks transcoded simultaneously
+VIDEO_CHUNK_CONCURRENCY = int(e('VIDEO_CHUNK_CONCURRENCY', 1))
+# Encode audio tracks in parallel with video chunks
+VIDEO_AUDIO_PREENCODE = bool(int(e('VIDEO_AUDIO_PREENCODE', 0)))
+# Transcode chunks directly to HLS segments at VIDEO_RESULTS_URI, audio
+# tracks are encoded in parallel with video chunks
+VIDEO_DIRECT_HLS = bool(int(e('VIDEO_DIRECT_HLS', 0)))
+# Publish transcoded chunks to EVENT playlists before video is finished
+# (requires VIDEO_DIRECT_HLS)
+VIDEO_PROGRESSIVE_HLS = bool(int(e('VIDEO_PROGRESSIVE_HLS', 0)))
+# Start transcoding chunks while source is still being split
+VIDEO_SPLIT_PIPELINE = bool(int(e('VIDEO_SPLIT_PIPELINE', 0)))
+# Split playlist polling interval for pipelined mode, seconds
+VIDEO_SPLIT_POLL_INTERVAL = float(e('VIDEO_SPLIT_POLL_INTERVAL', 1))
+# Min interval between transcoding progress updates, seconds, 0 to disable
+VIDEO_PROGRESS_INTERVAL = float(e('VIDEO_PROGRESS_INTERVAL', 5))
+# Metrics backend for pipeline stages stats, i.e. statsd://localhost:8125/prefix
+VIDEO_METRICS_URI = e('VIDEO_METRICS_URI', '')
+
+# Pixels encoded per second by a single CPU core, for transcoding planner
+VIDEO_PLANNER_PIXEL_RATE = float(e('VIDEO_PLANNER_PIXEL_RATE', 10_000_000))
 
 VIDEO_MODEL = 'video_transcoding.Video'
 
@@ -1,23 +1,105 @@
+from typing import Optional, Any, Dict
+
 from celery.result import AsyncResult
 
 from video_transcoding import models, defaults
 from video_transcoding import tasks
+from video_transcoding.transcoding import metadata
+
+# Transcoding cost unit: a minute of 1080p video
+FULL_HD_PIXELS = 1920 * 1080
+
+
+def get_transcode_cost(video: models.Video,
+                       src: Optional[metadata.Metadata] = None
+                       ) -> Optional[float]:
+    """
+    Estimates transcoding cost in 1080p-minutes.
+
+    Uses metadata of previously transcoded video or source metadata analyzed
+    by routing task.
+
+    :returns: cost or None if source duration is unknown.
+    """
+    data = video.metadata
+    if data and data.get('videos'):
+        duration = data.get('duration') or data['videos'][0]['duration']
+        pixels = max(v['width'] * v['height'] for v in data['videos'])
+    elif src is not None and src.videos:
+        duration = float(src.video.duration)
+        pixels = src.video.width * src.video.height
+    else:
+        return None
+    return duration / 60 * pixels / FULL_HD_PIXELS
+
 
+def needs_probe(video: models.Video) -> bool:
+    """
+    Checks if video is routed by cost that is known only after source
+    analysis with VIDEO_PRIORITY_PROBE enabled.
+    """
+    return (defaults.VIDEO_PRIORITY_PROBE and
+            bool(defaults.VIDEO_PRIORITY_TIERS) and
+            video.priority is None and
+            get_transcode_cost(video) is None)
+
+
+def get_routing_key(video: models.Video,
+                    src: Optional[metadata.Metadata] = None) -> str:
+    """
+    Selects transcoding queue for a video.
 
-def send_transcode_task(video: models.Video) -> AsyncResult:
+    Videos with explicit priority are sent to corresponding priority queue,
+    other videos are routed by estimated transcoding cost. Expensive and
+    unknown jobs are sent to default queue.
+    """
+    tiers = defaults.VIDEO_PRIORITY_TIERS
+    tier = len(tiers)
+    if video.priority is not None:
+        tier = max(0, min(video.priority, tier))
+    elif tiers:
+        cost = get_transcode_cost(video, src)
+        if cost is not None:
+            tier = next((i for i, t in enumerate(tiers) if cost <= t), tier)
+    if tier == len(tiers):
+        return tasks.transcode_video.routing_key
+    return f'{defaults.CELERY_APP_NAME}.{tier}'
+
+
+def send_transcode_task(video: models.Video,
+                        src: Optional[metadata.Metadata] = None,
+                        probe: bool = True) -> AsyncResult:
     """
     Send a video transcoding task.
 
     If task is successfully sent to broker, Video status is changed to QUEUED
     and Celery task identifier is saved.
 
+    If transcoding cost can be computed only from source analysis, routing
+    task is sent instead, so caller is not blocked by analysis.
+
     :param video: video object
     :type video: video.models.Video
+    :param src: source metadata analyzed by routing task
+    :param probe: send routing task if source analysis is needed
     :returns: Celery task result
     :rtype: celery.result.AsyncResult
     """
+    if probe and src is None and needs_probe(video):
+        # Analysis is a short job, so it is sent to first priority queue.
+        result = tasks.route_video.apply_async(
+            args=(video.pk,),
+            countdown=defaults.VIDEO_TRANSCODING_COUNTDOWN,
+            routing_key=f'{defaults.CELERY_APP_NAME}.0')
+        video.change_status(video.QUEUED, task_id=result.task_id)
+        return result
+    options: Dict[str, Any] = {}
+    routing_key = get_routing_key(video, src)
+    if routing_key != tasks.transcode_video.routing_key:
+        options['routing_key'] = routing_key
     result = tasks.transcode_video.apply_async(
         args=(video.pk,),
-        countdown=defaults.VIDEO_TRANSCODING_COUNTDOWN)
+        countdown=defaults.VIDEO_TRANSCODING_COUNTDOWN,
+        **options)
     video.change_status(video.QUEUED, task_id=result.task_id)
     return result
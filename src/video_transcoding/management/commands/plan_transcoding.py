@@ -0,0 +1,78 @@
+import json
+from dataclasses import asdict
+from typing import Any
+
+from django.core.management import BaseCommand, CommandParser
+
+from video_transcoding import models, planner
+
+Video = models.get_video_model()
+
+STATUSES = {
+    'created': Video.CREATED,
+    'queued': Video.QUEUED,
+    'process': Video.PROCESS,
+    'done': Video.DONE,
+    'error': Video.ERROR,
+}
+
+
+class Command(BaseCommand):
+    help = "Predicts transcoding profile, chunks count and CPU cost for videos"
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        parser.add_argument('ids', nargs='*', type=int,
+                            help="video primary keys")
+        parser.add_argument('--status', choices=list(STATUSES),
+                            help="plan videos with given status")
+        parser.add_argument('--limit', type=int,
+                            help="max number of videos to plan")
+        parser.add_argument('--concurrency', type=int, default=4,
+                            help="max number of sources analyzed in parallel")
+        parser.add_argument('--pixel-rate', type=float,
+                            help="pixels encoded per second by a CPU core")
+        parser.add_argument('--order', choices=['id', 'cost'], default='id',
+                            help="per-video plan ordering")
+        parser.add_argument('--json', action='store_true',
+                            help="output plan as JSON")
+
+    def handle(self, *args: Any, **options: Any) -> None:
+        qs = Video.objects.select_related('preset').order_by('pk')
+        if options['ids']:
+            qs = qs.filter(pk__in=options['ids'])
+        if options['status'] is not None:
+            qs = qs.filter(status=STATUSES[options['status']])
+        if options['limit'] is not None:
+            qs = qs[:options['limit']]
+
+        p = planner.Planner(concurrency=options['concurrency'],
+                            pixel_rate=options['pixel_rate'])
+        plan = p(qs)
+        if options['order'] == 'cost':
+            plan.videos.sort(key=lambda v: v.core_hours, reverse=True)
+
+        if options['json']:
+            # noinspection PyTypeChecker
+            data = {
+                'videos': [asdict(v) for v in plan.videos],
+                'duration': plan.duration,
+                'chunks': plan.chunks,
+                'core_hours': plan.core_hours,
+                'failed': len(plan.failed),
+            }
+            self.stdout.write(json.dumps(data, indent=2))
+            return
+
+        for v in plan.videos:
+            if v.error is not None:
+                self.stdout.write(f"{v.video_id}\t{v.source}\t"
+                                  f"error: {v.error}")
+                continue
+            tracks = ','.join(v.video_tracks + v.audio_tracks)
+            self.stdout.write(f"{v.video_id}\t{v.source}\t{tracks}\t"
+                              f"{v.duration:.1f}s\t{v.chunks} chunks\t"
+                              f"{v.core_hours:.2f} core-hours")
+        self.stdout.write(f"Total: {len(plan.planned)} videos, "
+                          f"{len(plan.failed)} failed, "
+                          f"{plan.duration:.1f}s, {plan.chunks} chunks, "
+                          f"{plan.core_hours:.2f} core-hours")
@@ -0,0 +1,439 @@
+import abc
+import os
+import resource
+import socket
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import (
+    Dict, List, Optional, Tuple, Iterator, Iterable, Any, Callable,
+)
+from urllib.parse import urlparse
+
+from video_transcoding import defaults
+from video_transcoding.transcoding import ffmpeg
+from video_transcoding.utils import LoggerMixin
+
+Labels = Dict[str, str]
+
+# Metric names prefix
+PREFIX = 'video_transcoding'
+
+
+@dataclass
+class StageStats:
+    """
+    Resource usage of a single transcoding pipeline stage.
+    """
+    stage: str
+    # Elapsed time, seconds
+    wall_time: float = 0.0
+    # User and system CPU time of child processes (ffmpeg, ffprobe), unknown
+    # if stage was running simultaneously with other stages
+    cpu_time: Optional[float] = None
+    # Output size reported by ffmpeg
+    write_bytes: int = 0
+    # Processed media duration, seconds
+    duration: float = 0.0
+
+    @property
+    def realtime_factor(self) -> Optional[float]:
+        """
+        :return: processed media duration relative to elapsed time.
+        """
+        if not self.duration or not self.wall_time:
+            return None
+        return self.duration / self.wall_time
+
+    def add_progress(self, progress: Optional[ffmpeg.Progress]) -> None:
+        """
+        Fills processed duration and written bytes from last ffmpeg
+        progress report.
+        """
+        if progress is None:
+            return
+        self.duration = progress.out_time
+        self.write_bytes = progress.total_size
+
+
+class Backend(LoggerMixin, abc.ABC):
+    """
+    Metrics backend.
+    """
+
+    @abc.abstractmethod
+    def observe(self, name: str, value: float,
+                labels: Labels) -> None:  # pragma: no cover
+        """
+        Adds a sample to a histogram.
+        """
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def increment(self, name: str, value: float,
+                  labels: Labels) -> None:  # pragma: no cover
+        """
+        Increments a counter.
+        """
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def add(self, name: str, value: float,
+            labels: Labels) -> None:  # pragma: no cover
+        """
+        Adds a value (possibly negative) to a gauge.
+        """
+        raise NotImplementedError
+
+    def record(self, stats: StageStats) -> None:
+        """
+        Emits stage resource usage.
+        """
+        labels = {'stage': stats.stage}
+        self.observe('stage_duration_seconds', stats.wall_time, labels)
+        if stats.cpu_time is not None:
+            self.increment('stage_cpu_seconds_total', stats.cpu_time, labels)
+        self.increment('stage_write_bytes_total', stats.write_bytes, labels)
+        realtime_factor = stats.realtime_factor
+        if realtime_factor is not None:
+            self.observe('stage_realtime_factor', realtime_factor, labels)
+
+
+class MemoryBackend(Backend):
+    """
+    Keeps metrics samples in memory, useful for tests.
+    """
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.samples: List[Tuple[str, float, Labels]] = []
+        self.lock = threading.Lock()
+
+    def observe(self, name: str, value: float, labels: Labels) -> None:
+        with self.lock:
+            self.samples.append((name, value, labels))
+
+    def increment(self, name: str, value: float, labels: Labels) -> None:
+        with self.lock:
+            self.samples.append((name, value, labels))
+
+    def add(self, name: str, value: float, labels: Labels) -> None:
+        with self.lock:
+            self.samples.append((name, value, labels))
+
+    def get(self, name: str, **labels: str) -> List[float]:
+        """
+        :return: values for a metric with matching labels.
+        """
+        with self.lock:
+            return [v for n, v, s in self.samples
+                    if n == name and labels.items() <= s.items()]
+
+
+class StatsdBackend(Backend):
+    """
+    Sends metrics to StatsD over UDP with DogStatsD tags, which are also
+    supported by prometheus statsd_exporter.
+    """
+
+    def __init__(self, host: str, port: int, prefix: str) -> None:
+        super().__init__()
+        self.address = (host, port)
+        self.prefix = prefix
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def observe(self, name: str, value: float, labels: Labels) -> None:
+        self.send(name, value, 'h', labels)
+
+    def increment(self, name: str, value: float, labels: Labels) -> None:
+        self.send(name, value, 'c', labels)
+
+    def add(self, name: str, value: float, labels: Labels) -> None:
+        # signed value is a gauge delta for statsd
+        self.send(name, value, 'g', labels, sign='+')
+
+    def send(self, name: str, value: float, kind: str,
+             labels: Labels, sign: str = '') -> None:
+        tags = ','.join(f'{k}:{v}' for k, v in labels.items())
+        line = f'{self.prefix}.{name}:{value:{sign}g}|{kind}'
+        if tags:
+            line = f'{line}|#{tags}'
+        try:
+            self.socket.sendto(line.encode(), self.address)
+        except OSError as e:
+            # Metrics are not worth failing transcoding for.
+            self.logger.debug("Can't send metrics: %r", e)
+
+
+class PrometheusBackend(Backend):
+    """
+    Collects metrics with prometheus_client.
+
+    For prefork celery pool PROMETHEUS_MULTIPROC_DIR environment variable
+    must be set, so metrics from all worker processes are exported by the
+    master process, see start_exporter.
+    """
+
+    def __init__(self, registry: Any = None) -> None:
+        """
+        :param registry: prometheus registry, default registry if None.
+        """
+        super().__init__()
+        client = get_prometheus_client()
+        self.client = client
+        self.registry = registry or client.REGISTRY
+        self.metrics: Dict[str, Any] = {}
+        self.lock = threading.Lock()
+
+    def get_metric(self, cls: Any, name: str, labels: Labels,
+                   **kwargs: Any) -> Any:
+        """
+        Registers a metric on first use.
+
+        :return: metric child for given labels.
+        """
+        with self.lock:
+            metric = self.metrics.get(name)
+            if metric is None:
+                metric = cls(f'{PREFIX}_{name}',
+                             name.replace('_', ' '),
+                             labelnames=sorted(labels),
+                             registry=self.registry,
+                             **kwargs)
+                self.metrics[name] = metric
+        return metric.labels(**labels) if labels else metric
+
+    def observe(self, name: str, value: float, labels: Labels) -> None:
+        self.get_metric(self.client.Histogram, name, labels).observe(value)
+
+    def increment(self, name: str, value: float, labels: Labels) -> None:
+        self.get_metric(self.client.Counter, name, labels).inc(value)
+
+    def add(self, name: str, value: float, labels: Labels) -> None:
+        # gauges are summed for live worker processes of a host
+        gauge = self.get_metric(self.client.Gauge, name, labels,
+                                multiprocess_mode='livesum')
+        gauge.inc(value)
+
+
+def get_prometheus_client() -> Any:
+    """
+    :return: prometheus_client module.
+    """
+    try:
+        import prometheus_client
+        # not imported by prometheus_client package itself
+        import prometheus_client.multiprocess
+    except ImportError:  # pragma: no cover
+        raise RuntimeError("prometheus_client is required for prometheus:// "
+                           "metrics")
+    return prometheus_client
+
+
+class QueueCollector:
+    """
+    Prometheus collector for celery queues depth, measured on scrape.
+    """
+
+    def __init__(self, queue_depths: Callable[[], Dict[str, int]]) -> None:
+        """
+        :param queue_depths: a function returning message count by queue.
+        """
+        self.queue_depths = queue_depths
+
+    def collect(self) -> Iterator[Any]:
+        get_prometheus_client()
+        from prometheus_client.core import GaugeMetricFamily
+        family = GaugeMetricFamily(f'{PREFIX}_queue_depth', 'queue depth',
+                                   labels=['queue'])
+        for queue, depth in self.queue_depths().items():
+            family.add_metric([queue], depth)
+        yield family
+
+
+def start_exporter(uri: str,
+                   queue_depths: Optional[Callable[[], Dict[str, int]]] = None,
+                   ) -> None:
+    """
+    Starts prometheus metrics HTTP endpoint in a background thread.
+
+    :param uri: endpoint address, i.e. `prometheus://0.0.0.0:9100`.
+    :param queue_depths: a function returning message count by queue.
+    """
+    client = get_prometheus_client()
+    parsed = urlparse(uri)
+    registry = client.REGISTRY
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        # Worker processes write metrics to files in this directory
+        registry = client.CollectorRegistry()
+        client.multiprocess.MultiProcessCollector(registry)
+    if queue_depths is not None:
+        registry.register(QueueCollector(queue_depths))
+    client.start_http_server(parsed.port or 9100,
+                             addr=parsed.hostname or '0.0.0.0',
+                             registry=registry)
+
+
+def init(uri: str) -> Backend:
+    """
+    Initializes metrics backend from URI, i.e. `statsd://localhost:8125/prefix`,
+    `prometheus://0.0.0.0:9100` or `memory:`.
+    """
+    parsed = urlparse(uri)
+    if parsed.scheme == 'memory':
+        return MemoryBackend()
+    elif parsed.scheme == 'statsd':
+        return StatsdBackend(parsed.hostname or 'localhost',
+                             parsed.port or 8125,
+                             parsed.path.strip('/') or PREFIX)
+    elif parsed.scheme == 'prometheus':
+        return PrometheusBackend()
+    else:
+        raise ValueError(uri)
+
+
+@lru_cache(maxsize=None)
+def get_metrics() -> Optional[Backend]:
+    """
+    Returns metrics backend configured with VIDEO_METRICS_URI setting.
+    """
+    if not defaults.VIDEO_METRICS_URI:
+        return None
+    return init(defaults.VIDEO_METRICS_URI)
+
+
+def increment(name: str, value: float = 1, **labels: str) -> None:
+    """
+    Increments a counter if metrics backend is configured.
+    """
+    backend = get_metrics()
+    if backend is not None:
+        backend.increment(name, value, labels)
+
+
+def add(name: str, value: float, **labels: str) -> None:
+    """
+    Adds a value to a gauge if metrics backend is configured.
+    """
+    backend = get_metrics()
+    if backend is not None:
+        backend.add(name, value, labels)
+
+
+class SpeedGauge:
+    """
+    Reports running ffmpeg process speed to `ffmpeg_speed` gauge, so the
+    gauge sums up speed of all ffmpeg processes running on a host.
+    """
+
+    def __init__(self, **labels: str) -> None:
+        self.labels = labels
+        self.speed = 0.0
+
+    def __call__(self, progress: ffmpeg.Progress) -> None:
+        speed = 0.0 if progress.finished else progress.speed
+        delta, self.speed = speed - self.speed, speed
+        if delta:
+            add('ffmpeg_speed', delta, **self.labels)
+
+
+def get_children_cpu_time() -> float:
+    """
+    :return: CPU time of finished child processes.
+    """
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+class RunningStages:
+    """
+    Tracks stages measured simultaneously in current process.
+
+    Child processes usage is accounted for the whole process, so it is
+    attributed only to stages that were not running simultaneously with
+    other stages.
+    """
+
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        # overlap flags for running stages
+        self.overlapped: Dict[int, bool] = {}
+
+    def start(self, key: int) -> None:
+        with self.lock:
+            for k in self.overlapped:
+                self.overlapped[k] = True
+            self.overlapped[key] = bool(self.overlapped)
+
+    def finish(self, key: int) -> bool:
+        """
+        :return: True if stage was running alone.
+        """
+        with self.lock:
+            return not self.overlapped.pop(key)
+
+
+running_stages = RunningStages()
+
+
+@contextmanager
+def measure(stage: str) -> Iterator[StageStats]:
+    """
+    Measures resource usage of a pipeline stage and emits it to metrics
+    backend.
+
+    Child processes CPU time is accounted for the whole worker process, so
+    it is left unknown for stages running simultaneously in other threads.
+
+    :param stage: pipeline stage name.
+    :return: stage stats, filled on successful exit.
+    """
+    stats = StageStats(stage)
+    start = time.monotonic()
+    cpu = get_children_cpu_time()
+    running_stages.start(id(stats))
+    try:
+        yield stats
+    except Exception:
+        increment('stage_errors_total', stage=stage)
+        raise
+    finally:
+        alone = running_stages.finish(id(stats))
+    stats.wall_time = time.monotonic() - start
+    if alone:
+        stats.cpu_time = get_children_cpu_time() - cpu
+    backend = get_metrics()
+    if backend is not None:
+        backend.record(stats)
+
+
+def summarize(stats: Iterable[StageStats]) -> Dict[str, Dict[str, Any]]:
+    """
+    Combines resource usage for each stage.
+
+    :return: json-serializable totals by stage name.
+    """
+    result: Dict[str, Dict[str, Any]] = defaultdict(lambda: {
+        'count': 0,
+        'wall_time': 0.0,
+        'cpu_time': None,
+        'write_bytes': 0,
+        'duration': 0.0,
+    })
+    for s in stats:
+        total = result[s.stage]
+        total['count'] += 1
+        total['wall_time'] += s.wall_time
+        if s.cpu_time is not None:
+            # sum of stages that were running alone
+            total['cpu_time'] = (total['cpu_time'] or 0.0) + s.cpu_time
+        total['write_bytes'] += s.write_bytes
+        total['duration'] += s.duration
+    for total in result.values():
+        total['realtime_factor'] = StageStats(
+            stage='', wall_time=total['wall_time'],
+            duration=total['duration']).realtime_factor
+    return dict(result)
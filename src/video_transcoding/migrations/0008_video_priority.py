@@ -0,0 +1,19 @@
+from django.db import migrations, models
+
+from video_transcoding import defaults
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('video_transcoding', '0007_videoprofile_segment_duration'),
+    ]
+
+    operations = []
+    if defaults.VIDEO_MODEL == 'video_transcoding.Video':
+        operations.extend([
+            migrations.AddField(
+                model_name='video',
+                name='priority',
+                field=models.SmallIntegerField(blank=True, help_text='Transcoding queue tier, 0 is the most urgent. Computed from source duration if not set.', null=True, verbose_name='priority'),
+            ),
+        ])
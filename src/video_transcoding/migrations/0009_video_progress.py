@@ -0,0 +1,19 @@
+from django.db import migrations, models
+
+from video_transcoding import defaults
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('video_transcoding', '0008_video_priority'),
+    ]
+
+    operations = []
+    if defaults.VIDEO_MODEL == 'video_transcoding.Video':
+        operations.extend([
+            migrations.AddField(
+                model_name='video',
+                name='progress',
+                field=models.JSONField(blank=True, null=True, verbose_name='progress'),
+            ),
+        ])
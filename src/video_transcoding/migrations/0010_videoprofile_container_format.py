@@ -0,0 +1,16 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('video_transcoding', '0009_video_progress'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='videoprofile',
+            name='container_format',
+            field=models.CharField(choices=[('mpegts', 'MPEG-TS'), ('fmp4', 'fMP4 (CMAF)')], default='mpegts', max_length=10, verbose_name='container format'),
+        ),
+    ]
@@ -0,0 +1,16 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('video_transcoding', '0010_videoprofile_container_format'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='videoprofile',
+            name='single_file',
+            field=models.BooleanField(default=False, verbose_name='single file'),
+        ),
+    ]
@@ -0,0 +1,19 @@
+from django.db import migrations, models
+
+from video_transcoding import defaults
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('video_transcoding', '0011_videoprofile_single_file'),
+    ]
+
+    operations = []
+    if defaults.VIDEO_MODEL == 'video_transcoding.Video':
+        operations.extend([
+            migrations.AddField(
+                model_name='video',
+                name='published',
+                field=models.BooleanField(default=False, help_text='Transcoded part of video is playable while video is still processed.', verbose_name='published'),
+            ),
+        ])
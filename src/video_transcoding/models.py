@@ -10,6 +10,7 @@ from django.utils.translation import gettext_lazy as _
 from model_utils.models import TimeStampedModel
 
 from video_transcoding import defaults
+from video_transcoding.transcoding import profiles
 
 
 class PresetBase(TimeStampedModel):
@@ -86,6 +87,13 @@ class VideoProfileBase(TimeStampedModel):
                                related_name='video_profiles',
                                verbose_name=_('preset'))
     segment_duration = models.DurationField(verbose_name=_('segment duration'))
+    container_format = models.CharField(
+        verbose_name=_('container format'), max_length=10,
+        choices=((profiles.MPEGTS, 'MPEG-TS'),
+                 (profiles.FMP4, 'fMP4 (CMAF)')),
+        default=profiles.MPEGTS)
+    single_file = models.BooleanField(verbose_name=_('single file'),
+                                      default=False)
 
     video = cast(
         related_descriptors.ManyToManyDescriptor,
@@ -205,6 +213,16 @@ class Video(TimeStampedModel):
                                null=True)
     metadata = models.JSONField(verbose_name=_('metadata'), blank=True, null=True)
     duration = models.DurationField(verbose_name=_('duration'), blank=True, null=True)
+    priority = models.SmallIntegerField(
+        verbose_name=_('priority'), blank=True, null=True,
+        help_text=_('Transcoding queue tier, 0 is the most urgent. '
+                    'Computed from source duration if not set.'))
+    progress = models.JSONField(verbose_name=_('progress'), blank=True,
+                                null=True)
+    published = models.BooleanField(
+        verbose_name=_('published'), default=False,
+        help_text=_('Transcoded part of video is playable while video '
+                    'is still processed.'))
 
     class Meta:
         abstract = defaults.VIDEO_MODEL != 'video_transcoding.Video'
@@ -215,9 +233,22 @@ class Video(TimeStampedModel):
         basename = os.path.basename(self.source)
         return f'{basename} ({self.get_status_display()})'
 
+    @property
+    def is_playable(self) -> bool:
+        """
+        :return: True if HLS stream is available at format_video_url, it
+            contains only transcoded part of video if video is published
+            before it is processed.
+        """
+        return self.status == self.DONE or (
+            self.status == self.PROCESS and self.published)
+
     def format_video_url(self, edge: str) -> str:
         """
         Returns a link to m3u8 playlist on one of randomly chosen edges.
+
+        Playlist is available before video is processed if it is published
+        (see is_playable and VIDEO_PROGRESSIVE_HLS).
         """
         if self.basename is None:
             raise RuntimeError("Video has no files")
@@ -0,0 +1,137 @@
+import math
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Iterable, List, Optional
+
+from django.db.models import prefetch_related_objects
+
+from video_transcoding import defaults, models, presets
+from video_transcoding.transcoding import extract, profiles
+from video_transcoding.utils import LoggerMixin
+
+
+@dataclass
+class VideoPlan:
+    """
+    Predicted transcoding work for a single video.
+    """
+    video_id: int
+    source: str
+    duration: float = 0.0
+    video_tracks: List[str] = field(default_factory=list)
+    audio_tracks: List[str] = field(default_factory=list)
+    chunks: int = 0
+    # Encoded pixels count for all video tracks
+    pixels: float = 0.0
+    core_hours: float = 0.0
+    error: Optional[str] = None
+
+
+@dataclass
+class Plan:
+    """
+    Predicted transcoding work for a batch of videos.
+    """
+    videos: List[VideoPlan]
+
+    @property
+    def planned(self) -> List[VideoPlan]:
+        return [p for p in self.videos if p.error is None]
+
+    @property
+    def failed(self) -> List[VideoPlan]:
+        return [p for p in self.videos if p.error is not None]
+
+    @property
+    def duration(self) -> float:
+        return sum(p.duration for p in self.planned)
+
+    @property
+    def chunks(self) -> int:
+        return sum(p.chunks for p in self.planned)
+
+    @property
+    def core_hours(self) -> float:
+        return sum(p.core_hours for p in self.planned)
+
+
+class Planner(LoggerMixin):
+    """
+    Predicts transcoding profile, chunks count and CPU cost for videos
+    without transcoding them.
+
+    Sources are analyzed concurrently, work is estimated as encoded pixels
+    count for every video track of selected profile.
+    """
+
+    def __init__(self, *,
+                 concurrency: int = 4,
+                 pixel_rate: Optional[float] = None,
+                 chunk_duration: Optional[float] = None) -> None:
+        """
+        :param concurrency: max number of sources analyzed simultaneously.
+        :param pixel_rate: pixels encoded per second by a single CPU core.
+        :param chunk_duration: source chunk duration, seconds.
+        """
+        super().__init__()
+        self.concurrency = concurrency
+        self.pixel_rate = pixel_rate or defaults.VIDEO_PLANNER_PIXEL_RATE
+        self.chunk_duration = (chunk_duration or
+                               defaults.VIDEO_CHUNK_DURATION)
+
+    def __call__(self, videos: Iterable[models.Video]) -> Plan:
+        return self.plan(videos)
+
+    def plan(self, videos: Iterable[models.Video]) -> Plan:
+        """
+        :param videos: videos to plan, preferably with preset selected.
+        :return: plan with an item for each video in the same order.
+        """
+        videos = list(videos)
+        preset_list = [v.preset for v in videos if v.preset is not None]
+        prefetch_related_objects(preset_list,
+                                 *presets.get_preset_prefetch())
+        with ThreadPoolExecutor(max_workers=self.concurrency,
+                                thread_name_prefix='planner') as pool:
+            # presets are initialized in caller thread to use prefetched
+            # objects without database access in pool threads.
+            args = [(v, self.init_preset(v.preset)) for v in videos]
+            plans = pool.map(lambda a: self.plan_video(*a), args)
+            return Plan(videos=list(plans))
+
+    @staticmethod
+    def init_preset(preset: Optional[models.Preset]) -> profiles.Preset:
+        if preset is None:
+            return profiles.DEFAULT_PRESET
+        cache = presets.get_preset_cache()
+        return cache.get_or_build(preset, presets.load_preset)
+
+    def plan_video(self, video: models.Video, preset: profiles.Preset
+                   ) -> VideoPlan:
+        """
+        Analyzes video source and estimates transcoding work.
+        """
+        plan = VideoPlan(video_id=video.pk, source=video.source)
+        try:
+            src = extract.SourceExtractor().get_meta_data(video.source)
+            profile = preset.select_profile(src.video, src.audio)
+        except Exception as e:
+            self.logger.warning("Can't plan %s: %s", video.source, e)
+            plan.error = repr(e)
+            return plan
+        self.estimate(plan, float(src.video.duration), profile)
+        return plan
+
+    def estimate(self, plan: VideoPlan, duration: float,
+                 profile: profiles.Profile) -> None:
+        """
+        Fills video plan with work estimation for selected profile.
+        """
+        plan.duration = duration
+        plan.video_tracks = [v.id for v in profile.video]
+        plan.audio_tracks = [a.id for a in profile.audio]
+        plan.chunks = math.ceil(duration / self.chunk_duration)
+        plan.pixels = sum(duration * v.frame_rate * v.width * v.height
+                          for v in profile.video)
+        plan.core_hours = plan.pixels / self.pixel_rate / 3600
+
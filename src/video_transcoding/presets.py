@@ -0,0 +1,184 @@
+from collections import OrderedDict
+from dataclasses import asdict
+from datetime import datetime
+from functools import lru_cache
+from threading import Lock
+from typing import Any, Callable, Optional, Tuple, List
+
+from django.db.models import Prefetch, prefetch_related_objects
+
+from video_transcoding import defaults, models
+from video_transcoding.transcoding import profiles
+from video_transcoding.utils import LoggerMixin
+
+Builder = Callable[[models.Preset], profiles.Preset]
+
+
+def get_preset_prefetch() -> List[Any]:
+    """
+    Returns prefetch lookups for loading the whole preset graph.
+
+    Usable with `Preset.objects.prefetch_related(*get_preset_prefetch())`
+    to load any number of presets with a constant number of queries.
+    """
+    video_tracks = models.VideoProfileTracks.objects.select_related('track')
+    audio_tracks = models.AudioProfileTracks.objects.select_related('track')
+    return [
+        'video_tracks',
+        'audio_tracks',
+        Prefetch('video_profiles',
+                 queryset=models.VideoProfile.objects.prefetch_related(
+                     Prefetch('videoprofiletracks_set',
+                              queryset=video_tracks))),
+        Prefetch('audio_profiles',
+                 queryset=models.AudioProfile.objects.prefetch_related(
+                     Prefetch('audioprofiletracks_set',
+                              queryset=audio_tracks))),
+    ]
+
+
+def load_preset(preset: models.Preset) -> profiles.Preset:
+    """
+    Builds preset entity from database objects.
+
+    Related objects are prefetched unless they are already prefetched, so
+    building a preset costs a constant number of queries regardless of
+    the number of tracks and profiles.
+    """
+    prefetch_related_objects([preset], *get_preset_prefetch())
+
+    video_tracks: List[profiles.VideoTrack] = []
+    for vt in preset.video_tracks.all():  # type: models.VideoTrack
+        kwargs = dict(**vt.params)
+        kwargs['id'] = vt.name
+        video_tracks.append(profiles.VideoTrack(**kwargs))
+
+    audio_tracks: List[profiles.AudioTrack] = []
+    for at in preset.audio_tracks.all():  # type: models.AudioTrack
+        kwargs = dict(**at.params)
+        kwargs['id'] = at.name
+        audio_tracks.append(profiles.AudioTrack(**kwargs))
+
+    video_profiles: List[profiles.VideoProfile] = []
+    for vp in preset.video_profiles.all():  # type: models.VideoProfile
+        vc = profiles.VideoCondition(**vp.condition)
+        tracks = [vpt.track.name for vpt in vp.videoprofiletracks_set.all()]
+        video_profiles.append(profiles.VideoProfile(
+            condition=vc,
+            video=tracks,
+            segment_duration=vp.segment_duration.total_seconds(),
+            container_format=vp.container_format,
+            single_file=vp.single_file,
+        ))
+
+    audio_profiles: List[profiles.AudioProfile] = []
+    for ap in preset.audio_profiles.all():  # type: models.AudioProfile
+        ac = profiles.AudioCondition(**ap.condition)
+        tracks = [apt.track.name for apt in ap.audioprofiletracks_set.all()]
+        audio_profiles.append(profiles.AudioProfile(
+            condition=ac,
+            audio=tracks,
+        ))
+
+    return profiles.Preset(
+        video_profiles=video_profiles,
+        audio_profiles=audio_profiles,
+        video=video_tracks,
+        audio=audio_tracks,
+    )
+
+
+class PresetCache(LoggerMixin):
+    """
+    Cache for preset snapshots built from database objects.
+
+    Snapshots are keyed by preset primary key and modification time. Signal
+    handlers update `Preset.modified` whenever any related object changes,
+    so a stale snapshot is never returned.
+
+    Snapshots are shared between threads and must not be modified.
+    """
+
+    def __init__(self, max_size: int, alias: str = '') -> None:
+        super().__init__()
+        self.max_size = max_size
+        self.alias = alias
+        self.items: "OrderedDict[Any, Tuple[datetime, profiles.Preset]]"
+        self.items = OrderedDict()
+        self.lock = Lock()
+
+    @property
+    def cache(self) -> Any:
+        from django.core.cache import caches
+        return caches[self.alias]
+
+    @staticmethod
+    def make_key(preset: models.Preset) -> str:
+        modified = preset.modified.isoformat()
+        return f'video_transcoding:preset:{preset.pk}:{modified}'
+
+    def get(self, preset: models.Preset) -> Optional[profiles.Preset]:
+        """
+        Returns a snapshot for current preset version or None.
+        """
+        with self.lock:
+            item = self.items.get(preset.pk)
+            if item is not None and item[0] == preset.modified:
+                self.items.move_to_end(preset.pk)
+                return item[1]
+        if not self.alias:
+            return None
+        data = self.cache.get(self.make_key(preset))
+        if data is None:
+            return None
+        snapshot = profiles.Preset.from_native(data)
+        self.store(preset, snapshot)
+        return snapshot
+
+    def set(self, preset: models.Preset, snapshot: profiles.Preset) -> None:
+        """
+        Stores a snapshot for current preset version.
+        """
+        self.store(preset, snapshot)
+        if self.alias:
+            # noinspection PyTypeChecker
+            self.cache.set(self.make_key(preset), asdict(snapshot))
+
+    def store(self, preset: models.Preset, snapshot: profiles.Preset
+              ) -> None:
+        if self.max_size <= 0:
+            return
+        with self.lock:
+            self.items[preset.pk] = (preset.modified, snapshot)
+            self.items.move_to_end(preset.pk)
+            while len(self.items) > self.max_size:
+                self.items.popitem(last=False)
+
+    def invalidate(self, pk: Any) -> None:
+        """
+        Removes preset snapshot from process memory.
+        """
+        with self.lock:
+            self.items.pop(pk, None)
+
+    def get_or_build(self, preset: models.Preset, build: Builder
+                     ) -> profiles.Preset:
+        """
+        Returns cached preset snapshot or builds it from database.
+        """
+        snapshot = self.get(preset)
+        if snapshot is not None:
+            return snapshot
+        self.logger.debug("Building preset %s snapshot", preset)
+        snapshot = build(preset)
+        self.set(preset, snapshot)
+        return snapshot
+
+
+@lru_cache(maxsize=None)
+def get_preset_cache() -> PresetCache:
+    """
+    Returns preset cache configured with VIDEO_PRESET_CACHE_* settings.
+    """
+    return PresetCache(defaults.VIDEO_PRESET_CACHE_SIZE,
+                       defaults.VIDEO_PRESET_CACHE_ALIAS)
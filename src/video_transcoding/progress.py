@@ -0,0 +1,224 @@
+import abc
+import asyncio
+import threading
+import time
+from functools import partial
+from typing import Dict, Any, Optional, Set
+
+from django.db import connections
+from django.db.transaction import atomic
+
+from video_transcoding import models
+from video_transcoding.transcoding import ffmpeg
+from video_transcoding.utils import LoggerMixin
+
+Video = models.get_video_model()
+
+
+class ProgressTracker(LoggerMixin, abc.ABC):
+    """
+    Collects transcoding progress and stores it with throttling.
+
+    Progress state contains current processing stage, chunks counters and
+    statistics for each running ffmpeg process.
+
+    ffmpeg progress is reported from fffw event loop, where Django prohibits
+    database queries, so state is stored from a separate thread there. Next
+    save waits for it to keep writes order.
+    """
+
+    def __init__(self,
+                 state: Optional[Dict[str, Any]] = None, *,
+                 interval: float = 0.0) -> None:
+        """
+        :param state: initial progress state.
+        :param interval: min interval between ffmpeg statistics saves,
+            seconds.
+        """
+        super().__init__()
+        self.state: Dict[str, Any] = dict(state or {})
+        self.running: Dict[str, ffmpeg.Progress] = {}
+        self.interval = interval
+        self.saved_at: Optional[float] = None
+        self.lock = threading.Lock()
+        # a thread storing state reported from event loop
+        self.pending: Optional[threading.Thread] = None
+
+    def update(self, **fields: Any) -> None:
+        """
+        Updates progress state and saves it immediately.
+        """
+        with self.lock:
+            self.state.update(fields)
+            self.save(force=True)
+
+    def chunk_done(self) -> None:
+        """
+        Increments transcoded chunks counter.
+        """
+        with self.lock:
+            self.state['done'] = self.state.get('done', 0) + 1
+            self.save()
+
+    def callback(self, key: str) -> ffmpeg.ProgressCallback:
+        """
+        :param key: ffmpeg process name, i.e. chunk filename.
+        :return: a callback for ffmpeg progress reports.
+        """
+        return partial(self.report, key)
+
+    def report(self, key: str, progress: ffmpeg.Progress) -> None:
+        """
+        Handles ffmpeg progress report.
+        """
+        with self.lock:
+            if progress.finished:
+                self.running.pop(key, None)
+            else:
+                self.running[key] = progress
+            self.save()
+
+    def get_state(self) -> Dict[str, Any]:
+        """
+        :return: json-serializable progress state.
+        """
+        state = dict(self.state)
+        state['ffmpeg'] = {
+            key: {'out_time': p.out_time, 'fps': p.fps, 'speed': p.speed}
+            for key, p in self.running.items()
+        }
+        return state
+
+    def save(self, force: bool = False) -> None:
+        """
+        Stores progress state if save interval has passed.
+
+        Must be called with lock acquired.
+        """
+        now = time.monotonic()
+        if (not force and self.saved_at is not None and
+                now - self.saved_at < self.interval):
+            return
+        self.saved_at = now
+        state = self.get_state()
+        self.wait()
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            self.store(state)
+            return
+        self.pending = threading.Thread(target=self.store_in_thread,
+                                        args=(state,))
+        self.pending.start()
+
+    def flush(self) -> None:
+        """
+        Waits until progress state reported from event loop is stored.
+        """
+        with self.lock:
+            self.wait()
+
+    def wait(self) -> None:
+        """
+        Waits for a pending write.
+
+        Must be called with lock acquired.
+        """
+        if self.pending is not None:
+            self.pending.join()
+            self.pending = None
+
+    def store(self, state: Dict[str, Any]) -> None:
+        """
+        Stores progress state ignoring errors.
+        """
+        try:
+            self.write(state)
+        except Exception as e:
+            # Progress is not worth failing transcoding for.
+            self.logger.warning("Can't save progress: %r", e)
+
+    def store_in_thread(self, state: Dict[str, Any]) -> None:
+        """
+        Stores progress state and closes database connections of a thread.
+        """
+        try:
+            self.store(state)
+        finally:
+            connections.close_all()
+
+    @abc.abstractmethod
+    def write(self, state: Dict[str, Any]) -> None:  # pragma: no cover
+        """
+        Stores progress state.
+        """
+        raise NotImplementedError
+
+
+class VideoProgressTracker(ProgressTracker):
+    """
+    Stores transcoding progress in Video model.
+    """
+
+    def __init__(self, video: models.Video, *, interval: float) -> None:
+        super().__init__(video.progress, interval=interval)
+        self.video_id = video.pk
+        self.task_id = video.task_id
+
+    def write(self, state: Dict[str, Any]) -> None:
+        # Video row is not locked, so status and task are checked to skip
+        # updates for a video processed by another task.
+        Video.objects.filter(
+            pk=self.video_id,
+            task_id=self.task_id,
+            status=Video.PROCESS,
+        ).update(progress=state)
+
+
+class SubtaskProgressTracker(VideoProgressTracker):
+    """
+    Merges progress of a chunk task into Video progress shared with other
+    tasks of the same video.
+
+    Only fields updated by this task and statistics of its own ffmpeg
+    processes are stored, so concurrent tasks don't overwrite each other.
+    Transcoded chunks counter is computed from results checkpoints and never
+    decreases.
+    """
+
+    def __init__(self, video: models.Video, *, interval: float) -> None:
+        super().__init__(video, interval=interval)
+        self.fields: Set[str] = set()
+        self.keys: Set[str] = set()
+
+    def update(self, **fields: Any) -> None:
+        with self.lock:
+            self.fields.update(fields)
+        super().update(**fields)
+
+    def report(self, key: str, progress: ffmpeg.Progress) -> None:
+        with self.lock:
+            self.keys.add(key)
+        super().report(key, progress)
+
+    @atomic
+    def write(self, state: Dict[str, Any]) -> None:
+        video = Video.objects.select_for_update().filter(
+            pk=self.video_id,
+            task_id=self.task_id,
+            status=Video.PROCESS,
+        ).first()
+        if video is None:
+            return
+        progress = dict(video.progress or {})
+        done = progress.get('done') or 0
+        for name in self.fields:
+            progress[name] = state[name]
+        if 'done' in self.fields:
+            progress['done'] = max(done, state['done'])
+        running = {key: value
+                   for key, value in (progress.get('ffmpeg') or {}).items()
+                   if key not in self.keys}
+        running.update(state['ffmpeg'])
+        progress['ffmpeg'] = running
+        Video.objects.filter(pk=self.video_id).update(progress=progress)
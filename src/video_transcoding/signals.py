@@ -3,10 +3,11 @@ from typing import Any
 import celery
 from django.core.signals import request_started, request_finished
 from django.db import transaction
-from django.db.models.signals import post_save
+from django.db.models.signals import post_save, post_delete, m2m_changed
 from django.dispatch import receiver
+from django.utils import timezone
 
-from video_transcoding import helpers, models
+from video_transcoding import helpers, models, presets
 from celery.signals import task_prerun, task_postrun
 
 
@@ -19,6 +20,65 @@ def send_transcode_task(sender: Any, *, instance: models.Video, created: bool,
     transaction.on_commit(lambda: helpers.send_transcode_task(instance))
 
 
+def touch_presets(**filters: Any) -> None:
+    """
+    Updates modification time for presets, invalidating their snapshots.
+    """
+    qs = models.Preset.objects.filter(**filters)
+    qs.update(modified=timezone.now())
+
+
+# noinspection PyUnusedLocal
+@receiver(post_save, sender=models.Preset)
+@receiver(post_delete, sender=models.Preset)
+def invalidate_preset(sender: Any, *, instance: models.Preset,
+                      **kw: Any) -> None:
+    presets.get_preset_cache().invalidate(instance.pk)
+
+
+# noinspection PyUnusedLocal
+@receiver(post_save, sender=models.VideoTrack)
+@receiver(post_delete, sender=models.VideoTrack)
+@receiver(post_save, sender=models.AudioTrack)
+@receiver(post_delete, sender=models.AudioTrack)
+@receiver(post_save, sender=models.VideoProfile)
+@receiver(post_delete, sender=models.VideoProfile)
+@receiver(post_save, sender=models.AudioProfile)
+@receiver(post_delete, sender=models.AudioProfile)
+def touch_preset(sender: Any, *, instance: Any, **kw: Any) -> None:
+    touch_presets(pk=instance.preset_id)
+
+
+# noinspection PyUnusedLocal
+@receiver(post_save, sender=models.VideoProfileTracks)
+@receiver(post_delete, sender=models.VideoProfileTracks)
+def touch_video_profile_preset(sender: Any, *,
+                               instance: models.VideoProfileTracks,
+                               **kw: Any) -> None:
+    touch_presets(video_profiles__pk=instance.profile_id)
+
+
+# noinspection PyUnusedLocal
+@receiver(post_save, sender=models.AudioProfileTracks)
+@receiver(post_delete, sender=models.AudioProfileTracks)
+def touch_audio_profile_preset(sender: Any, *,
+                               instance: models.AudioProfileTracks,
+                               **kw: Any) -> None:
+    touch_presets(audio_profiles__pk=instance.profile_id)
+
+
+# noinspection PyUnusedLocal
+@receiver(m2m_changed, sender=models.VideoProfileTracks)
+@receiver(m2m_changed, sender=models.AudioProfileTracks)
+def touch_profile_tracks_preset(sender: Any, *, instance: Any, action: str,
+                                **kw: Any) -> None:
+    """
+    Handles track list changes made with related managers.
+    """
+    if action.startswith('post_'):
+        touch_presets(pk=instance.preset_id)
+
+
 # noinspection PyUnusedLocal
 @task_prerun.connect
 def send_request_started(task: celery.Task, **kwargs: Any) -> None:
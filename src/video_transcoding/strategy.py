@@ -1,19 +1,97 @@
 import abc
+import asyncio
 import json
+import math
+import os.path
+import threading
+from concurrent import futures
+from contextlib import contextmanager, nullcontext
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import replace, asdict
 from types import TracebackType
-from typing import Type, List, Optional
+from typing import (
+    Type, List, Optional, Callable, Tuple, Dict, Iterator, Set, Any,
+    ContextManager,
+)
+
+from django.db import connections
 
-from video_transcoding import defaults
+from video_transcoding import defaults, progress, metrics
 from video_transcoding.transcoding import (
     workspace,
     profiles,
     metadata,
     transcoder,
     extract,
+    ffmpeg,
+    keyframes,
+    m3u8,
+    mpd,
 )
 from video_transcoding.utils import LoggerMixin
 
+FanOut = Callable[[List[str]], None]
+Publish = Callable[[], None]
+PublishLock = Callable[[], ContextManager[Any]]
+
+# Max number of checkpoint journal records before merging to snapshot
+JOURNAL_MAX_RECORDS = 16
+
+
+class WorkerPool(ThreadPoolExecutor):
+    """
+    Thread pool for chunk processing.
+
+    fffw runs ffmpeg with asyncio subprocess API, which requires an event loop
+    to be set for current thread. Loops are closed at pool shutdown.
+
+    Progress trackers open database connections in worker threads, they are
+    closed after each task because celery closes connections of its own
+    threads only.
+    """
+
+    def __init__(self, max_workers: int, thread_name_prefix: str = '',
+                 ) -> None:
+        super().__init__(max_workers=max_workers,
+                         thread_name_prefix=thread_name_prefix,
+                         initializer=self.init_worker_thread)
+        self._loops: List[asyncio.AbstractEventLoop] = []
+        self._loops_lock = threading.Lock()
+
+    def init_worker_thread(self) -> None:
+        """
+        Initializes chunk processing thread with a new event loop.
+        """
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        with self._loops_lock:
+            self._loops.append(loop)
+
+    def submit(self, fn: Callable[..., Any], /, *args: Any, **kwargs: Any
+               ) -> "futures.Future[Any]":
+        return super().submit(self.run_task, fn, *args, **kwargs)
+
+    @staticmethod
+    def run_task(fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+        """
+        Runs a task in worker thread and closes its database connections.
+        """
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            connections.close_all()
+
+    def shutdown(self, wait: bool = True, *,
+                 cancel_futures: bool = False) -> None:
+        super().shutdown(wait=wait, cancel_futures=cancel_futures)
+        if not wait:
+            # Worker threads may still use their loops.
+            return
+        with self._loops_lock:
+            loops, self._loops = self._loops, []
+        for loop in loops:
+            loop.close()
+
 
 class Strategy(LoggerMixin, abc.ABC):
     """
@@ -24,12 +102,14 @@ class Strategy(LoggerMixin, abc.ABC):
                  source_uri: str,
                  basename: str,
                  preset: profiles.Preset,
+                 tracker: Optional[progress.ProgressTracker] = None,
                  ) -> None:
         """
 
         :param source_uri: URI of source file at remote storage.
         :param basename: common prefix for temporary and resulting paths.
         :param preset: preset to choose profile from.
+        :param tracker: transcoding progress tracker.
 
         >>> from uuid import uuid4
         >>> s = Strategy(source_uri='http://storage.localhost:8080/source.mp4',
@@ -41,11 +121,16 @@ class Strategy(LoggerMixin, abc.ABC):
         self.source_uri = source_uri
         self.basename = basename
         self.preset = preset
+        self.tracker = tracker
+        # Resource usage of finished pipeline stages
+        self.stats: List[metrics.StageStats] = []
+        self.stats_lock = threading.Lock()
 
-    def __call__(self) -> metadata.Metadata:
+    def __call__(self) -> Optional[metadata.Metadata]:
         """
         Entrypoint.
-        :return: result media metadata.
+        :return: result media metadata or None if processing is continued
+            asynchronously.
         """
         with self:
             return self.process()
@@ -65,8 +150,45 @@ class Strategy(LoggerMixin, abc.ABC):
         """
         self.cleanup(is_error=exc_type is not None)
 
+    def report(self, **fields: Any) -> None:
+        """
+        Updates transcoding progress state if progress is tracked.
+        """
+        if self.tracker is not None:
+            self.tracker.update(**fields)
+
+    @contextmanager
+    def measure(self, stage: str) -> Iterator[metrics.StageStats]:
+        """
+        Measures resource usage of a pipeline stage.
+
+        :param stage: pipeline stage name.
+        :return: stage stats, filled on successful exit.
+        """
+        with metrics.measure(stage) as stats:
+            yield stats
+        with self.stats_lock:
+            self.stats.append(stats)
+
+    def get_progress_callback(self, key: str, stage: Optional[str] = None,
+                              ) -> Optional[ffmpeg.ProgressCallback]:
+        """
+        :param key: ffmpeg process name.
+        :param stage: pipeline stage name, same as key if not set.
+        :return: a callback for ffmpeg progress reports if progress is
+            tracked or metrics are collected.
+        """
+        callbacks: List[ffmpeg.ProgressCallback] = []
+        if self.tracker is not None:
+            callbacks.append(self.tracker.callback(key))
+        if metrics.get_metrics() is not None:
+            callbacks.append(metrics.SpeedGauge(stage=stage or key))
+        if len(callbacks) <= 1:
+            return callbacks[0] if callbacks else None
+        return ffmpeg.chain(*callbacks)
+
     @abc.abstractmethod
-    def process(self) -> metadata.Metadata:  # pragma: no cover
+    def process(self) -> Optional[metadata.Metadata]:  # pragma: no cover
         """
         Run processing logic.
         """
@@ -94,9 +216,9 @@ class ResumableStrategy(Strategy):
     Transcoding strategy implementation with resume support.
 
     Source file is downloaded to temporary shared webdav directory,
-    split to chunks. Chunks are transcoded on by one and merged to a
-    single file at the end. Resulting file is segmented to HLS on
-    a result storage.
+    split to chunks. Chunks are transcoded one by one (or a few at once, see
+    VIDEO_CHUNK_CONCURRENCY) and merged to a single file at the end.
+    Resulting file is segmented to HLS on a result storage.
     """
     sources: workspace.Collection
     """
@@ -114,17 +236,38 @@ class ResumableStrategy(Strategy):
                  source_uri: str,
                  basename: str,
                  preset: profiles.Preset,
+                 tracker: Optional[progress.ProgressTracker] = None,
+                 on_publish: Optional[Publish] = None,
+                 lock_publishing: Optional[PublishLock] = None,
                  ) -> None:
-        super().__init__(source_uri, basename, preset)
+        """
+        :param on_publish: a callback called when video becomes playable
+            before it is processed, see publish_playlists.
+        :param lock_publishing: returns a context manager that serializes
+            playlists publishing by all tasks of a video.
+        """
+        super().__init__(source_uri, basename, preset, tracker)
+        self.on_publish = on_publish
+        self.lock_publishing = lock_publishing
 
         root = defaults.VIDEO_TEMP_URI.rstrip('/')
         base = f'{root}/{basename}/'
         self.ws = workspace.init(base)
+        if defaults.VIDEO_LOCAL_CACHE_DIR:
+            self.ws = workspace.CachedWorkspace(self.ws,
+                                                workspace.get_local_cache())
 
         root = defaults.VIDEO_RESULTS_URI.rstrip('/')
         base = f'{root}/{basename}/'
         self.store = workspace.init(base)
 
+        # Checkpoint journal content, see read_checkpoint
+        self.journal: Optional[Dict[str, Any]] = None
+        # Number of journal records not merged to snapshot
+        self.journal_records = 0
+        self.journal_lock = threading.Lock()
+        self.publish_lock = threading.Lock()
+
     @property
     def source_metadata(self) -> workspace.File:
         """
@@ -160,6 +303,39 @@ class ResumableStrategy(Strategy):
         """
         return self.sources.file('source-audio.mkv')
 
+    @property
+    def audio_result_file(self) -> workspace.File:
+        """
+        :return: An mkv file with transcoded audio tracks.
+        """
+        return self.results.file('audio.mkv')
+
+    def chunk_playlist_file(self, filename: str,
+                            variant: str = '%v') -> workspace.File:
+        """
+        :param filename: chunk filename.
+        :param variant: variant name, i.e. `v0`.
+        :return: An m3u8 playlist for HLS segments of a transcoded chunk.
+        """
+        stem = os.path.splitext(filename)[0]
+        return self.results.file(f'{stem}-{variant}.m3u8')
+
+    @property
+    def preencode_audio(self) -> bool:
+        """
+        :return: True if audio tracks are encoded in parallel with video
+            chunks.
+        """
+        return defaults.VIDEO_AUDIO_PREENCODE or defaults.VIDEO_DIRECT_HLS
+
+    @property
+    def progressive(self) -> bool:
+        """
+        :return: True if transcoded chunks are published to EVENT playlists
+            before video is processed.
+        """
+        return defaults.VIDEO_DIRECT_HLS and defaults.VIDEO_PROGRESSIVE_HLS
+
     @property
     def manifest_uri(self) -> str:
         """
@@ -185,6 +361,92 @@ class ResumableStrategy(Strategy):
         parts[-1] = f'{file.basename}.json'
         return workspace.File(*parts)
 
+    @property
+    def journal_file(self) -> workspace.File:
+        """
+        :return: a json file containing snapshot of processing checkpoints.
+        """
+        return self.ws.root.file('checkpoint.json')
+
+    @property
+    def journal_collection(self) -> workspace.Collection:
+        """
+        :return: a collection of journal records written after snapshot.
+        """
+        return self.ws.root.collection('checkpoints')
+
+    def checkpoint_key(self, f: workspace.File) -> str:
+        """
+        :param f: checkpoint file.
+        :return: checkpoint key in a journal.
+        """
+        return '/'.join(f.parts[len(self.ws.root.parts):])
+
+    def load_journal(self) -> Dict[str, Any]:
+        """
+        Reads checkpoint journal from temporary workspace once.
+
+        Journal is a snapshot with records appended after it, records are
+        applied in the order they were written.
+
+        Must be called with journal lock acquired.
+        :return: checkpoint journal content.
+        """
+        if self.journal is not None:
+            return self.journal
+        journal: Dict[str, Any] = {}
+        if self.ws.exists(self.journal_file):
+            journal.update(json.loads(self.ws.read(self.journal_file)))
+        records = sorted(r.basename for r in
+                         self.ws.list_collection(self.journal_collection)
+                         if isinstance(r, workspace.File))
+        for name in records:
+            f = self.journal_collection.file(name)
+            journal.update(json.loads(self.ws.read(f)))
+        self.journal_records = len(records)
+        self.journal = journal
+        return journal
+
+    def read_checkpoint(self, f: workspace.File) -> Optional[Any]:
+        """
+        Reads checkpoint data from journal.
+
+        :param f: checkpoint file.
+        :return: stored data or None if step is not finished yet.
+        """
+        with self.journal_lock:
+            journal = self.load_journal()
+            return journal.get(self.checkpoint_key(f))
+
+    def write_checkpoint(self, f: workspace.File, data: Any) -> None:
+        """
+        Appends checkpoint data to journal as a separate record.
+
+        Records are merged to journal snapshot when there are
+        JOURNAL_MAX_RECORDS of them, so resuming reads a snapshot and a
+        constant number of records regardless of chunks count.
+
+        :param f: checkpoint file.
+        :param data: json-serializable checkpoint data.
+        """
+        with self.journal_lock:
+            journal = self.load_journal()
+            key = self.checkpoint_key(f)
+            journal[key] = data
+            if self.journal_records < JOURNAL_MAX_RECORDS:
+                self.journal_records += 1
+                if self.journal_records == 1:
+                    self.ws.create_collection(self.journal_collection)
+                record = self.journal_collection.file(
+                    f'{self.journal_records:08d}.json')
+                self.ws.write(record, json.dumps({key: data}))
+                return
+            # Records are removed after snapshot is written, so they are
+            # applied again if merge is interrupted.
+            self.ws.write(self.journal_file, json.dumps(journal))
+            self.ws.delete_collection(self.journal_collection)
+            self.journal_records = 0
+
     def initialize(self) -> None:
         self.ws.create_collection(self.ws.root)
         self.sources = self.ws.ensure_collection('sources')
@@ -197,23 +459,37 @@ class ResumableStrategy(Strategy):
         else:
             self.ws.delete_collection(self.ws.root)
 
-    def process(self) -> metadata.Metadata:
-        src = self.analyze_source()
-        self.profile = self.select_profile(src)
-
-        self.split(src)
-
-        segments = self.get_segment_list()
+    def process(self) -> Optional[metadata.Metadata]:
+        if defaults.VIDEO_SPLIT_PIPELINE:
+            segments, results = self.split_and_process()
+        else:
+            segments = self.prepare()
+            with self.audio_stage():
+                results = self.process_segments(segments)
 
         result_meta: Optional[metadata.Metadata] = None
-        for fn in segments:
-            segment_meta = self.process_segment(fn)
+        for segment_meta in results:
             result_meta = self.merge_metadata(result_meta, segment_meta)
         if result_meta is None:  # pragma: no cover
             raise RuntimeError("no segments")
 
         return self.merge(segments, meta=result_meta)
 
+    def prepare(self) -> List[str]:
+        """
+        Analyzes source, selects profile and splits source to chunks.
+
+        :return: a list of chunk filenames.
+        """
+        self.report(stage='analyze')
+        src = self.analyze_source()
+        self.profile = self.select_profile(src)
+
+        self.report(stage='split')
+        self.split(src)
+
+        return self.get_segment_list()
+
     @staticmethod
     def merge_metadata(result_meta: Optional[metadata.Metadata],
                        segment_meta: metadata.Metadata,
@@ -253,18 +529,16 @@ class ResumableStrategy(Strategy):
 
         :return: source file metadata
         """
-        if self.ws.exists(self.source_metadata):
+        data = self.read_checkpoint(self.source_metadata)
+        if data is not None:
             self.logger.debug("Using previous metadata %s",
                               self.source_metadata)
-            content = self.ws.read(self.source_metadata)
-            data = json.loads(content)
             return metadata.Metadata.from_native(data)
 
         meta = self._analyze_source()
 
         # noinspection PyTypeChecker
-        content = json.dumps(asdict(meta))
-        self.ws.write(self.source_metadata, content)
+        self.write_checkpoint(self.source_metadata, asdict(meta))
 
         return meta
 
@@ -273,7 +547,8 @@ class ResumableStrategy(Strategy):
         Runs source file analysis
         :return: source file metadata.
         """
-        src = extract.SourceExtractor().get_meta_data(self.source_uri)
+        with self.measure('analyze'):
+            src = extract.SourceExtractor().get_meta_data(self.source_uri)
         return src
 
     def select_profile(self, src: metadata.Metadata) -> profiles.Profile:
@@ -283,17 +558,15 @@ class ResumableStrategy(Strategy):
         Selected profile is stored in sources collection.
         :return: selected or cached profile.
         """
-        if self.ws.exists(self.profile_file):
+        data = self.read_checkpoint(self.profile_file)
+        if data is not None:
             self.logger.debug("Using previous profile %s", self.profile_file)
-            content = self.ws.read(self.profile_file)
-            data = json.loads(content)
             return profiles.Profile.from_native(data)
 
         profile = self._select_profile(src)
 
         # noinspection PyTypeChecker
-        content = json.dumps(asdict(profile))
-        self.ws.write(self.profile_file, content)
+        self.write_checkpoint(self.profile_file, asdict(profile))
 
         return profile
 
@@ -314,25 +587,29 @@ class ResumableStrategy(Strategy):
         :return: a list of chunk filenames.
         """
         f = self.split_metadata
-        if self.ws.exists(f):
-            # split metadata is already written after playlists finished, reuse it
-            self.logger.debug("Source already split to %s", self.split_metadata)
-            content = self.ws.read(f)
-            data = json.loads(content)
+        data = self.read_checkpoint(f)
+        if data is not None:
+            # split metadata is already written after playlists finished,
+            # reuse it
+            self.logger.debug("Source already split to %s",
+                              self.split_metadata)
             meta = metadata.Metadata.from_native(data)
             return meta
 
         meta = self._split(src)
         # noinspection PyTypeChecker
-        content = json.dumps(asdict(meta))
-        self.ws.write(f, content)
+        self.write_checkpoint(f, asdict(meta))
         return meta
 
     def _split(self, src: metadata.Metadata) -> metadata.Metadata:
         """
         Downloads source file and split it to chunks at shared webdav.
         """
-        destination = self.ws.get_absolute_uri(self.split_metadata)
+        destination = self.ws.get_output_uri(self.split_metadata)
+        for f in (self.video_chunk_file, self.audio_file,
+                  self.video_playlist_file):
+            # splitter writes these files next to metadata file
+            self.ws.get_output_uri(f)
         split = transcoder.Splitter(
             self.source_uri,
             destination.geturl(),
@@ -341,8 +618,36 @@ class ResumableStrategy(Strategy):
             source_video_playlist=self.video_playlist_file.basename,
             source_video_chunk=self.video_chunk_file.basename,
             source_audio=self.audio_file.basename,
+            segment_times=self.get_segment_times(),
+            progress=self.get_progress_callback('split'),
         )
-        return split()
+        with self.measure('split') as stats:
+            result = split()
+            stats.add_progress(split.last_progress)
+            for f in (self.video_chunk_file, self.audio_file,
+                      # playlist is committed last to list existing chunks
+                      self.video_playlist_file):
+                self.ws.commit(f)
+        return result
+
+    def get_segment_times(self) -> Optional[List[float]]:
+        """
+        Plans source split points at keyframes if enabled.
+
+        :return: split points, seconds, or None to split source evenly.
+        """
+        if not defaults.VIDEO_SPLIT_KEYFRAMES:
+            return None
+        planner = keyframes.KeyframePlanner(defaults.VIDEO_CHUNK_DURATION)
+        try:
+            with self.measure('keyframes'):
+                segment_times = planner(self.source_uri)
+        except Exception as e:
+            # Even split is a correct fallback
+            self.logger.warning("Can't plan keyframe split: %r", e)
+            return None
+        self.logger.debug("Split points: %s", segment_times)
+        return segment_times or None
 
     def get_segment_list(self) -> List[str]:
         """
@@ -357,6 +662,113 @@ class ResumableStrategy(Strategy):
             segments.append(line)
         return segments
 
+    def split_and_process(self
+                          ) -> Tuple[List[str], List[metadata.Metadata]]:
+        """
+        Transcodes source chunks while source is still being split.
+
+        Split playlist is polled while splitter is running, and each chunk
+        is sent to transcoding as soon as splitter closes it.
+
+        :return: a list of chunk filenames and a list of resulting chunks
+            metadata in playlist order.
+        """
+        self.report(stage='analyze')
+        src = self.analyze_source()
+        self.profile = self.select_profile(src)
+
+        if self.read_checkpoint(self.split_metadata) is not None:
+            # Source is already split, nothing to overlap with.
+            self.split(src)
+            segments = self.get_segment_list()
+            with self.audio_stage():
+                return segments, self.process_segments(segments)
+
+        # Playlist may be left from previous split attempt, and chunks listed
+        # there are being overwritten by a new splitter process.
+        self.ws.write(self.video_playlist_file, '')
+        # Chunks count is not known until splitter finishes.
+        self.report(stage='transcode', chunks=None, done=0)
+
+        splitter = WorkerPool(max_workers=1, thread_name_prefix='split')
+        pool = WorkerPool(
+            max_workers=max(defaults.VIDEO_CHUNK_CONCURRENCY, 1),
+            thread_name_prefix='segment')
+        results: Dict[str, futures.Future] = {}
+        try:
+            split = splitter.submit(self.split, src)
+            while True:
+                # Playlist is complete if read after splitter finished.
+                done = split.done()
+                for fn in self.get_finished_segments():
+                    if fn not in results:
+                        self.logger.debug("Chunk %s is ready", fn)
+                        results[fn] = pool.submit(self.process_segment, fn)
+                for f in results.values():
+                    if f.done() and f.exception() is not None:
+                        # Don't wait for splitter to fail fast.
+                        f.result()
+                if done:
+                    break
+                timeout = defaults.VIDEO_SPLIT_POLL_INTERVAL
+                futures.wait([split], timeout=timeout)
+            split.result()
+
+            with self.audio_stage():
+                segments = self.get_segment_list()
+                self.report(chunks=len(segments))
+                for fn in segments:
+                    if fn not in results:  # pragma: no cover
+                        results[fn] = pool.submit(self.process_segment, fn)
+                return segments, [results[fn].result() for fn in segments]
+        finally:
+            # Don't start pending chunks if split or one of chunks failed.
+            pool.shutdown(cancel_futures=True)
+            splitter.shutdown()
+
+    def get_finished_segments(self) -> List[str]:
+        """
+        Parses a list of segment names from a M3U8 playlist written by
+        splitter, that may not exist yet.
+
+        :return: a list of chunk filenames closed by splitter.
+        """
+        if not self.ws.exists(self.video_playlist_file):
+            return []
+        segments = []
+        content = self.ws.read(self.video_playlist_file)
+        for line in content.splitlines(keepends=True):
+            if not line.endswith('\n'):
+                # Skip partially written line
+                continue
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            segments.append(line)
+        return segments
+
+    def process_segments(self, segments: List[str]
+                         ) -> List[metadata.Metadata]:
+        """
+        Transcodes source chunks with a bounded pool of worker threads.
+
+        :param segments: list of chunk filenames.
+        :return: a list of resulting chunks metadata in playlist order.
+        """
+        self.report(stage='transcode', chunks=len(segments), done=0)
+        concurrency = min(defaults.VIDEO_CHUNK_CONCURRENCY, len(segments))
+        if concurrency <= 1:
+            return list(map(self.process_segment, segments))
+        self.logger.debug("Processing %s segments with %s workers",
+                          len(segments), concurrency)
+        pool = WorkerPool(max_workers=concurrency,
+                          thread_name_prefix='segment')
+        try:
+            return list(pool.map(self.process_segment, segments))
+        finally:
+            # don't start pending chunks if one of chunks failed
+            pool.shutdown(cancel_futures=True)
+
     def process_segment(self, filename: str) -> metadata.Metadata:
         """
         Transcodes source chunk to a resulting chunk if not yed transcoded.
@@ -366,19 +778,27 @@ class ResumableStrategy(Strategy):
         :return: resulting chunk metadata.
         """
         f = self.metadata_file(self.results.file(filename))
-        if self.ws.exists(f):
+        data = self.read_checkpoint(f)
+        if data is not None:
             self.logger.debug("Skip %s, using metadata from %s", filename, f)
-            content = self.ws.read(f)
-            data = json.loads(content)
             meta = metadata.Metadata.from_native(data)
-            return meta
+        else:
+            meta = self._process_segment(filename)
+            # noinspection PyTypeChecker
+            self.write_checkpoint(f, asdict(meta))
+        self.segment_done(filename)
+        return meta
 
-        meta = self._process_segment(filename)
+    def segment_done(self, filename: str) -> None:
+        """
+        Reports chunk transcoding completion.
 
-        # noinspection PyTypeChecker
-        content = json.dumps(asdict(meta))
-        self.ws.write(f, content)
-        return meta
+        :param filename: chunk filename
+        """
+        if self.tracker is not None:
+            self.tracker.chunk_done()
+        if self.progressive:
+            self.publish_playlists(self.get_finished_segments())
 
     def _process_segment(self, filename: str) -> metadata.Metadata:
         """
@@ -389,14 +809,145 @@ class ResumableStrategy(Strategy):
         self.logger.debug("Processing %s", filename)
         src = self.sources.file(filename)
         meta = self.get_segment_meta(src)
+        if defaults.VIDEO_DIRECT_HLS:
+            return self._process_segment_hls(filename, meta)
         dst = self.results.file(filename)
         transcode = transcoder.Transcoder(
-            self.ws.get_absolute_uri(src).geturl(),
-            self.ws.get_absolute_uri(dst).geturl(),
+            self.ws.get_input_uri(src).geturl(),
+            self.ws.get_output_uri(dst).geturl(),
             profile=self.profile,
             meta=meta,
+            progress=self.get_progress_callback(filename, 'transcode'),
         )
-        meta = transcode()
+        with self.measure('transcode') as stats:
+            meta = transcode()
+            stats.add_progress(transcode.last_progress)
+        self.ws.commit(dst)
+        meta = replace(meta, uri=self.ws.get_absolute_uri(dst).geturl())
+        self.logger.debug("Transcoded: %s", meta)
+        return meta
+
+    def _process_segment_hls(self, filename: str, meta: metadata.Metadata,
+                             ) -> metadata.Metadata:
+        """
+        Runs transcoding process on a source chunk writing HLS segments
+        directly to result storage.
+
+        :param filename: chunk filename
+        :param meta: source chunk metadata.
+        :return: resulting chunk metadata.
+        """
+        src = self.sources.file(filename)
+        stem = os.path.splitext(filename)[0]
+        segments = self.store.root.file(f'segment-%v-{stem}-%05d.ts')
+        playlist = self.chunk_playlist_file(filename)
+        transcode = transcoder.HLSTranscoder(
+            self.ws.get_input_uri(src).geturl(),
+            self.ws.get_output_uri(playlist).geturl(),
+            segments=self.store.get_output_uri(segments).geturl(),
+            profile=self.profile,
+            meta=meta,
+            progress=self.get_progress_callback(filename, 'transcode'),
+        )
+        with self.measure('transcode') as stats:
+            meta = transcode()
+            stats.add_progress(transcode.last_progress)
+        # Segments must be stored before they are listed in playlists
+        self.store.commit(segments)
+        self.ws.commit(playlist)
+        self.logger.debug("Transcoded: %s", meta)
+        return meta
+
+    @contextmanager
+    def audio_stage(self) -> Iterator[None]:
+        """
+        Transcodes audio tracks in a background thread while video chunks
+        are processed, if audio pre-encoding is enabled.
+        """
+        if not self.preencode_audio:
+            yield
+            return
+        pool = WorkerPool(max_workers=1, thread_name_prefix='audio')
+        try:
+            audio = pool.submit(self.process_audio)
+            yield
+            audio.result()
+        finally:
+            pool.shutdown()
+
+    def process_audio(self) -> metadata.Metadata:
+        """
+        Transcodes source audio to profile audio tracks if not yet transcoded.
+
+        Skips transcoding if resulting audio metadata exists on shared webdav.
+        :return: resulting audio metadata.
+        """
+        f = self.metadata_file(self.audio_result_file)
+        data = self.read_checkpoint(f)
+        if data is not None:
+            self.logger.debug("Skip audio, using metadata from %s", f)
+            return metadata.Metadata.from_native(data)
+
+        meta = self._process_audio()
+
+        # noinspection PyTypeChecker
+        self.write_checkpoint(f, asdict(meta))
+        return meta
+
+    def _process_audio(self) -> metadata.Metadata:
+        """
+        Runs transcoding process on source audio.
+        :return: resulting audio metadata.
+        """
+        self.logger.debug("Processing audio")
+        data = self.read_checkpoint(self.split_metadata)
+        if data is None:  # pragma: no cover
+            raise RuntimeError("Source not split")
+        src = metadata.Metadata.from_native(data)
+        if defaults.VIDEO_DIRECT_HLS:
+            return self._process_audio_hls(src)
+        dst = self.audio_result_file
+        transcode = transcoder.AudioTranscoder(
+            self.ws.get_input_uri(self.audio_file).geturl(),
+            self.ws.get_output_uri(dst).geturl(),
+            profile=self.profile,
+            meta=src,
+            progress=self.get_progress_callback('audio'),
+        )
+        with self.measure('audio') as stats:
+            meta = transcode()
+            stats.add_progress(transcode.last_progress)
+        self.ws.commit(dst)
+        meta = replace(meta, uri=self.ws.get_absolute_uri(dst).geturl())
+        self.logger.debug("Transcoded: %s", meta)
+        return meta
+
+    def _process_audio_hls(self, src: metadata.Metadata
+                           ) -> metadata.Metadata:
+        """
+        Runs transcoding process on source audio writing HLS segments
+        directly to result storage.
+
+        :param src: split source metadata.
+        :return: resulting audio metadata.
+        """
+        playlist = self.store.root.file('playlist-%v.m3u8')
+        segments = self.store.root.file('segment-%v-%05d.ts')
+        transcode = transcoder.HLSAudioTranscoder(
+            self.ws.get_input_uri(self.audio_file).geturl(),
+            self.store.get_output_uri(playlist).geturl(),
+            segments=self.store.get_output_uri(segments).geturl(),
+            # ffmpeg writes VOD playlist only when audio is finished
+            playlist_type='event' if self.progressive else 'vod',
+            profile=self.profile,
+            meta=src,
+            progress=self.get_progress_callback('audio'),
+        )
+        with self.measure('audio') as stats:
+            meta = transcode()
+            stats.add_progress(transcode.last_progress)
+        self.store.commit(segments)
+        self.store.commit(playlist)
         self.logger.debug("Transcoded: %s", meta)
         return meta
 
@@ -410,34 +961,403 @@ class ResumableStrategy(Strategy):
         :param meta: resulting file metadata.
         :return: resulting file metadata.
         """
-        src = self.write_concat_file(segments)
-        dst = self.manifest_uri
+        self.report(stage='merge')
+        if defaults.VIDEO_DIRECT_HLS:
+            return self.merge_playlists(segments, meta)
+        src, safe_concat = self.write_concat_file(segments)
+        manifest = self.store.root.file('index.m3u8')
+        dst = self.store.get_output_uri(manifest).geturl()
         self.logger.debug("Segmenting %s to %s", src, dst)
-        audio = self.ws.get_absolute_uri(self.audio_file).geturl()
+        copy_audio = defaults.VIDEO_AUDIO_PREENCODE
+        if copy_audio:
+            # Audio tracks are already encoded, just copy them
+            audio_meta = self.process_audio()
+            meta = replace(meta, audios=audio_meta.audios)
+            audio = self.ws.get_input_uri(self.audio_result_file).geturl()
+        else:
+            audio = self.ws.get_input_uri(self.audio_file).geturl()
         segment = transcoder.Segmentor(
             video_source=src,
             audio_source=audio,
             dst=dst,
             profile=self.profile,
             meta=meta,
+            copy_audio=copy_audio,
+            safe_concat=safe_concat,
+            progress=self.get_progress_callback('merge'),
         )
-        result = segment()
+        with self.measure('merge') as stats:
+            result = segment()
+            stats.add_progress(segment.last_progress)
+            self.commit_segmentor_outputs(manifest)
+            result = replace(result, uri=self.manifest_uri)
+            if self.profile.container.format == profiles.FMP4:
+                self.write_dash_manifest(result)
         return result
 
-    def write_concat_file(self, segments: List[str]) -> str:
+    def commit_segmentor_outputs(self, manifest: workspace.File) -> None:
+        """
+        Commits HLS files written by Segmentor to result storage.
+
+        :param manifest: master playlist file.
+        """
+        container = self.profile.container
+        ext = 'm4s' if container.format == profiles.FMP4 else 'ts'
+        if container.single_file:
+            names = [f'segment-%v.{ext}']
+        else:
+            names = [f'segment-%v-%05d.{ext}']
+        if container.format == profiles.FMP4:
+            names.append('init-%v.mp4')
+        names.append('playlist-%v.m3u8')
+        for name in names:
+            self.store.commit(self.store.root.file(name))
+        # Master playlist is committed last to refer to existing media
+        self.store.commit(manifest)
+
+    def write_dash_manifest(self, meta: metadata.Metadata) -> None:
+        """
+        Writes DASH manifest for fMP4 segments written by Segmentor.
+
+        :param meta: resulting file metadata.
+        """
+        # Segmentor variants are audio tracks followed by video tracks for
+        # each audio group; DASH manifest refers to the first group only.
+        audios = len(self.profile.audio)
+        playlists = []
+        for i in range(audios + len(self.profile.video)):
+            f = self.store.root.file(f'playlist-{i}.m3u8')
+            playlists.append(m3u8.MediaPlaylist.loads(self.store.read(f)))
+        content = mpd.manifest(self.profile, meta,
+                               videos=playlists[audios:],
+                               audios=playlists[:audios])
+        self.store.write(self.store.root.file('index.mpd'), content)
+
+    def merge_playlists(self,
+                        segments: List[str],
+                        meta: metadata.Metadata,
+                        ) -> metadata.Metadata:
+        """
+        Joins HLS playlists of transcoded chunks to media playlists and
+        writes master playlist, media segments are not read at all.
+
+        :param segments: list of chunk filenames.
+        :param meta: resulting file metadata.
+        :return: resulting file metadata.
+        """
+        audio_meta = self.process_audio()
+        with self.measure('merge'):
+            for i in range(len(self.profile.video)):
+                variant = f'v{i}'
+                playlist = m3u8.MediaPlaylist.join(
+                    m3u8.MediaPlaylist.loads(
+                        self.ws.read(self.chunk_playlist_file(fn, variant)))
+                    for fn in segments)
+                if self.progressive:
+                    # Published EVENT playlist keeps its target duration
+                    # when it is finalized to VOD.
+                    playlist.fixed_target_duration = max(
+                        playlist.target_duration, self.event_target_duration)
+                f = self.store.root.file(f'playlist-{variant}.m3u8')
+                self.store.write(f, playlist.dumps())
+            # Bitrate hints are used for BANDWIDTH tags as in Segmentor
+            videos = [replace(v, bitrate=t.max_rate)
+                      for v, t in zip(meta.videos, self.profile.video)]
+            meta = replace(meta, uri=self.manifest_uri, videos=videos,
+                           audios=audio_meta.audios)
+            if self.progressive:
+                # Playable audio playlists are written as EVENT ones
+                for i in range(len(self.profile.audio)):
+                    f = self.store.root.file(f'playlist-a{i}.m3u8')
+                    playlist = m3u8.MediaPlaylist.loads(self.store.read(f))
+                    playlist.playlist_type = 'VOD'
+                    self.store.write(f, playlist.dumps())
+            master = m3u8.MasterPlaylist.from_profile(self.profile, meta)
+            self.store.write(self.store.root.file('index.m3u8'),
+                             master.dumps())
+        return meta
+
+    @property
+    def event_target_duration(self) -> int:
+        """
+        :return: target duration for progressively published playlists, it
+            is fixed before all segments are known.
+        """
+        # ffmpeg hls_time default is 2 seconds
+        duration = self.profile.container.segment_duration or 2.0
+        # Segments are cut at keyframes and may be a bit longer.
+        return math.ceil(duration) + 1
+
+    def publish_playlists(self, segments: List[str]) -> None:
+        """
+        Appends transcoded chunks to EVENT media playlists at result storage,
+        so video is playable before it is processed. Playlists are finalized
+        to VOD by merge_playlists.
+
+        EVENT playlists may only be appended, so chunks are published in
+        order, up to the first chunk not transcoded yet. Playlists are
+        modified by tasks running at different hosts, so publishing is
+        serialized with lock_publishing to never overwrite a playlist with
+        an older one. Publishing errors are not worth failing transcoding
+        for.
+
+        :param segments: list of chunk filenames known so far.
+        """
+        lock = self.lock_publishing or nullcontext
+        try:
+            with self.publish_lock, lock():
+                self._publish_playlists(segments)
+        except Exception as e:
+            self.logger.warning("Can't publish playlists: %r", e)
+
+    def _publish_playlists(self, segments: List[str]) -> None:
+        playlists = []
+        for i in range(len(self.profile.video)):
+            f = self.store.root.file(f'playlist-v{i}.m3u8')
+            if self.store.exists(f):
+                playlist = m3u8.MediaPlaylist.loads(self.store.read(f))
+            else:
+                playlist = m3u8.MediaPlaylist(
+                    playlist_type='EVENT',
+                    ended=False,
+                    fixed_target_duration=self.event_target_duration)
+            playlists.append(playlist)
+        # Chunk segments are named segment-v0-<chunk>-00000.ts
+        published = {s.uri.rsplit('-', 1)[0] for s in playlists[0].segments}
+        first_meta = None
+        added = 0
+        for fn in segments:
+            stem = os.path.splitext(fn)[0]
+            if f'segment-v0-{stem}' in published:
+                continue
+            data = self.read_checkpoint(self.metadata_file(
+                self.results.file(fn)))
+            if data is None:
+                break
+            if first_meta is None:
+                first_meta = metadata.Metadata.from_native(data)
+            for i, playlist in enumerate(playlists):
+                f = self.chunk_playlist_file(fn, f'v{i}')
+                chunk = m3u8.MediaPlaylist.loads(self.ws.read(f))
+                chunk.fixed_target_duration = None
+                if chunk.target_duration > playlist.target_duration:
+                    self.logger.warning("Segment of %s exceeds target "
+                                        "duration %s", fn,
+                                        playlist.target_duration)
+                playlist.segments.extend(chunk.segments)
+            added += 1
+        if not added:
+            return
+        self.logger.debug("Publishing %s chunks", added)
+        for i, playlist in enumerate(playlists):
+            f = self.store.root.file(f'playlist-v{i}.m3u8')
+            self.store.write(f, playlist.dumps())
+        if published or first_meta is None:
+            return
+        # First chunk is published, master playlist refers to audio
+        # playlists updated by ffmpeg while audio is transcoded.
+        master = m3u8.MasterPlaylist.from_profile(self.profile, first_meta)
+        self.store.write(self.store.root.file('index.m3u8'), master.dumps())
+        if self.on_publish is not None:
+            self.on_publish()
+
+    def write_concat_file(self, segments: List[str]) -> Tuple[str, bool]:
         """
         Writes ffconcat file to a shared collection
         :param segments: segments list
-        :return: uri for ffconcat file
+        :return: uri for ffconcat file and a flag that all files are listed
+            with relative names.
         """
         concat = ['ffconcat version 1.0']
+        safe = True
         for fn in segments:
-            concat.append(f"file '{fn}'")
+            f = self.results.file(fn)
+            uri = self.ws.get_input_uri(f)
+            if uri == self.ws.get_absolute_uri(f):
+                concat.append(f"file '{fn}'")
+            else:
+                # chunk is read from local cache
+                concat.append(f"file '{uri.geturl()}'")
+                safe = False
         f = self.results.file('concat.ffconcat')
         self.ws.write(f, '\n'.join(concat))
-        return self.ws.get_absolute_uri(f).geturl()
+        return self.ws.get_input_uri(f).geturl(), safe
 
     def get_segment_meta(self, src: workspace.File) -> metadata.Metadata:
-        segment_uri = self.ws.get_absolute_uri(src).geturl()
-        segment = extract.VideoSegmentExtractor().get_meta_data(segment_uri)
+        segment_uri = self.ws.get_input_uri(src).geturl()
+        with self.measure('probe'):
+            segment = extract.VideoSegmentExtractor().get_meta_data(
+                segment_uri)
         return segment
+
+
+class DistributedStrategy(ResumableStrategy):
+    """
+    Transcoding strategy implementation with chunks transcoded at multiple
+    hosts.
+
+    Source file is analyzed and split to chunks at shared webdav by the worker
+    that started processing. Chunks are then transcoded by separate tasks,
+    and results are merged by a callback after every chunk is transcoded.
+    """
+
+    def __init__(self,
+                 source_uri: str,
+                 basename: str,
+                 preset: profiles.Preset,
+                 fan_out: Optional[FanOut] = None,
+                 tracker: Optional[progress.ProgressTracker] = None,
+                 on_publish: Optional[Publish] = None,
+                 lock_publishing: Optional[PublishLock] = None,
+                 ) -> None:
+        """
+        :param fan_out: a callback that schedules chunks transcoding.
+        """
+        super().__init__(source_uri, basename, preset, tracker,
+                         on_publish=on_publish,
+                         lock_publishing=lock_publishing)
+        self.fan_out = fan_out
+        # Cached file names for temporary collections, see checkpoint_exists
+        self.listings: Dict[Tuple[str, ...], Set[str]] = {}
+        self.listings_lock = threading.Lock()
+
+    def process(self) -> Optional[metadata.Metadata]:
+        if self.fan_out is None:  # pragma: no cover
+            raise RuntimeError("fan_out callback not set")
+        segments = self.prepare()
+        self.report(stage='transcode', chunks=len(segments), done=0)
+        self.fan_out(segments)
+        # Processing is continued by chunk tasks.
+        return None
+
+    def cleanup(self, is_error: bool) -> None:
+        if is_error:
+            super().cleanup(is_error=True)
+        # Shared files are still needed by chunk tasks, they are removed
+        # after merge in finalize.
+
+    def restore(self) -> None:
+        """
+        Restores collections and selected profile from shared webdav.
+        """
+        self.sources = self.ws.root.collection('sources')
+        self.results = self.ws.root.collection('results')
+        data = self.read_checkpoint(self.profile_file)
+        if data is None:
+            raise RuntimeError("Profile not selected")
+        self.profile = profiles.Profile.from_native(data)
+
+    def read_checkpoint(self, f: workspace.File) -> Optional[Any]:
+        """
+        Reads results checkpoint from a separate file because results are
+        written by multiple chunk tasks simultaneously.
+        """
+        if f.parent != self.results:
+            return super().read_checkpoint(f)
+        if not self.checkpoint_exists(f):
+            return None
+        content = self.ws.read(f)
+        return json.loads(content)
+
+    def write_checkpoint(self, f: workspace.File, data: Any) -> None:
+        """
+        Writes results checkpoint to a separate file and updates listing
+        cache.
+        """
+        if f.parent != self.results:
+            return super().write_checkpoint(f, data)
+        self.ws.write(f, json.dumps(data))
+        with self.listings_lock:
+            names = self.listings.get(self.results.parts)
+            if names is not None:
+                names.add(f.basename)
+
+    def checkpoint_exists(self, f: workspace.File) -> bool:
+        """
+        Checks whether a checkpoint file exists in temporary workspace.
+
+        Parent collection is listed once and file names are cached, so
+        resuming doesn't cost a request for each chunk checkpoint.
+
+        :param f: checkpoint file.
+        :return: True if file exists.
+        """
+        parent = f.parent
+        if parent is None:  # pragma: no cover
+            return self.ws.exists(f)
+        with self.listings_lock:
+            names = self.listings.get(parent.parts)
+            if names is None:
+                names = {r.basename for r in self.ws.list_collection(parent)}
+                self.listings[parent.parts] = names
+            return f.basename in names
+
+    def transcode_segment(self, filename: str) -> metadata.Metadata:
+        """
+        Transcodes a single chunk from a chunk task.
+
+        :param filename: chunk filename
+        :return: resulting chunk metadata.
+        """
+        self.restore()
+        meta = self.process_segment(filename)
+        if self.tracker is not None:
+            self.tracker.update(done=self.count_finished_segments())
+        if self.progressive:
+            # Chunks finished by other tasks are not in cached listing
+            with self.listings_lock:
+                self.listings.pop(self.results.parts, None)
+            self.publish_playlists(self.get_segment_list())
+        return meta
+
+    def segment_done(self, filename: str) -> None:
+        """
+        Chunks are transcoded by multiple tasks, so finished chunks are
+        counted at shared webdav instead, see count_finished_segments.
+        """
+
+    def count_finished_segments(self) -> int:
+        """
+        Counts chunks transcoded by all chunk tasks.
+
+        :return: number of chunk metadata files at shared webdav.
+        """
+        audio = self.metadata_file(self.audio_result_file).basename
+        return sum(1 for r in self.ws.list_collection(self.results)
+                   if r.basename.endswith('.json') and r.basename != audio)
+
+    def transcode_audio(self) -> metadata.Metadata:
+        """
+        Transcodes audio tracks from an audio task.
+
+        :return: resulting audio metadata.
+        """
+        self.restore()
+        return self.process_audio()
+
+    def finalize(self) -> metadata.Metadata:
+        """
+        Merges transcoded chunks after every chunk metadata is stored at
+        shared webdav.
+
+        :return: resulting file metadata.
+        """
+        self.restore()
+        segments = self.get_segment_list()
+        result_meta: Optional[metadata.Metadata] = None
+        try:
+            for fn in segments:
+                f = self.metadata_file(self.results.file(fn))
+                if not self.checkpoint_exists(f):
+                    raise RuntimeError(f"Segment not transcoded: {fn}")
+                segment_meta = self.process_segment(fn)
+                result_meta = self.merge_metadata(result_meta, segment_meta)
+            if result_meta is None:  # pragma: no cover
+                raise RuntimeError("no segments")
+
+            result = self.merge(segments, meta=result_meta)
+        except Exception:
+            self.cleanup(is_error=True)
+            raise
+        super().cleanup(is_error=False)
+        return result
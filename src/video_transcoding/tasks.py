@@ -1,7 +1,11 @@
 import dataclasses
 import time
+from contextlib import contextmanager
 from datetime import timedelta, datetime
-from typing import Optional, List, Iterable, Any, Dict, Union
+from functools import partial
+from typing import (
+    Optional, List, Iterable, Any, Dict, Union, Callable, Iterator,
+)
 from uuid import UUID, uuid4
 
 import celery
@@ -10,15 +14,25 @@ from django.db import close_old_connections
 from django.db.transaction import atomic
 from django.db.utils import OperationalError
 
-from video_transcoding import models, strategy, defaults
+from video_transcoding import (
+    models,
+    strategy,
+    defaults,
+    presets,
+    progress,
+    metrics,
+)
 from video_transcoding.celery import app
-from video_transcoding.transcoding import profiles
+from video_transcoding.transcoding import profiles, metadata, extract
 from video_transcoding.utils import LoggerMixin
 
 Video = models.get_video_model()
 
 DESTINATION_FILENAME = '{basename}.mp4'
 
+RESUMABLE = 'resumable'
+DISTRIBUTED = 'distributed'
+
 CONNECT_TIMEOUT = 1
 DOWNLOAD_TIMEOUT = 60 * 60
 UPLOAD_TIMEOUT = 60 * 60
@@ -56,6 +70,9 @@ class TranscodeVideo(LoggerMixin, celery.Task):
         3. Changes video status to DONE, stores result basename
         4. On errors changes video status ERROR, stores error message
 
+        For distributed strategy chunks are transcoded by separate tasks and
+        video status is changed by MergeSegments callback.
+
         :param video_id: Video id.
         """
         status = Video.DONE
@@ -63,7 +80,13 @@ class TranscodeVideo(LoggerMixin, celery.Task):
         video = self.lock_video(video_id)
         try:
             meta = self.process_video(video)
-            duration = timedelta(seconds=meta['duration'])
+            if meta is not None:
+                duration = timedelta(seconds=meta['duration'])
+            elif self.distributed:
+                # Video is still processed by chunk tasks
+                status = Video.PROCESS
+            else:
+                raise RuntimeError("No result metadata")
         except SoftTimeLimitExceeded as e:
             self.logger.debug("Received SIGUSR1, return video to queue")
             # celery graceful shutdown
@@ -77,14 +100,24 @@ class TranscodeVideo(LoggerMixin, celery.Task):
         finally:
             # Close possible stale connections after long operation
             close_old_connections()
-            self.unlock_video(video_id, status, error, meta, duration)
+            if status != Video.PROCESS:
+                self.unlock_video(video_id, status, error, meta, duration)
         return error
 
-    def select_for_update(self, video_id: int, status: int) -> models.Video:
+    @property
+    def distributed(self) -> bool:
+        """
+        :returns: True if video chunks are transcoded by separate tasks.
+        """
+        return defaults.VIDEO_TRANSCODING_STRATEGY == DISTRIBUTED
+
+    def select_for_update(self, video_id: int, status: int,
+                          task_id: Optional[str] = None) -> models.Video:
         """ Lock video in DB for current task.
 
         :param video_id: Video primary key
         :param status: expected video status
+        :param task_id: expected task id (current task by default)
         :returns: Video object from db
 
         :raises models.Video.DoesNotExist: in case of missing or locked
@@ -99,7 +132,7 @@ class TranscodeVideo(LoggerMixin, celery.Task):
             self.logger.error("Can't lock video %s", video_id)
             raise
 
-        if video.task_id != UUID(self.request.id):
+        if video.task_id != UUID(task_id or self.request.id):
             self.logger.error("Unexpected video %s task_id %s",
                               video.id, video.task_id)
             raise ValueError(video.task_id)
@@ -129,12 +162,14 @@ class TranscodeVideo(LoggerMixin, celery.Task):
             raise self.retry(exc=e)
         if video.basename is None:
             video.basename = uuid4()
-        video.change_status(Video.PROCESS, basename=video.basename)
+        video.change_status(Video.PROCESS, basename=video.basename,
+                            progress=None, published=False)
         return video
 
     @atomic
     def unlock_video(self, video_id: int, status: int, error: Optional[str],
                      meta: Optional[dict], duration: Optional[timedelta],
+                     task_id: Optional[str] = None,
                      ) -> None:
         """
         Marks video with final status.
@@ -144,24 +179,30 @@ class TranscodeVideo(LoggerMixin, celery.Task):
         :param error: error message
         :param meta: resulting media metadata
         :param duration: media duration
+        :param task_id: task that locked the video (current task by default)
         :raises RuntimeError: in case of unexpected video status or task id
         """
         try:
-            video = self.select_for_update(video_id, Video.PROCESS)
+            video = self.select_for_update(video_id, Video.PROCESS, task_id)
         except (Video.DoesNotExist, ValueError) as e:
             # if video is locked or task_id differs from current task, do
             # nothing because video is modified somewhere else.
             raise RuntimeError("Can't unlock locked video %s: %s",
                                video_id, repr(e))
 
+        # Partial stream is either finalized or removed
         video.change_status(status,
                             error=error,
                             metadata=meta,
-                            duration=duration)
+                            duration=duration,
+                            published=False)
 
-    def process_video(self, video: models.Video) -> dict:
+    def process_video(self, video: models.Video) -> Optional[dict]:
         """
         Makes an HLS adaptation set from video source.
+
+        :returns: resulting media metadata or None if video is transcoded by
+            chunk tasks.
         """
         preset = self.init_preset(video.preset)
         basename = video.basename
@@ -171,9 +212,27 @@ class TranscodeVideo(LoggerMixin, celery.Task):
             source_uri=video.source,
             basename=basename.hex,
             preset=preset,
+            fan_out=partial(self.fan_out, video.pk),
+            tracker=self.init_tracker(video),
+            on_publish=partial(self.mark_published, video.pk, video.task_id),
+            lock_publishing=partial(self.lock_published, video.pk,
+                                    video.task_id),
         )
         output_meta = s()
+        if output_meta is None:
+            return None
+        return self.get_video_metadata(output_meta, s.stats)
+
+    @staticmethod
+    def get_video_metadata(output_meta: metadata.Metadata,
+                           stats: Iterable[metrics.StageStats] = (),
+                           ) -> dict:
+        """
+        Cleanups internal metadata and computes media duration.
 
+        :param output_meta: resulting media metadata.
+        :param stats: resource usage of pipeline stages.
+        """
         # noinspection PyTypeChecker
         data = dataclasses.asdict(output_meta)
         duration = None
@@ -186,70 +245,330 @@ class TranscodeVideo(LoggerMixin, celery.Task):
             else:
                 duration = min(duration, stream['duration'])
         data['duration'] = duration
+        summary = metrics.summarize(stats)
+        if summary:
+            data['stats'] = summary
 
         return data
 
+    def fan_out(self, video_id: int, segments: List[str]) -> None:
+        """
+        Sends chunk transcoding tasks and merge callback for them.
+
+        :param video_id: Video primary key
+        :param segments: list of chunk filenames.
+        """
+        task_id = self.request.id
+        self.logger.debug("Sending %s chunk tasks for %s",
+                          len(segments), video_id)
+        options = self.get_routing_options()
+        header = [transcode_segment.si(video_id, task_id, fn).set(**options)
+                  for fn in segments]
+        if defaults.VIDEO_AUDIO_PREENCODE or defaults.VIDEO_DIRECT_HLS:
+            header.insert(0, transcode_audio.si(video_id, task_id).set(
+                **options))
+        celery.chord(header)(merge_segments.si(video_id, task_id).set(
+            **options))
+
+    def get_routing_options(self) -> Dict[str, Any]:
+        """
+        Sends subtasks to the same priority queue as current task.
+        """
+        delivery_info = self.request.delivery_info or {}
+        routing_key = delivery_info.get('routing_key')
+        if not routing_key or routing_key == self.routing_key:
+            return {}
+        return {'routing_key': routing_key}
+
     @staticmethod
     def init_strategy(
         source_uri: str,
         basename: str,
-        preset: profiles.Preset
+        preset: profiles.Preset,
+        fan_out: Optional[strategy.FanOut] = None,
+        tracker: Optional[progress.ProgressTracker] = None,
+        on_publish: Optional[strategy.Publish] = None,
+        lock_publishing: Optional[strategy.PublishLock] = None,
     ) -> strategy.Strategy:
+        if defaults.VIDEO_TRANSCODING_STRATEGY == DISTRIBUTED:
+            return strategy.DistributedStrategy(
+                source_uri=source_uri,
+                basename=basename,
+                preset=preset,
+                fan_out=fan_out,
+                tracker=tracker,
+                on_publish=on_publish,
+                lock_publishing=lock_publishing,
+            )
         return strategy.ResumableStrategy(
             source_uri=source_uri,
             basename=basename,
             preset=preset,
+            tracker=tracker,
+            on_publish=on_publish,
+            lock_publishing=lock_publishing,
         )
 
+    @staticmethod
+    def mark_published(video_id: int, task_id: Optional[UUID]) -> None:
+        """
+        Marks video as playable before it is processed.
+
+        :param video_id: Video primary key
+        :param task_id: task that locked the video
+        """
+        # Video row is not locked, so status and task are checked to skip
+        # updates for a video processed by another task.
+        Video.objects.filter(
+            pk=video_id,
+            task_id=task_id,
+            status=Video.PROCESS,
+        ).update(published=True)
+
+    @staticmethod
+    @contextmanager
+    def lock_published(video_id: int, task_id: Optional[UUID]
+                       ) -> Iterator[None]:
+        """
+        Locks video row while playlists are published, so tasks of a video
+        running at different hosts append chunks one by one.
+
+        :param video_id: Video primary key
+        :param task_id: task that locked the video
+        :raises RuntimeError: if video is not processed by task anymore.
+        """
+        with atomic():
+            video = Video.objects.select_for_update().filter(
+                pk=video_id,
+                task_id=task_id,
+                status=Video.PROCESS,
+            ).first()
+            if video is None:
+                raise RuntimeError("Video is not processed by task")
+            yield
+
+    @staticmethod
+    def init_tracker(video: models.Video
+                     ) -> Optional[progress.ProgressTracker]:
+        """
+        Initializes progress tracker for a video if progress reporting is
+        enabled.
+        """
+        if not defaults.VIDEO_PROGRESS_INTERVAL:
+            return None
+        return progress.VideoProgressTracker(
+            video, interval=defaults.VIDEO_PROGRESS_INTERVAL)
+
     @staticmethod
     def init_preset(preset: Optional[models.Preset]) -> profiles.Preset:
         """
-        Initializes preset entity from database objects.
+        Initializes preset entity from database objects or preset cache.
         """
         if preset is None:
             return profiles.DEFAULT_PRESET
-        video_tracks: List[profiles.VideoTrack] = []
-        for vt in preset.video_tracks.all():  # type: models.VideoTrack
-            kwargs = dict(**vt.params)
-            kwargs['id'] = vt.name
-            video_tracks.append(profiles.VideoTrack(**kwargs))
-
-        audio_tracks: List[profiles.AudioTrack] = []
-        for at in preset.audio_tracks.all():  # type: models.AudioTrack
-            kwargs = dict(**at.params)
-            kwargs['id'] = at.name
-            audio_tracks.append(profiles.AudioTrack(**kwargs))
-
-        video_profiles: List[profiles.VideoProfile] = []
-        for vp in preset.video_profiles.all():  # type: models.VideoProfile
-            vc = profiles.VideoCondition(**vp.condition)
-
-            vqs = vp.videoprofiletracks_set.select_related('track')
-            tracks = [vpt.track.name for vpt in vqs]
-            video_profiles.append(profiles.VideoProfile(
-                condition=vc,
-                video=tracks,
-                segment_duration=vp.segment_duration.total_seconds(),
-            ))
-
-        audio_profiles: List[profiles.AudioProfile] = []
-        for ap in preset.audio_profiles.all():  # type: models.AudioProfile
-            ac = profiles.AudioCondition(**ap.condition)
-
-            aqs = ap.audioprofiletracks_set.select_related('track')
-            tracks = [apt.track.name for apt in aqs]
-            audio_profiles.append(profiles.AudioProfile(
-                condition=ac,
-                audio=tracks,
-            ))
-
-        return profiles.Preset(
-            video_profiles=video_profiles,
-            audio_profiles=audio_profiles,
-            video=video_tracks,
-            audio=audio_tracks,
+        cache = presets.get_preset_cache()
+        return cache.get_or_build(preset, presets.load_preset)
+
+
+class VideoSubtask(TranscodeVideo):
+    """ Base class for chunk tasks sent by TranscodeVideo."""
+
+    def get_video(self, video_id: int, task_id: str
+                  ) -> Optional[models.Video]:
+        """
+        Gets video still being processed by parent task.
+
+        :param video_id: Video primary key
+        :param task_id: parent task id
+        :returns: Video object or None if processing has been stopped.
+        """
+        try:
+            return Video.objects.get(pk=video_id,
+                                     task_id=task_id,
+                                     status=Video.PROCESS)
+        except Video.DoesNotExist:
+            self.logger.warning("Video %s is not processed by %s, skip",
+                                video_id, task_id)
+            return None
+
+    @staticmethod
+    def init_tracker(video: models.Video
+                     ) -> Optional[progress.ProgressTracker]:
+        """
+        Initializes progress tracker that merges chunk task progress with
+        other tasks of a video.
+        """
+        if not defaults.VIDEO_PROGRESS_INTERVAL:
+            return None
+        return progress.SubtaskProgressTracker(
+            video, interval=defaults.VIDEO_PROGRESS_INTERVAL)
+
+    def init_subtask_strategy(self, video: models.Video
+                              ) -> strategy.DistributedStrategy:
+        basename = video.basename
+        if basename is None:  # pragma: no cover
+            raise RuntimeError("basename not set")
+        return strategy.DistributedStrategy(
+            source_uri=video.source,
+            basename=basename.hex,
+            preset=self.init_preset(video.preset),
+            tracker=self.init_tracker(video),
+            on_publish=partial(self.mark_published, video.pk, video.task_id),
+            lock_publishing=partial(self.lock_published, video.pk,
+                                    video.task_id),
         )
 
 
+class MediaSubtask(VideoSubtask):
+    """ Base class for tasks transcoding a part of video media."""
+
+    def process_media(self, video_id: int, task_id: str,
+                      transcode: Callable[[strategy.DistributedStrategy],
+                                          Any],
+                      ) -> Optional[str]:
+        """
+        Runs transcoding step with a strategy for a video being processed.
+
+        On errors changes video status to ERROR, so merge callback is skipped.
+
+        :param video_id: Video primary key
+        :param task_id: parent task id
+        :param transcode: transcoding step to run with a strategy.
+        :return: error message if any.
+        """
+        video = self.get_video(video_id, task_id)
+        if video is None:
+            return None
+        try:
+            transcode(self.init_subtask_strategy(video))
+        except SoftTimeLimitExceeded:
+            self.logger.debug("Received SIGUSR1, return chunk to queue")
+            raise self.retry(countdown=10)
+        except Exception as e:
+            error = repr(e)
+            self.logger.exception("Processing error %s", error)
+            close_old_connections()
+            try:
+                self.unlock_video(video_id, Video.ERROR, error, None, None,
+                                  task_id=task_id)
+            except RuntimeError as exc:
+                # Another chunk task has already failed
+                self.logger.warning("Can't mark error: %r", exc)
+            return error
+        return None
+
+
+class TranscodeSegment(MediaSubtask):
+    """ Single chunk transcoding task."""
+
+    def run(self, video_id: int,  # type: ignore[override]
+            task_id: str, filename: str) -> Optional[str]:
+        """
+        Transcodes a single chunk of a video.
+
+        :param video_id: Video primary key
+        :param task_id: parent task id
+        :param filename: chunk filename
+        """
+        return self.process_media(
+            video_id, task_id, lambda s: s.transcode_segment(filename))
+
+
+class TranscodeAudio(MediaSubtask):
+    """ Audio tracks transcoding task."""
+
+    def run(self, video_id: int,  # type: ignore[override]
+            task_id: str) -> Optional[str]:
+        """
+        Transcodes audio tracks of a video.
+
+        :param video_id: Video primary key
+        :param task_id: parent task id
+        """
+        return self.process_media(
+            video_id, task_id, lambda s: s.transcode_audio())
+
+
+class MergeSegments(VideoSubtask):
+    """ Chord callback for chunk transcoding tasks."""
+
+    def run(self, video_id: int,  # type: ignore[override]
+            task_id: str) -> Optional[str]:
+        """
+        Merges transcoded chunks to HLS and marks video with final status.
+
+        :param video_id: Video primary key
+        :param task_id: parent task id
+        """
+        video = self.get_video(video_id, task_id)
+        if video is None:
+            return None
+        status = Video.DONE
+        error = meta = duration = None
+        try:
+            s = self.init_subtask_strategy(video)
+            output_meta = s.finalize()
+            meta = self.get_video_metadata(output_meta, s.stats)
+            duration = timedelta(seconds=meta['duration'])
+        except SoftTimeLimitExceeded:
+            self.logger.debug("Received SIGUSR1, return merge to queue")
+            raise self.retry(countdown=10)
+        except Exception as e:
+            status = Video.ERROR
+            error = repr(e)
+            self.logger.exception("Processing error %s", error)
+        # Close possible stale connections after long operation
+        close_old_connections()
+        self.unlock_video(video_id, status, error, meta, duration,
+                          task_id=task_id)
+        return error
+
+
+class RouteVideo(TranscodeVideo):
+    """ Source analysis task for priority routing."""
+
+    def run(self, video_id: int) -> Optional[str]:
+        """
+        Sends transcoding task to a queue selected by source analysis.
+
+        Source is analyzed here instead of web request that created a video.
+        Transcoding task replaces current task in Video.task_id.
+
+        :param video_id: Video primary key
+        """
+        # helpers module sends tasks defined here
+        from video_transcoding import helpers
+        try:
+            video = Video.objects.get(pk=video_id,
+                                      task_id=self.request.id,
+                                      status=Video.QUEUED)
+        except Video.DoesNotExist:
+            self.logger.warning("Video %s is not queued by %s, skip",
+                                video_id, self.request.id)
+            return None
+        src: Optional[metadata.Metadata] = None
+        try:
+            src = extract.SourceExtractor().get_meta_data(video.source)
+        except Exception as e:
+            # Unknown cost is routed to default queue
+            self.logger.warning("Failed to analyze %s: %r", video.source, e)
+        with atomic():
+            try:
+                video = self.select_for_update(video_id, Video.QUEUED)
+            except (Video.DoesNotExist, ValueError):
+                # video has been sent to transcoding again
+                return None
+            helpers.send_transcode_task(video, src, probe=False)
+        return None
+
+
 transcode_video: TranscodeVideo = app.register_task(
     TranscodeVideo())  # type: ignore
+transcode_segment: TranscodeSegment = app.register_task(
+    TranscodeSegment())  # type: ignore
+transcode_audio: TranscodeAudio = app.register_task(
+    TranscodeAudio())  # type: ignore
+merge_segments: MergeSegments = app.register_task(
+    MergeSegments())  # type: ignore
+route_video: RouteVideo = app.register_task(
+    RouteVideo())  # type: ignore
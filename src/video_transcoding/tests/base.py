@@ -1,3 +1,5 @@
+from datetime import timedelta
+from typing import List
 from unittest import mock
 from urllib.parse import ParseResult, urlparse, urlunparse
 from uuid import uuid4
@@ -6,6 +8,7 @@ from celery.result import AsyncResult
 from django.test import TestCase
 from fffw.graph import VideoMeta, TS, Scene, AudioMeta
 
+from video_transcoding import models
 from video_transcoding.transcoding import profiles, metadata, workspace
 
 
@@ -53,6 +56,52 @@ class ProfileMixin:
         )
 
 
+class PresetMixin:
+    @staticmethod
+    def create_preset(name: str = 'preset') -> models.Preset:
+        p = models.Preset.objects.create(name=name)
+        vt = models.VideoTrack.objects.create(
+            name='v',
+            preset=p,
+            params={
+                'codec': 'libx264',
+                'constant_rate_factor': 23,
+                'preset': 'slow',
+                'max_rate': 1_500_000,
+                'buf_size': 3_000_000,
+                'profile': 'main',
+                'pix_fmt': 'yuv420p',
+                'width': 1920,
+                'height': 1080,
+                'frame_rate': 30.0,
+                'gop_size': 30,
+                'force_key_frames': 'formula'
+            })
+        at = models.AudioTrack.objects.create(
+            name='a',
+            preset=p,
+            params={
+                'codec': 'libfdk_aac',
+                'bitrate': 128_000,
+                'channels': 2,
+                'sample_rate': 44100,
+            }
+        )
+        vp = models.VideoProfile.objects.create(
+            preset=p,
+            segment_duration=timedelta(seconds=1.0),
+            condition={'min_width': 1},
+        )
+        ap = models.AudioProfile.objects.create(
+            preset=p,
+            condition={'min_bitrate': 2},
+        )
+        vp.videoprofiletracks_set.create(track=vt)
+        ap.audioprofiletracks_set.create(track=at)
+        p.refresh_from_db()
+        return p
+
+
 class MetadataMixin:
 
     @staticmethod
@@ -140,6 +189,17 @@ class MemoryWorkspace:
         else:
             return True
 
+    def list_collection(self, c: workspace.Collection
+                        ) -> List[workspace.Resource]:
+        t = self.tree
+        for p in c.parts:
+            try:
+                t = t[p]
+            except KeyError:
+                return []
+        return [c.collection(k) if isinstance(v, dict) else c.file(k)
+                for k, v in t.items()]
+
     def read(self, f: workspace.File) -> str:
         t = self.tree
         for p in f.parts:
@@ -157,3 +217,8 @@ class MemoryWorkspace:
         path = '/'.join(r.parts)
         # noinspection PyArgumentList
         return urlparse(urlunparse(('memory', '', path, '', '', '')))
+
+    get_input_uri = get_output_uri = get_absolute_uri
+
+    def commit(self, f: workspace.File) -> None:
+        pass
@@ -87,6 +87,30 @@ class MKVSegmentAnalyzerTestCase(TestCase):
         self.assertEqual(d, 3_500_000)
 
 
+class AudioResultAnalyzerTestCase(TestCase):
+    def setUp(self):
+        super().setUp()
+        self.info = ProbeInfo(
+            streams=[
+                {'duration': 30.0, 'codec_type': 'audio'},
+                {'codec_type': 'audio'},
+            ],
+            format={
+                'duration': 60.0,
+            }
+        )
+        self.analyzer = analysis.AudioResultAnalyzer(self.info)
+
+    def test_container_duration_normalize(self):
+        d = self.analyzer.get_duration(self.info.streams[0])
+
+        self.assertEqual(d, 30.0)
+
+        d = self.analyzer.get_duration(self.info.streams[1])
+
+        self.assertEqual(d, 60.0)
+
+
 class FFprobeHLSAnalyzerTestCase(TestCase):
     def setUp(self):
         super().setUp()
@@ -1,10 +1,18 @@
 import os
 import signal
-from unittest import mock
+from tempfile import TemporaryDirectory
+from unittest import mock, skipUnless
+
+try:
+    import prometheus_client
+except ImportError:  # pragma: no cover
+    prometheus_client = None
 
 from celery import signals
 from django.test import TestCase
 
+from video_transcoding import defaults, metrics
+
 
 class CelerySignalsTestCase(TestCase):
 
@@ -22,6 +30,31 @@ class CelerySignalsTestCase(TestCase):
         signals.worker_init.send(None)
         m.assert_called_once_with()
 
+    @mock.patch.object(metrics, 'start_exporter')
+    @mock.patch('os.setpgrp')
+    def test_worker_init_metrics_exporter(self, _, m: mock.Mock):
+        """
+        Celery master process exports prometheus metrics if configured.
+        """
+        with mock.patch.object(defaults, 'VIDEO_METRICS_URI', 'statsd://'):
+            signals.worker_init.send(None)
+        m.assert_not_called()
+
+        uri = 'prometheus://0.0.0.0:9100'
+        with mock.patch.object(defaults, 'VIDEO_METRICS_URI', uri):
+            signals.worker_init.send(None)
+        m.assert_called_once_with(uri, mock.ANY)
+
+        app = __import__('video_transcoding.celery').celery.app
+        conn = mock.MagicMock()
+        channel = conn.__enter__.return_value.default_channel
+        channel.queue_declare.return_value.message_count = 3
+        with mock.patch.object(app, 'connection_for_read', return_value=conn):
+            depths = m.call_args.args[1]()
+        queues = [q.name for q in app.conf.task_queues]
+        self.assertEqual(depths, {q: 3 for q in queues})
+        channel.queue_declare.assert_any_call(queue=queues[0], passive=True)
+
     @mock.patch('os.killpg')
     def test_worker_shutting_down_signal(self, m: mock.Mock):
         """
@@ -37,3 +70,19 @@ class CelerySignalsTestCase(TestCase):
             signals.worker_shutting_down.send(None)
         except ProcessLookupError:  # pragma: no cover
             self.fail("exception not handled")
+
+    @skipUnless(prometheus_client, "prometheus_client is not installed")
+    def test_worker_process_shutdown_signal(self):
+        """
+        Metrics of terminated worker process are cleaned up.
+        """
+        with (
+            TemporaryDirectory() as tmp,
+            mock.patch.dict(os.environ, {'PROMETHEUS_MULTIPROC_DIR': tmp}),
+        ):
+            path = os.path.join(tmp, 'gauge_livesum_123.db')
+            open(path, 'wb').close()
+
+            signals.worker_process_shutdown.send(None, pid=123, exitcode=0)
+
+            self.assertFalse(os.path.exists(path))
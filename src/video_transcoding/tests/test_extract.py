@@ -8,7 +8,7 @@ from fffw.analysis import ffprobe
 from fffw.graph import VIDEO, AUDIO
 
 from video_transcoding.tests import base
-from video_transcoding.transcoding import extract
+from video_transcoding.transcoding import extract, probe_cache
 
 
 class ExtractorBaseTestCase(base.MetadataMixin, TestCase):
@@ -45,6 +45,84 @@ class ExtractorBaseTestCase(base.MetadataMixin, TestCase):
         self.ffprobe_patcher.stop()
 
 
+class ExtractorCacheTestCase(TestCase):
+    def setUp(self):
+        super().setUp()
+        self.cache = probe_cache.MemoryProbeCache(max_size=10)
+        self.cache_patcher = mock.patch(
+            'video_transcoding.transcoding.extract.get_probe_cache',
+            return_value=self.cache)
+        self.cache_patcher.start()
+        self.validators_patcher = mock.patch(
+            'video_transcoding.transcoding.extract.get_validators',
+            return_value=(100, 1000))
+        self.validators_mock = self.validators_patcher.start()
+        self.extractor = extract.SourceExtractor()
+
+    def tearDown(self):
+        super().tearDown()
+        self.cache_patcher.stop()
+        self.validators_patcher.stop()
+
+    def test_ffprobe_cached(self):
+        content = json.dumps(asdict(ffprobe.ProbeInfo(streams=[{}],
+                                                      format={})))
+        with mock.patch('video_transcoding.transcoding.extract.FFProbe',
+                        ) as m:
+            m.return_value.run.return_value = (0, content, '')
+            first = self.extractor.ffprobe('uri')
+            second = self.extractor.ffprobe('uri')
+
+            m.assert_called_once()
+            self.assertEqual(first, second)
+
+            # file modified
+            self.validators_mock.return_value = (100, 2000)
+            self.extractor.ffprobe('uri')
+
+            self.assertEqual(m.call_count, 2)
+
+            # file can't be validated
+            self.validators_mock.return_value = None
+            self.extractor.ffprobe('uri')
+            self.extractor.ffprobe('uri')
+
+            self.assertEqual(m.call_count, 4)
+
+    def test_mediainfo_cached(self):
+        extractor = extract.SourceExtractor()
+        with mock.patch('pymediainfo.MediaInfo.parse',
+                        return_value=mock.sentinel.mi) as m:
+            first = extractor.mediainfo('uri')
+            second = extractor.mediainfo('uri')
+
+        m.assert_called_once_with('uri')
+        self.assertEqual(first, mock.sentinel.mi)
+        self.assertEqual(second, mock.sentinel.mi)
+
+    def test_intermediate_files_not_cached(self):
+        extractor = extract.HLSExtractor()
+        with mock.patch('pymediainfo.MediaInfo.parse',
+                        return_value=mock.sentinel.mi) as m:
+            extractor.mediainfo('uri')
+            extractor.mediainfo('uri')
+
+        self.assertEqual(m.call_count, 2)
+        self.validators_mock.assert_not_called()
+
+    def test_cache_disabled(self):
+        with mock.patch(
+                'video_transcoding.transcoding.extract.get_probe_cache',
+                return_value=None):
+            with mock.patch('pymediainfo.MediaInfo.parse',
+                            return_value=mock.sentinel.mi) as m:
+                self.extractor.mediainfo('uri')
+                self.extractor.mediainfo('uri')
+
+        self.assertEqual(m.call_count, 2)
+        self.validators_mock.assert_not_called()
+
+
 class SourceExtractorTestCase(ExtractorBaseTestCase):
     analyzer = 'SourceAnalyzer'
     extractor_class = extract.SourceExtractor
@@ -125,6 +203,22 @@ class VideoResultExtractorTestCase(MKVVideoSegmentTestsMixin,
     extractor_class = extract.VideoResultExtractor
 
 
+class AudioResultExtractorTestCase(ExtractorBaseTestCase):
+    analyzer = 'AudioResultAnalyzer'
+    extractor_class = extract.AudioResultExtractor
+
+    def test_extract(self):
+        # audio results don't contain video streams
+        self.meta.videos.clear()
+        self.analyze_mock.return_value = [s.meta for s in self.meta.streams]
+
+        meta = self.extractor.get_meta_data('uri')
+
+        self.analyzer_mock.assert_called_once_with(mock.sentinel.ffprobe)
+        self.analyze_mock.assert_called_once_with()
+        self.assertEqual(meta, self.meta)
+
+
 class SplitExtractorTestCase(ExtractorBaseTestCase):
     analyzer = 'MKVPlaylistAnalyzer'
 
@@ -0,0 +1,86 @@
+from unittest import TestCase, mock
+
+from video_transcoding.transcoding import keyframes
+
+
+def make_packets(gops):
+    """
+    :param gops: a list of (duration, frame size) for each GOP at 10 fps.
+    """
+    packets = []
+    pts = 0.0
+    for duration, size in gops:
+        for i in range(round(duration * 10)):
+            packets.append(keyframes.Packet(pts=round(pts, 3), size=size,
+                                            keyframe=i == 0))
+            pts += 0.1
+    return packets
+
+
+class KeyframePlannerTestCase(TestCase):
+    def setUp(self):
+        super().setUp()
+        self.planner = keyframes.KeyframePlanner(chunk_duration=10)
+
+    def test_parse_packet(self):
+        self.assertEqual(keyframes.parse_packet('1.500000,1024,K__\n'),
+                         keyframes.Packet(pts=1.5, size=1024, keyframe=True))
+        self.assertEqual(keyframes.parse_packet('1.600000,512,__,\n'),
+                         keyframes.Packet(pts=1.6, size=512, keyframe=False))
+        self.assertIsNone(keyframes.parse_packet('N/A,512,__\n'))
+        self.assertIsNone(keyframes.parse_packet('side_data\n'))
+
+    def test_plan_even(self):
+        packets = make_packets([(2, 100)] * 20)
+
+        self.assertEqual(self.planner.plan(packets), [10.0, 20.0, 30.0])
+
+    def test_plan_sparse_keyframes(self):
+        """
+        Split points are chosen among existing keyframes only.
+        """
+        packets = make_packets([(1, 100), (14, 100), (1, 100), (14, 100)])
+
+        self.assertEqual(self.planner.plan(packets), [15.0])
+
+    def test_plan_complexity(self):
+        """
+        Complex scenes with large frames are split to shorter chunks.
+        """
+        packets = make_packets([(2, 300)] * 5 + [(2, 100)] * 10)
+
+        result = self.planner.plan(packets)
+
+        self.assertEqual(len(result), 2)
+        self.assertLess(result[0], 10.0)
+
+    def test_plan_short(self):
+        self.assertEqual(self.planner.plan([]), [])
+        self.assertEqual(self.planner.plan(make_packets([(2, 100)] * 7)), [])
+
+    def test_probe(self):
+        output = '\n'.join([
+            '0.000000,1000,K__',
+            '0.100000,100,___',
+            'N/A,100,___',
+            '0.080000,100,___',
+        ])
+        with mock.patch('video_transcoding.transcoding.keyframes.FFProbe',
+                        autospec=True) as m:
+            m.return_value.run.return_value = (0, output, '')
+
+            result = self.planner.probe('http://storage/src.mp4')
+
+        m.assert_called_once_with(
+            'http://storage/src.mp4',
+            select_streams='v:0',
+            show_entries='packet=pts_time,size,flags',
+            output_format='csv=p=0')
+        m.return_value.run.assert_called_once_with(timeout=600.0)
+        self.assertEqual([p.pts for p in result], [0.0, 0.1, 0.08])
+
+        with mock.patch('video_transcoding.transcoding.keyframes.FFProbe',
+                        autospec=True) as m:
+            m.return_value.run.return_value = (1, '', 'error')
+            with self.assertRaises(RuntimeError):
+                self.planner.probe('http://storage/src.mp4')
@@ -0,0 +1,198 @@
+from dataclasses import replace
+
+from django.test import TestCase
+
+from video_transcoding.tests import base
+from video_transcoding.transcoding import m3u8
+
+
+class MediaPlaylistTestCase(TestCase):
+    def test_join(self):
+        first = '\n'.join([
+            '#EXTM3U',
+            '#EXT-X-VERSION:3',
+            '#EXT-X-TARGETDURATION:4',
+            '#EXT-X-MEDIA-SEQUENCE:0',
+            '#EXT-X-PLAYLIST-TYPE:VOD',
+            '#EXTINF:4.000000,',
+            'segment-v0-s1-00000.ts',
+            '#EXTINF:2.500000,',
+            'segment-v0-s1-00001.ts',
+            '#EXT-X-ENDLIST',
+        ])
+        second = '\n'.join([
+            '#EXTM3U',
+            '#EXTINF:4.200000,',
+            'segment-v0-s2-00000.ts',
+            '#EXT-X-ENDLIST',
+        ])
+
+        result = m3u8.MediaPlaylist.join(
+            m3u8.MediaPlaylist.loads(c) for c in (first, second))
+
+        self.assertEqual(result.target_duration, 5)
+        self.assertAlmostEqual(result.duration, 10.7)
+        self.assertEqual(result.dumps(), '\n'.join([
+            '#EXTM3U',
+            '#EXT-X-VERSION:3',
+            '#EXT-X-TARGETDURATION:5',
+            '#EXT-X-MEDIA-SEQUENCE:0',
+            '#EXT-X-PLAYLIST-TYPE:VOD',
+            '#EXTINF:4.000000,',
+            'segment-v0-s1-00000.ts',
+            '#EXTINF:2.500000,',
+            'segment-v0-s1-00001.ts',
+            '#EXTINF:4.200000,',
+            'segment-v0-s2-00000.ts',
+            '#EXT-X-ENDLIST',
+            '',
+        ]))
+
+    def test_loads_dumps(self):
+        playlist = m3u8.MediaPlaylist(
+            segments=[m3u8.Segment(uri='s1.ts', duration=2.0)],
+            playlist_type='EVENT',
+            media_sequence=3,
+            ended=False,
+            fixed_target_duration=5,
+        )
+
+        content = playlist.dumps()
+
+        self.assertNotIn('#EXT-X-ENDLIST', content)
+        self.assertIn('#EXT-X-PLAYLIST-TYPE:EVENT\n', content)
+        self.assertEqual(m3u8.MediaPlaylist.loads(content), playlist)
+
+    def test_fixed_target_duration(self):
+        playlist = m3u8.MediaPlaylist(playlist_type='EVENT', ended=False,
+                                      fixed_target_duration=5)
+        playlist.segments.append(m3u8.Segment(uri='s1.ts', duration=2.0))
+
+        content = playlist.dumps()
+
+        self.assertIn('#EXT-X-TARGETDURATION:5\n', content)
+        loaded = m3u8.MediaPlaylist.loads(content)
+        loaded.segments.append(m3u8.Segment(uri='s2.ts', duration=4.2))
+        self.assertEqual(loaded.target_duration, 5)
+
+    def test_byterange(self):
+        content = '\n'.join([
+            '#EXTM3U',
+            '#EXT-X-VERSION:4',
+            '#EXT-X-MAP:URI="segment-0.m4s",BYTERANGE="800@0"',
+            '#EXTINF:4.000000,',
+            '#EXT-X-BYTERANGE:1000@800',
+            'segment-0.m4s',
+            '#EXTINF:4.000000,',
+            '#EXT-X-BYTERANGE:500',
+            'segment-0.m4s',
+            '#EXT-X-ENDLIST',
+        ])
+
+        playlist = m3u8.MediaPlaylist.loads(content)
+
+        self.assertEqual(playlist.map_byterange, (800, 0))
+        self.assertEqual([s.byterange for s in playlist.segments],
+                         [(1000, 800), (500, 1800)])
+
+        playlist.version = 3
+        result = playlist.dumps()
+
+        self.assertIn('#EXT-X-VERSION:4\n', result)
+        self.assertIn('#EXT-X-MAP:URI="segment-0.m4s",BYTERANGE="800@0"\n',
+                      result)
+        self.assertIn('#EXT-X-BYTERANGE:500@1800\nsegment-0.m4s\n', result)
+        self.assertEqual(m3u8.MediaPlaylist.loads(result).segments,
+                         playlist.segments)
+
+    def test_map(self):
+        content = '\n'.join([
+            '#EXTM3U',
+            '#EXT-X-VERSION:7',
+            '#EXT-X-MAP:URI="init-0.mp4"',
+            '#EXTINF:4.000000,',
+            'segment-0-00000.m4s',
+        ])
+
+        playlist = m3u8.MediaPlaylist.loads(content)
+
+        self.assertEqual(playlist.map_uri, 'init-0.mp4')
+        self.assertEqual(playlist.version, 7)
+        self.assertIn('#EXT-X-MAP:URI="init-0.mp4"\n', playlist.dumps())
+
+
+class MasterPlaylistTestCase(base.ProfileMixin, base.MetadataMixin,
+                             TestCase):
+    def test_from_profile(self):
+        profile = self.default_profile()
+        meta = self.make_meta(30.0)
+        video = profile.video[0]
+        audio = profile.audio[0]
+        bandwidth = round((video.max_rate + audio.bitrate) * 1.1)
+        codecs = f'{m3u8.video_codec(video)},mp4a.40.2'
+
+        result = m3u8.MasterPlaylist.from_profile(profile, meta).dumps()
+
+        self.assertEqual(result, '\n'.join([
+            '#EXTM3U',
+            '#EXT-X-VERSION:3',
+            '#EXT-X-MEDIA:TYPE=AUDIO,GROUP-ID="a0",NAME="audio_0",'
+            'DEFAULT=YES,URI="playlist-a0.m3u8"',
+            f'#EXT-X-STREAM-INF:BANDWIDTH={bandwidth},'
+            f'RESOLUTION={meta.video.width}x{meta.video.height},'
+            f'CODECS="{codecs}",AUDIO="a0"',
+            'playlist-v0.m3u8',
+            '',
+        ]))
+
+    def test_from_profile_without_audio(self):
+        profile = self.default_profile()
+        profile.audio = []
+        meta = self.make_meta(30.0)
+        video = profile.video[0]
+
+        result = m3u8.MasterPlaylist.from_profile(profile, meta).dumps()
+
+        self.assertIn(f'#EXT-X-STREAM-INF:BANDWIDTH='
+                      f'{round(video.max_rate * 1.1)},'
+                      f'RESOLUTION={meta.video.width}x{meta.video.height},'
+                      f'CODECS="{m3u8.video_codec(video)}"\n',
+                      result)
+
+    def test_from_profile_unknown_codec(self):
+        profile = self.default_profile()
+        profile.audio = [replace(profile.audio[0], codec='libopus')]
+        meta = self.make_meta(30.0)
+
+        result = m3u8.MasterPlaylist.from_profile(profile, meta)
+
+        self.assertEqual(result.variants[0].codecs, [])
+        self.assertNotIn('CODECS', result.dumps())
+
+
+class CodecsTestCase(base.ProfileMixin, TestCase):
+    def test_video_codec(self):
+        track = self.default_profile().video[0]
+        cases = [
+            ('high', 1920, 1080, 30.0, 'avc1.640028'),
+            ('high', 1920, 1080, 24.0, 'avc1.640028'),
+            ('main', 1280, 720, 30.0, 'avc1.4D401F'),
+            ('baseline', 640, 360, 25.0, 'avc1.42E01E'),
+            ('high', 1920, 1080, 60.0, 'avc1.64002A'),
+            ('high', 3840, 2160, 30.0, 'avc1.640033'),
+        ]
+        for profile, width, height, frame_rate, expected in cases:
+            with self.subTest(profile=profile, height=height, fps=frame_rate):
+                t = replace(track, codec='libx264', profile=profile,
+                            width=width, height=height, frame_rate=frame_rate)
+                self.assertEqual(m3u8.video_codec(t), expected)
+
+        self.assertIsNone(m3u8.video_codec(replace(track, codec='libx265')))
+        self.assertIsNone(m3u8.video_codec(replace(track, codec='libx264',
+                                                   profile='high10')))
+
+    def test_audio_codec(self):
+        track = self.default_profile().audio[0]
+        self.assertEqual(m3u8.audio_codec(replace(track, codec='aac')),
+                         'mp4a.40.2')
+        self.assertIsNone(m3u8.audio_codec(replace(track, codec='libopus')))
@@ -0,0 +1,283 @@
+import os
+from tempfile import TemporaryDirectory
+from unittest import TestCase, mock, skipUnless
+
+try:
+    import prometheus_client
+except ImportError:  # pragma: no cover
+    prometheus_client = None
+
+from video_transcoding import metrics, defaults
+from video_transcoding.transcoding import ffmpeg
+
+
+class StageStatsTestCase(TestCase):
+    def test_realtime_factor(self):
+        stats = metrics.StageStats('transcode', wall_time=10.0)
+        self.assertIsNone(stats.realtime_factor)
+
+        stats.add_progress(ffmpeg.Progress(out_time=30.0, total_size=100))
+
+        self.assertEqual(stats.realtime_factor, 3.0)
+        self.assertEqual(stats.write_bytes, 100)
+
+        stats.add_progress(None)
+
+        self.assertEqual(stats.duration, 30.0)
+
+    def test_summarize(self):
+        summary = metrics.summarize([
+            metrics.StageStats('transcode', wall_time=10.0, cpu_time=30.0,
+                               write_bytes=2, duration=60.0),
+            metrics.StageStats('analyze', wall_time=1.0),
+            metrics.StageStats('transcode', wall_time=20.0, cpu_time=60.0,
+                               write_bytes=4, duration=30.0),
+            # running simultaneously with other stages
+            metrics.StageStats('transcode', wall_time=5.0),
+        ])
+
+        self.assertEqual(summary, {
+            'transcode': {
+                'count': 3,
+                'wall_time': 35.0,
+                'cpu_time': 90.0,
+                'write_bytes': 6,
+                'duration': 90.0,
+                'realtime_factor': 90.0 / 35.0,
+            },
+            'analyze': {
+                'count': 1,
+                'wall_time': 1.0,
+                'cpu_time': None,
+                'write_bytes': 0,
+                'duration': 0.0,
+                'realtime_factor': None,
+            },
+        })
+        self.assertEqual(metrics.summarize([]), {})
+
+
+class MeasureTestCase(TestCase):
+    def setUp(self):
+        super().setUp()
+        self.backend = metrics.MemoryBackend()
+        self.metrics_patcher = mock.patch.object(
+            metrics, 'get_metrics', return_value=self.backend)
+        self.metrics_patcher.start()
+        self.usage_patcher = mock.patch.object(
+            metrics, 'get_children_cpu_time', side_effect=[1.0, 5.0])
+        self.usage_patcher.start()
+        self.monotonic_patcher = mock.patch('time.monotonic',
+                                            side_effect=[100.0, 110.0])
+        self.monotonic_patcher.start()
+
+    def tearDown(self):
+        super().tearDown()
+        self.metrics_patcher.stop()
+        self.usage_patcher.stop()
+        self.monotonic_patcher.stop()
+
+    def test_measure(self):
+        with metrics.measure('transcode') as stats:
+            stats.add_progress(ffmpeg.Progress(out_time=20.0, total_size=100))
+
+        self.assertEqual(stats, metrics.StageStats(
+            'transcode',
+            wall_time=10.0,
+            cpu_time=4.0,
+            write_bytes=100,
+            duration=20.0,
+        ))
+        get = self.backend.get
+        self.assertEqual(get('stage_duration_seconds', stage='transcode'),
+                         [10.0])
+        self.assertEqual(get('stage_cpu_seconds_total'), [4.0])
+        self.assertEqual(get('stage_write_bytes_total'), [100])
+        self.assertEqual(get('stage_realtime_factor'), [2.0])
+        self.assertEqual(get('stage_duration_seconds', stage='merge'), [])
+
+    def test_measure_concurrent(self):
+        self.monotonic_patcher.stop()
+        self.usage_patcher.stop()
+        try:
+            with metrics.measure('split') as split:
+                with metrics.measure('transcode') as first:
+                    pass
+                with metrics.measure('transcode') as second:
+                    pass
+        finally:
+            self.usage_patcher.start()
+            self.monotonic_patcher.start()
+
+        self.assertIsNone(split.cpu_time)
+        self.assertIsNone(first.cpu_time)
+        self.assertIsNone(second.cpu_time)
+        self.assertEqual(self.backend.get('stage_cpu_seconds_total'), [])
+
+        with metrics.measure('merge') as merge:
+            pass
+
+        self.assertEqual(merge.cpu_time, 4.0)
+
+    def test_measure_error(self):
+        with self.assertRaises(RuntimeError):
+            with metrics.measure('transcode'):
+                raise RuntimeError()
+
+        self.assertEqual(self.backend.samples, [
+            ('stage_errors_total', 1, {'stage': 'transcode'}),
+        ])
+
+    def test_measure_interrupted(self):
+        class Interrupt(BaseException):
+            pass
+
+        with self.assertRaises(Interrupt):
+            with metrics.measure('transcode'):
+                raise Interrupt()
+
+        self.assertEqual(metrics.running_stages.overlapped, {})
+        self.assertEqual(self.backend.samples, [])
+
+    def test_speed_gauge(self):
+        gauge = metrics.SpeedGauge(stage='transcode')
+
+        gauge(ffmpeg.Progress(speed=2.0))
+        gauge(ffmpeg.Progress(speed=2.0))
+        gauge(ffmpeg.Progress(speed=1.5))
+        gauge(ffmpeg.Progress(speed=1.5, finished=True))
+
+        self.assertEqual(self.backend.get('ffmpeg_speed', stage='transcode'),
+                         [2.0, -0.5, -1.5])
+
+
+class BackendTestCase(TestCase):
+    def test_init(self):
+        self.assertIsInstance(metrics.init('memory:'), metrics.MemoryBackend)
+
+        backend = metrics.init('statsd://statsd.local:9125/transcoder')
+
+        self.assertIsInstance(backend, metrics.StatsdBackend)
+        self.assertEqual(backend.address, ('statsd.local', 9125))
+        self.assertEqual(backend.prefix, 'transcoder')
+
+        backend = metrics.init('statsd://')
+
+        self.assertEqual(backend.address, ('localhost', 8125))
+        self.assertEqual(backend.prefix, 'video_transcoding')
+
+        with self.assertRaises(ValueError):
+            metrics.init('unknown://')
+
+    def test_get_metrics(self):
+        metrics.get_metrics.cache_clear()
+        self.addCleanup(metrics.get_metrics.cache_clear)
+        with mock.patch.object(defaults, 'VIDEO_METRICS_URI', ''):
+            self.assertIsNone(metrics.get_metrics())
+
+        metrics.get_metrics.cache_clear()
+        with mock.patch.object(defaults, 'VIDEO_METRICS_URI', 'memory:'):
+            backend = metrics.get_metrics()
+
+        self.assertIsInstance(backend, metrics.MemoryBackend)
+        self.assertIs(metrics.get_metrics(), backend)
+
+    def test_statsd(self):
+        backend = metrics.StatsdBackend('localhost', 8125, 'vt')
+        stats = metrics.StageStats('split', wall_time=0.5)
+
+        with mock.patch.object(backend, 'socket') as m:
+            backend.record(stats)
+            backend.add('tasks_in_progress', -1, {'task': 'TranscodeVideo'})
+            m.sendto.side_effect = OSError()
+            backend.increment('errors', 1, {})
+
+        sent = [c.args for c in m.sendto.call_args_list]
+        self.assertEqual(sent, [
+            (b'vt.stage_duration_seconds:0.5|h|#stage:split',
+             ('localhost', 8125)),
+            (b'vt.stage_write_bytes_total:0|c|#stage:split',
+             ('localhost', 8125)),
+            (b'vt.tasks_in_progress:-1|g|#task:TranscodeVideo',
+             ('localhost', 8125)),
+            (b'vt.errors:1|c', ('localhost', 8125)),
+        ])
+
+    def test_skip_not_configured(self):
+        with mock.patch.object(metrics, 'get_metrics', return_value=None):
+            metrics.increment('tasks_total', task='TranscodeVideo')
+            metrics.add('tasks_in_progress', 1, task='TranscodeVideo')
+
+
+@skipUnless(prometheus_client, "prometheus_client is not installed")
+class PrometheusTestCase(TestCase):
+    def setUp(self):
+        super().setUp()
+        self.registry = prometheus_client.CollectorRegistry()
+        self.backend = metrics.PrometheusBackend(registry=self.registry)
+
+    def get(self, name, **labels):
+        return self.registry.get_sample_value(
+            f'video_transcoding_{name}', labels)
+
+    def test_init(self):
+        backend = metrics.init('prometheus://0.0.0.0:9100')
+
+        self.assertIsInstance(backend, metrics.PrometheusBackend)
+        self.assertIs(backend.registry, prometheus_client.REGISTRY)
+
+    def test_record(self):
+        self.backend.record(metrics.StageStats(
+            'transcode', wall_time=10.0, cpu_time=30.0, duration=20.0))
+        self.backend.record(metrics.StageStats('transcode', wall_time=5.0))
+
+        self.assertEqual(
+            self.get('stage_duration_seconds_count', stage='transcode'), 2)
+        self.assertEqual(
+            self.get('stage_duration_seconds_sum', stage='transcode'), 15.0)
+        self.assertEqual(
+            self.get('stage_cpu_seconds_total', stage='transcode'), 30.0)
+        self.assertEqual(
+            self.get('stage_realtime_factor_sum', stage='transcode'), 2.0)
+
+    def test_gauge(self):
+        labels = {'task': 'TranscodeVideo'}
+        self.backend.add('tasks_in_progress', 1, labels)
+        self.backend.add('tasks_in_progress', 1, labels)
+        self.backend.add('tasks_in_progress', -1, labels)
+
+        self.assertEqual(self.get('tasks_in_progress', **labels), 1)
+
+    def test_queue_collector(self):
+        self.registry.register(metrics.QueueCollector(
+            lambda: {'video_transcoding': 3, 'video_transcoding.0': 0}))
+
+        self.assertEqual(self.get('queue_depth', queue='video_transcoding'),
+                         3)
+        self.assertEqual(self.get('queue_depth', queue='video_transcoding.0'),
+                         0)
+
+    @mock.patch('prometheus_client.start_http_server')
+    def test_start_exporter(self, m: mock.Mock):
+        queue_depths = mock.MagicMock(return_value={})
+        registry = prometheus_client.REGISTRY
+        with mock.patch.object(registry, 'register') as register:
+            metrics.start_exporter('prometheus://127.0.0.1:9200',
+                                   queue_depths)
+
+        m.assert_called_once_with(9200, addr='127.0.0.1', registry=registry)
+        collector = register.call_args.args[0]
+        self.assertIsInstance(collector, metrics.QueueCollector)
+        self.assertIs(collector.queue_depths, queue_depths)
+
+    @mock.patch('prometheus_client.start_http_server')
+    def test_start_exporter_multiprocess(self, m: mock.Mock):
+        with (
+            TemporaryDirectory() as tmp,
+            mock.patch.dict(os.environ, {'PROMETHEUS_MULTIPROC_DIR': tmp}),
+        ):
+            metrics.start_exporter('prometheus://127.0.0.1:9200')
+
+        registry = m.call_args.kwargs['registry']
+        self.assertIsNot(registry, prometheus_client.REGISTRY)
+        self.assertIsInstance(registry, prometheus_client.CollectorRegistry)
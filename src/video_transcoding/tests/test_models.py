@@ -2,8 +2,11 @@ from unittest import mock
 from uuid import uuid4, UUID
 
 from celery.result import AsyncResult
+from django.contrib.admin import site
 
-from video_transcoding import models
+from video_transcoding import models, helpers, defaults
+from video_transcoding.admin import VideoAdmin
+from video_transcoding.tests import base
 from video_transcoding.tests.base import BaseTestCase
 
 
@@ -37,3 +40,142 @@ class VideoModelTestCase(BaseTestCase):
         self.assertEqual(v.status, models.Video.QUEUED)
         result = self.apply_async_mock.return_value
         self.assertEqual(v.task_id, UUID(result.task_id))
+
+    def test_is_playable(self):
+        v = models.Video(source='http://ya.ru/1.mp4')
+        cases = [
+            (models.Video.CREATED, False, False),
+            (models.Video.PROCESS, False, False),
+            (models.Video.PROCESS, True, True),
+            (models.Video.DONE, False, True),
+            (models.Video.ERROR, True, False),
+        ]
+        for status, published, expected in cases:
+            with self.subTest(status=status, published=published):
+                v.status = status
+                v.published = published
+                self.assertEqual(v.is_playable, expected)
+
+
+    def test_admin_video_player(self):
+        """ Video player is shown for playable video only."""
+        admin = VideoAdmin(models.Video, site)
+        v = models.Video(source='http://ya.ru/1.mp4', basename=uuid4(),
+                         status=models.Video.PROCESS)
+
+        self.assertEqual(admin.video_player(v), '')
+
+        v.published = True
+        self.assertIn(v.basename.hex, admin.video_player(v))
+
+
+class PriorityRoutingTestCase(base.MetadataMixin, BaseTestCase):
+    """ Transcoding task priority routing tests."""
+
+    def setUp(self):
+        super().setUp()
+        self.tiers_patcher = mock.patch.object(
+            defaults, 'VIDEO_PRIORITY_TIERS', [5.0, 60.0])
+        self.tiers_patcher.start()
+        self.video = models.Video(source='http://ya.ru/1.mp4')
+
+    def tearDown(self):
+        super().tearDown()
+        self.tiers_patcher.stop()
+
+    def set_metadata(self, duration: float, width: int, height: int):
+        self.video.metadata = {
+            'duration': duration,
+            'videos': [
+                {'width': width, 'height': height, 'duration': duration},
+                {'width': width // 2, 'height': height // 2,
+                 'duration': duration},
+            ],
+        }
+
+    def test_default_queue(self):
+        self.assertEqual(helpers.get_routing_key(self.video),
+                         'video_transcoding')
+
+        with mock.patch.object(defaults, 'VIDEO_PRIORITY_TIERS', []):
+            self.set_metadata(30.0, 1920, 1080)
+            self.assertEqual(helpers.get_routing_key(self.video),
+                             'video_transcoding')
+
+    def test_route_by_cost(self):
+        self.set_metadata(60.0, 1920, 1080)
+        self.assertEqual(helpers.get_transcode_cost(self.video), 1.0)
+        self.assertEqual(helpers.get_routing_key(self.video),
+                         'video_transcoding.0')
+
+        self.set_metadata(600.0, 3840, 2160)
+        self.assertEqual(helpers.get_transcode_cost(self.video), 40.0)
+        self.assertEqual(helpers.get_routing_key(self.video),
+                         'video_transcoding.1')
+
+        self.set_metadata(4 * 3600.0, 1920, 1080)
+        self.assertEqual(helpers.get_routing_key(self.video),
+                         'video_transcoding')
+
+    def test_explicit_priority(self):
+        self.set_metadata(4 * 3600.0, 1920, 1080)
+
+        self.video.priority = 0
+        self.assertEqual(helpers.get_routing_key(self.video),
+                         'video_transcoding.0')
+
+        self.video.priority = 1
+        self.assertEqual(helpers.get_routing_key(self.video),
+                         'video_transcoding.1')
+
+        self.video.priority = 10
+        self.assertEqual(helpers.get_routing_key(self.video),
+                         'video_transcoding')
+
+    def test_source_metadata(self):
+        src = self.make_meta(120.0)
+
+        self.assertIsNone(helpers.get_transcode_cost(self.video))
+        self.assertEqual(helpers.get_transcode_cost(self.video, src), 2.0)
+        self.assertEqual(helpers.get_routing_key(self.video, src),
+                         'video_transcoding.0')
+
+    @mock.patch.object(defaults, 'VIDEO_PRIORITY_PROBE', True)
+    def test_send_routing_task(self):
+        self.video.save()
+        target = 'video_transcoding.tasks.route_video.apply_async'
+        with mock.patch(target,
+                        return_value=AsyncResult(str(uuid4()))) as m:
+            result = helpers.send_transcode_task(self.video)
+
+        m.assert_called_once_with(args=(self.video.pk,),
+                                  countdown=10,
+                                  routing_key='video_transcoding.0')
+        self.apply_async_mock.assert_not_called()
+        self.video.refresh_from_db()
+        self.assertEqual(self.video.status, models.Video.QUEUED)
+        self.assertEqual(self.video.task_id, UUID(result.task_id))
+
+    @mock.patch.object(defaults, 'VIDEO_PRIORITY_PROBE', True)
+    def test_send_without_probe(self):
+        self.video.save()
+
+        with mock.patch('video_transcoding.tasks.route_video.apply_async'
+                        ) as m:
+            helpers.send_transcode_task(self.video, probe=False)
+            self.set_metadata(60.0, 1920, 1080)
+            helpers.send_transcode_task(self.video)
+
+        m.assert_not_called()
+        self.assertEqual(self.apply_async_mock.call_count, 2)
+
+    def test_send_transcode_task(self):
+        self.video.priority = 1
+        self.video.save()
+
+        helpers.send_transcode_task(self.video)
+
+        self.apply_async_mock.assert_called_with(
+            args=(self.video.pk,),
+            countdown=10,
+            routing_key='video_transcoding.1')
@@ -0,0 +1,90 @@
+from xml.etree import ElementTree
+
+from django.test import TestCase
+
+from video_transcoding.tests import base
+from video_transcoding.transcoding import m3u8, mpd
+
+NS = {'mpd': mpd.NAMESPACE}
+
+
+class ManifestTestCase(base.ProfileMixin, base.MetadataMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.profile = self.default_profile()
+        self.meta = self.make_meta(30.0)
+
+    @staticmethod
+    def make_playlist(name: str, *durations: float) -> m3u8.MediaPlaylist:
+        return m3u8.MediaPlaylist(
+            segments=[m3u8.Segment(uri=f'segment-{name}-{i:05d}.m4s',
+                                   duration=d)
+                      for i, d in enumerate(durations)],
+            map_uri=f'init-{name}.mp4',
+        )
+
+    def test_manifest(self):
+        video = self.make_playlist('1', 4.0, 4.0, 4.0, 2.5)
+        audio = self.make_playlist('0', 4.0, 4.0, 4.0, 2.6)
+
+        content = mpd.manifest(self.profile, self.meta,
+                               videos=[video], audios=[audio])
+
+        root = ElementTree.fromstring(content)
+        self.assertEqual(root.get('type'), 'static')
+        self.assertEqual(root.get('mediaPresentationDuration'), 'PT14.600S')
+        v, a = root.findall('mpd:Period/mpd:AdaptationSet', NS)
+
+        r = v.find('mpd:Representation', NS)
+        track = self.profile.video[0]
+        self.assertEqual(r.get('id'), 'v0')
+        self.assertEqual(r.get('bandwidth'), str(track.max_rate))
+        self.assertEqual(r.get('width'), str(self.meta.video.width))
+        self.assertEqual(r.get('codecs'), m3u8.video_codec(track))
+        sl = r.find('mpd:SegmentList', NS)
+        self.assertEqual(sl.find('mpd:Initialization', NS).get('sourceURL'),
+                         'init-1.mp4')
+        timeline = [s.attrib for s in sl.findall('mpd:SegmentTimeline/mpd:S',
+                                                 NS)]
+        self.assertEqual(timeline, [
+            {'t': '0', 'd': '4000', 'r': '2'},
+            {'d': '2500'},
+        ])
+        self.assertEqual([s.get('media') for s in
+                          sl.findall('mpd:SegmentURL', NS)],
+                         [s.uri for s in video.segments])
+
+        r = a.find('mpd:Representation', NS)
+        self.assertEqual(r.get('id'), 'a0')
+        self.assertEqual(r.get('codecs'), 'mp4a.40.2')
+        self.assertEqual(
+            r.find('mpd:AudioChannelConfiguration', NS).get('value'),
+            str(self.profile.audio[0].channels))
+
+    def test_byterange(self):
+        playlist = self.make_playlist('0', 4.0, 4.0)
+        playlist.map_byterange = (800, 0)
+        playlist.segments[0].byterange = (1000, 800)
+        playlist.segments[1].byterange = (500, 1800)
+
+        sl = mpd.segment_list(playlist)
+
+        self.assertEqual(sl.find('Initialization').get('range'), '0-799')
+        self.assertEqual([s.get('mediaRange')
+                          for s in sl.findall('SegmentURL')],
+                         ['800-1799', '1800-2299'])
+
+    def test_timeline_rounding(self):
+        playlist = self.make_playlist('0', *[1 / 3] * 6)
+
+        sl = mpd.segment_list(playlist)
+
+        timeline = [s.attrib for s in sl.findall('SegmentTimeline/S')]
+        # rounding error is not accumulated
+        self.assertEqual(timeline, [
+            {'t': '0', 'd': '333'},
+            {'d': '334'},
+            {'d': '333', 'r': '1'},
+            {'d': '334'},
+            {'d': '333'},
+        ])
@@ -0,0 +1,105 @@
+import json
+from dataclasses import replace
+from io import StringIO
+from unittest import mock
+
+from django.core.management import call_command
+
+from video_transcoding import models, planner
+from video_transcoding.tests import base
+
+
+class PlannerTestCase(base.PresetMixin, base.MetadataMixin, base.BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.meta = self.make_meta(90.0)
+        self.meta.videos[0] = replace(self.meta.video, bitrate=5_000_000)
+        self.extractor_patcher = mock.patch(
+            'video_transcoding.transcoding.extract.SourceExtractor')
+        self.extractor_mock = self.extractor_patcher.start()
+        self.get_meta_data = self.extractor_mock.return_value.get_meta_data
+        self.get_meta_data.side_effect = self.get_source_meta
+        self.video = models.Video.objects.create(
+            source='http://storage.localhost/first.mp4')
+        self.planner = planner.Planner(concurrency=2,
+                                       pixel_rate=1_000_000,
+                                       chunk_duration=60)
+
+    def tearDown(self):
+        super().tearDown()
+        self.extractor_patcher.stop()
+
+    def get_source_meta(self, uri: str):
+        if 'missing' in uri:
+            raise RuntimeError("missing")
+        return self.meta
+
+    def test_plan_default_preset(self):
+        plan = self.planner([self.video])
+
+        self.get_meta_data.assert_called_once_with(self.video.source)
+        self.assertEqual(len(plan.videos), 1)
+        p = plan.videos[0]
+        self.assertIsNone(p.error)
+        self.assertEqual(p.video_id, self.video.pk)
+        self.assertEqual(p.duration, 90.0)
+        self.assertEqual(p.chunks, 2)
+        self.assertEqual(p.video_tracks, ['1080p', '720p', '480p', '360p'])
+        self.assertEqual(p.audio_tracks, ['192k'])
+        pixels = 90.0 * 30 * (1920 * 1080 + 1280 * 720 + 854 * 480 +
+                              640 * 360)
+        self.assertAlmostEqual(p.pixels, pixels)
+        self.assertAlmostEqual(p.core_hours, pixels / 1_000_000 / 3600)
+
+    def test_plan_video_preset(self):
+        self.video.preset = self.create_preset()
+        self.video.save()
+
+        plan = self.planner([self.video])
+
+        p = plan.videos[0]
+        self.assertEqual(p.video_tracks, ['v'])
+        self.assertEqual(p.audio_tracks, ['a'])
+        self.assertAlmostEqual(p.pixels, 90.0 * 30 * 1920 * 1080)
+
+    def test_plan_aggregate(self):
+        second = models.Video.objects.create(
+            source='http://storage.localhost/second.mp4')
+        missing = models.Video.objects.create(
+            source='http://storage.localhost/missing.mp4')
+
+        plan = self.planner([self.video, missing, second])
+
+        self.assertEqual([p.video_id for p in plan.videos],
+                         [self.video.pk, missing.pk, second.pk])
+        self.assertEqual(plan.planned, [plan.videos[0], plan.videos[2]])
+        self.assertEqual(plan.failed, [plan.videos[1]])
+        self.assertEqual(plan.failed[0].error, "RuntimeError('missing')")
+        self.assertEqual(plan.duration, 180.0)
+        self.assertEqual(plan.chunks, 4)
+        self.assertAlmostEqual(plan.core_hours,
+                               plan.videos[0].core_hours * 2)
+
+    def test_command(self):
+        models.Video.objects.create(
+            source='http://storage.localhost/missing.mp4',
+            status=models.Video.ERROR)
+        out = StringIO()
+
+        call_command('plan_transcoding', '--json', '--status=created',
+                     stdout=out)
+
+        data = json.loads(out.getvalue())
+        self.assertEqual(len(data['videos']), 1)
+        self.assertEqual(data['videos'][0]['video_id'], self.video.pk)
+        self.assertEqual(data['chunks'], 2)
+        self.assertEqual(data['failed'], 0)
+
+        out = StringIO()
+
+        call_command('plan_transcoding', stdout=out)
+
+        lines = out.getvalue().splitlines()
+        self.assertEqual(len(lines), 3)
+        self.assertIn('error:', lines[1])
+        self.assertTrue(lines[2].startswith('Total: 1 videos, 1 failed'))
@@ -0,0 +1,227 @@
+from datetime import timedelta
+from unittest import mock
+
+from django.core.cache import caches
+from django.test import TestCase
+
+from video_transcoding import models, presets, tasks, defaults
+from video_transcoding.tests.base import PresetMixin
+from video_transcoding.transcoding import profiles
+
+
+class LoadPresetTestCase(PresetMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.preset = self.create_preset()
+
+    def add_profiles(self, count: int) -> None:
+        vt = models.VideoTrack.objects.get(preset=self.preset)
+        at = models.AudioTrack.objects.get(preset=self.preset)
+        for i in range(count):
+            vt2 = models.VideoTrack.objects.create(
+                name=f'v{i}', preset=self.preset, params=vt.params)
+            vp = models.VideoProfile.objects.create(
+                name=f'vp{i}',
+                preset=self.preset,
+                segment_duration=timedelta(seconds=1.0),
+                condition={})
+            vp.videoprofiletracks_set.create(track=vt2, order_number=1)
+            vp.videoprofiletracks_set.create(track=vt, order_number=2)
+            ap = models.AudioProfile.objects.create(
+                name=f'ap{i}', preset=self.preset, condition={})
+            ap.audioprofiletracks_set.create(track=at)
+
+    def test_load_preset(self):
+        preset = presets.load_preset(self.preset)
+
+        self.assertEqual(preset.video_profiles, [profiles.VideoProfile(
+            condition=profiles.VideoCondition(min_width=1),
+            segment_duration=1.0,
+            video=['v'],
+        )])
+        self.assertEqual(preset.audio_profiles, [profiles.AudioProfile(
+            condition=profiles.AudioCondition(min_bitrate=2),
+            audio=['a'],
+        )])
+        self.assertEqual([v.id for v in preset.video], ['v'])
+        self.assertEqual([a.id for a in preset.audio], ['a'])
+
+    def test_load_container_format(self):
+        self.preset.video_profiles.update(container_format=profiles.FMP4,
+                                          single_file=True)
+
+        preset = presets.load_preset(self.preset)
+
+        self.assertEqual(preset.video_profiles[0].container_format,
+                         profiles.FMP4)
+        self.assertTrue(preset.video_profiles[0].single_file)
+
+    def test_profile_tracks_order(self):
+        self.add_profiles(1)
+
+        preset = presets.load_preset(self.preset)
+
+        self.assertEqual(preset.video_profiles[1].video, ['v0', 'v'])
+
+    def test_num_queries(self):
+        with self.assertNumQueries(6):
+            presets.load_preset(self.preset)
+
+        self.add_profiles(10)
+        self.preset.refresh_from_db()
+
+        with self.assertNumQueries(6):
+            preset = presets.load_preset(self.preset)
+        self.assertEqual(len(preset.video_profiles), 11)
+        self.assertEqual(len(preset.video), 11)
+
+    def test_prefetched_presets(self):
+        self.create_preset('second')
+
+        with self.assertNumQueries(7):
+            qs = models.Preset.objects.prefetch_related(
+                *presets.get_preset_prefetch())
+            result = [presets.load_preset(p) for p in qs]
+
+        self.assertEqual(len(result), 2)
+
+
+class PresetCacheTestCase(PresetMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.preset = self.create_preset()
+        self.cache = presets.PresetCache(max_size=2)
+        self.snapshot = presets.load_preset(self.preset)
+        self.build = mock.MagicMock(return_value=self.snapshot)
+
+    def test_get_or_build(self):
+        first = self.cache.get_or_build(self.preset, self.build)
+        second = self.cache.get_or_build(self.preset, self.build)
+
+        self.build.assert_called_once_with(self.preset)
+        self.assertIs(first, self.snapshot)
+        self.assertIs(second, self.snapshot)
+
+    def test_modified_preset(self):
+        self.cache.set(self.preset, self.snapshot)
+
+        self.preset.save()
+
+        self.assertIsNone(self.cache.get(self.preset))
+
+    def test_evict_least_recently_used(self):
+        second = self.create_preset('second')
+        third = self.create_preset('third')
+        self.cache.set(self.preset, self.snapshot)
+        self.cache.set(second, self.snapshot)
+        self.cache.get(self.preset)
+
+        self.cache.set(third, self.snapshot)
+
+        self.assertIsNotNone(self.cache.get(self.preset))
+        self.assertIsNone(self.cache.get(second))
+        self.assertIsNotNone(self.cache.get(third))
+
+    def test_invalidate(self):
+        self.cache.set(self.preset, self.snapshot)
+
+        self.cache.invalidate(self.preset.pk)
+
+        self.assertIsNone(self.cache.get(self.preset))
+
+    def test_django_cache(self):
+        self.cache.alias = 'default'
+        self.addCleanup(caches['default'].clear)
+        self.cache.set(self.preset, self.snapshot)
+        # another worker process
+        other = presets.PresetCache(max_size=2, alias='default')
+
+        snapshot = other.get(self.preset)
+
+        self.assertEqual(snapshot, self.snapshot)
+        self.assertIsNot(snapshot, self.snapshot)
+        self.assertIs(other.get(self.preset), snapshot)
+
+    def test_disabled(self):
+        self.cache.max_size = 0
+
+        self.cache.set(self.preset, self.snapshot)
+
+        self.assertIsNone(self.cache.get(self.preset))
+
+    def test_get_preset_cache(self):
+        presets.get_preset_cache.cache_clear()
+        self.addCleanup(presets.get_preset_cache.cache_clear)
+        with (
+            mock.patch.object(defaults, 'VIDEO_PRESET_CACHE_SIZE', 10),
+            mock.patch.object(defaults, 'VIDEO_PRESET_CACHE_ALIAS', 'alias'),
+        ):
+            cache = presets.get_preset_cache()
+
+        self.assertEqual(cache.max_size, 10)
+        self.assertEqual(cache.alias, 'alias')
+
+
+class InitPresetCacheTestCase(PresetMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        presets.get_preset_cache.cache_clear()
+        self.addCleanup(presets.get_preset_cache.cache_clear)
+        self.preset = self.create_preset()
+
+    def init_preset(self) -> profiles.Preset:
+        self.preset.refresh_from_db()
+        return tasks.transcode_video.init_preset(self.preset)
+
+    def test_init_preset_cached(self):
+        first = self.init_preset()
+
+        with self.assertNumQueries(0):
+            second = tasks.transcode_video.init_preset(self.preset)
+
+        self.assertIs(first, second)
+
+    def test_invalidate_on_track_change(self):
+        first = self.init_preset()
+        vt = models.VideoTrack.objects.get(preset=self.preset)
+
+        vt.params = {**vt.params, 'width': 1280}
+        vt.save()
+
+        second = self.init_preset()
+        self.assertEqual(second.video[0].width, 1280)
+        self.assertIsNot(first, second)
+
+    def test_invalidate_on_profile_change(self):
+        self.init_preset()
+        ap = models.AudioProfile.objects.get(preset=self.preset)
+
+        ap.condition = {'min_bitrate': 3}
+        ap.save()
+
+        preset = self.init_preset()
+        self.assertEqual(preset.audio_profiles[0].condition.min_bitrate, 3)
+
+    def test_invalidate_on_profile_tracks_change(self):
+        self.init_preset()
+        vp = models.VideoProfile.objects.get(preset=self.preset)
+
+        vp.videoprofiletracks_set.all().delete()
+
+        preset = self.init_preset()
+        self.assertEqual(preset.video_profiles[0].video, [])
+
+        at = models.AudioTrack.objects.get(preset=self.preset)
+        ap = models.AudioProfile.objects.get(preset=self.preset)
+        ap.audio.remove(at)
+
+        preset = self.init_preset()
+        self.assertEqual(preset.audio_profiles[0].audio, [])
+
+    def test_invalidate_on_delete(self):
+        self.init_preset()
+
+        models.AudioTrack.objects.filter(preset=self.preset).delete()
+
+        preset = self.init_preset()
+        self.assertEqual(preset.audio, [])
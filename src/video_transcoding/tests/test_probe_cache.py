@@ -0,0 +1,156 @@
+import os
+import tempfile
+from unittest import mock
+
+import requests
+from django.test import TestCase
+
+from video_transcoding import defaults
+from video_transcoding.transcoding import probe_cache
+
+
+class GetValidatorsTestCase(TestCase):
+    def setUp(self):
+        super().setUp()
+        self.tmp = tempfile.NamedTemporaryFile()
+        self.tmp.write(b'content')
+        self.tmp.flush()
+        os.utime(self.tmp.name, ns=(1_000, 1_000))
+
+    def tearDown(self):
+        super().tearDown()
+        self.tmp.close()
+
+    def test_local_file(self):
+        expected = (7, 1_000)
+        self.assertEqual(probe_cache.get_validators(self.tmp.name), expected)
+        self.assertEqual(
+            probe_cache.get_validators(f'file://{self.tmp.name}'), expected)
+
+    def test_missing_local_file(self):
+        self.assertIsNone(probe_cache.get_validators('/missing/file.mp4'))
+
+    def test_http_resource(self):
+        uri = 'https://storage.localhost/source.mp4'
+        resp = mock.MagicMock(status_code=200, headers={
+            'ETag': '"etag"',
+            'Content-Length': '100',
+        })
+        with mock.patch('requests.head', return_value=resp) as m:
+            result = probe_cache.get_validators(uri)
+
+        self.assertEqual(result, ('"etag"', None, '100'))
+        m.assert_called_once_with(
+            uri,
+            timeout=(defaults.VIDEO_CONNECT_TIMEOUT,
+                     defaults.VIDEO_REQUEST_TIMEOUT),
+            allow_redirects=True)
+
+    def test_http_resource_not_validated(self):
+        uri = 'https://storage.localhost/source.mp4'
+        resp = mock.MagicMock(status_code=200, headers={
+            'Content-Length': '100',
+        })
+        with mock.patch('requests.head', return_value=resp):
+            self.assertIsNone(probe_cache.get_validators(uri))
+
+        resp.status_code = 404
+        resp.headers['ETag'] = '"etag"'
+        with mock.patch('requests.head', return_value=resp):
+            self.assertIsNone(probe_cache.get_validators(uri))
+
+        with mock.patch('requests.head',
+                        side_effect=requests.ConnectionError()):
+            self.assertIsNone(probe_cache.get_validators(uri))
+
+    def test_unsupported_scheme(self):
+        self.assertIsNone(probe_cache.get_validators('s3://bucket/key'))
+
+
+class MemoryProbeCacheTestCase(TestCase):
+    def setUp(self):
+        super().setUp()
+        self.cache = probe_cache.MemoryProbeCache(max_size=2)
+
+    def test_make_key(self):
+        key = self.cache.make_key('ffprobe', 'uri', (1, 2), timeout=1)
+
+        self.assertEqual(
+            key, self.cache.make_key('ffprobe', 'uri', (1, 2), timeout=1))
+        self.assertNotEqual(
+            key, self.cache.make_key('mediainfo', 'uri', (1, 2), timeout=1))
+        self.assertNotEqual(
+            key, self.cache.make_key('ffprobe', 'uri', (1, 3), timeout=1))
+        self.assertNotEqual(
+            key, self.cache.make_key('ffprobe', 'uri', (1, 2), timeout=2))
+
+    def test_get_set(self):
+        self.assertIsNone(self.cache.get('key'))
+
+        self.cache.set('key', mock.sentinel.value)
+
+        self.assertEqual(self.cache.get('key'), mock.sentinel.value)
+
+    def test_copy_values(self):
+        value = {'streams': [{}]}
+        self.cache.set('key', value)
+        value['streams'].append({})
+
+        result = self.cache.get('key')
+        result['streams'][0]['codec'] = 'h264'
+
+        self.assertEqual(self.cache.get('key'), {'streams': [{}]})
+
+    def test_evict_least_recently_used(self):
+        self.cache.set('first', 1)
+        self.cache.set('second', 2)
+        self.cache.get('first')
+
+        self.cache.set('third', 3)
+
+        self.assertEqual(self.cache.get('first'), 1)
+        self.assertIsNone(self.cache.get('second'))
+        self.assertEqual(self.cache.get('third'), 3)
+
+
+class DjangoProbeCacheTestCase(TestCase):
+    def test_get_set(self):
+        cache = probe_cache.DjangoProbeCache('default', timeout=60)
+
+        with mock.patch('django.core.cache.caches') as m:
+            cache.set('key', mock.sentinel.value)
+            m['default'].get.return_value = mock.sentinel.value
+            result = cache.get('key')
+
+        self.assertEqual(result, mock.sentinel.value)
+        m['default'].set.assert_called_once_with(
+            'key', mock.sentinel.value, timeout=60)
+        m['default'].get.assert_called_once_with('key')
+
+
+class GetProbeCacheTestCase(TestCase):
+    def setUp(self):
+        super().setUp()
+        probe_cache.get_probe_cache.cache_clear()
+
+    def tearDown(self):
+        super().tearDown()
+        probe_cache.get_probe_cache.cache_clear()
+
+    def test_memory_cache(self):
+        with mock.patch.object(defaults, 'VIDEO_PROBE_CACHE_SIZE', 10):
+            cache = probe_cache.get_probe_cache()
+
+        self.assertIsInstance(cache, probe_cache.MemoryProbeCache)
+        self.assertEqual(cache.max_size, 10)
+
+    def test_django_cache(self):
+        with mock.patch.object(defaults, 'VIDEO_PROBE_CACHE_ALIAS', 'probe'):
+            cache = probe_cache.get_probe_cache()
+
+        self.assertIsInstance(cache, probe_cache.DjangoProbeCache)
+        self.assertEqual(cache.alias, 'probe')
+
+    def test_disabled(self):
+        with mock.patch.object(defaults, 'VIDEO_PROBE_CACHE_SIZE', 0):
+            self.assertIsNone(probe_cache.get_probe_cache())
@@ -0,0 +1,92 @@
+from dataclasses import replace, asdict
+
+from django.test import TestCase
+
+from video_transcoding.tests import base
+from video_transcoding.transcoding import profiles
+
+
+class PresetSelectProfileTestCase(base.MetadataMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.preset = profiles.Preset.from_native(
+            asdict(profiles.DEFAULT_PRESET))
+        self.meta = self.make_meta(30.0)
+        self.video = replace(self.meta.video,
+                             width=1920, height=1080, bitrate=5_000_000)
+        self.audio = replace(self.meta.audio, bitrate=192_000)
+
+    def test_select_first_matching_profile(self):
+        profile = self.preset.select_profile(self.video, self.audio)
+
+        self.assertEqual([v.id for v in profile.video],
+                         ['1080p', '720p', '480p', '360p'])
+        self.assertEqual([a.id for a in profile.audio], ['192k'])
+        self.assertEqual(profile.container.segment_duration,
+                         profiles.SEGMENT_SIZE)
+
+        video = replace(self.video, bitrate=3_000_000)
+
+        profile = self.preset.select_profile(video, self.audio)
+
+        self.assertEqual([v.id for v in profile.video],
+                         ['720p', '480p', '360p'])
+
+    def test_container_format(self):
+        self.preset.video_profiles[0].container_format = profiles.FMP4
+        self.preset.video_profiles[0].single_file = True
+
+        profile = self.preset.select_profile(self.video, self.audio)
+
+        self.assertEqual(profile.container.format, profiles.FMP4)
+        self.assertTrue(profile.container.single_file)
+
+        video = replace(self.video, bitrate=3_000_000)
+
+        profile = self.preset.select_profile(video, self.audio)
+
+        self.assertEqual(profile.container.format, profiles.MPEGTS)
+
+    def test_tracks_in_preset_order(self):
+        self.preset.video_profiles[0].video.reverse()
+
+        profile = self.preset.select_profile(self.video, self.audio)
+
+        self.assertEqual([v.id for v in profile.video],
+                         ['1080p', '720p', '480p', '360p'])
+
+    def test_no_compatible_profiles(self):
+        self.preset.video_profiles[-1].condition.min_width = 10_000
+        video = replace(self.video, width=320, height=180)
+
+        with self.assertRaises(RuntimeError) as ctx:
+            self.preset.select_profile(video, self.audio)
+        self.assertEqual(ctx.exception.args[0], "No compatible video profiles")
+
+        self.preset = profiles.Preset.from_native(
+            asdict(profiles.DEFAULT_PRESET))
+        self.preset.audio_profiles[-1].condition.min_bitrate = 10_000_000
+
+        with self.assertRaises(RuntimeError) as ctx:
+            self.preset.select_profile(self.video, self.audio)
+        self.assertEqual(ctx.exception.args[0], "No compatible audio profiles")
+
+    def test_selector_compiled_once(self):
+        selector = self.preset.selector
+
+        self.preset.select_profile(self.video, self.audio)
+
+        self.assertIs(self.preset.selector, selector)
+        self.assertEqual(len(selector.profiles),
+                         len(self.preset.video_profiles) *
+                         len(self.preset.audio_profiles))
+
+    def test_selected_profile_is_a_copy(self):
+        first = self.preset.select_profile(self.video, self.audio)
+        first.video.clear()
+
+        second = self.preset.select_profile(self.video, self.audio)
+
+        self.assertEqual(len(second.video), 4)
+        self.assertEqual(self.preset, profiles.Preset.from_native(
+            asdict(profiles.DEFAULT_PRESET)))
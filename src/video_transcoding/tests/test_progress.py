@@ -0,0 +1,169 @@
+import asyncio
+from unittest import mock
+from uuid import uuid4
+
+from django.contrib.admin import site
+from django.test import TransactionTestCase
+
+from video_transcoding import models, progress
+from video_transcoding.admin import VideoAdmin
+from video_transcoding.tests.base import BaseTestCase
+from video_transcoding.transcoding import ffmpeg
+
+
+class VideoProgressTrackerTestCase(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.video = models.Video.objects.create(
+            status=models.Video.PROCESS,
+            task_id=uuid4(),
+            source='http://ya.ru/1.mp4',
+            progress={'stage': 'transcode', 'chunks': 3, 'done': 1})
+        self.tracker = progress.VideoProgressTracker(self.video, interval=5)
+        self.monotonic_patcher = mock.patch('time.monotonic',
+                                            return_value=100.0)
+        self.monotonic_mock = self.monotonic_patcher.start()
+
+    def tearDown(self):
+        super().tearDown()
+        self.monotonic_patcher.stop()
+
+    def saved(self):
+        self.video.refresh_from_db()
+        return self.video.progress
+
+    def test_update(self):
+        self.tracker.update(stage='merge')
+
+        self.assertEqual(self.saved(), {
+            'stage': 'merge', 'chunks': 3, 'done': 1, 'ffmpeg': {}})
+
+    def test_throttle_ffmpeg_progress(self):
+        callback = self.tracker.callback('s1')
+
+        callback(ffmpeg.Progress(frame=1, fps=25.0, speed=1.0))
+        self.assertEqual(self.saved()['ffmpeg'], {
+            's1': {'out_time': 0.0, 'fps': 25.0, 'speed': 1.0}})
+
+        self.monotonic_mock.return_value = 104.0
+        callback(ffmpeg.Progress(frame=2, fps=50.0, speed=2.0))
+        self.tracker.chunk_done()
+        self.assertEqual(self.saved()['ffmpeg']['s1']['fps'], 25.0)
+        self.assertEqual(self.saved()['done'], 1)
+
+        self.monotonic_mock.return_value = 105.0
+        callback(ffmpeg.Progress(frame=3, fps=50.0, speed=2.0,
+                                 finished=True))
+        self.assertEqual(self.saved()['ffmpeg'], {})
+        self.assertEqual(self.saved()['done'], 2)
+
+    def test_skip_foreign_video(self):
+        self.video.change_status(models.Video.QUEUED, task_id=uuid4())
+
+        self.tracker.update(stage='merge')
+
+        self.assertEqual(self.saved()['stage'], 'transcode')
+
+    def test_write_error(self):
+        with mock.patch.object(self.tracker, 'write',
+                               side_effect=RuntimeError("db")):
+            self.tracker.update(stage='merge')
+
+        self.assertEqual(self.tracker.state['stage'], 'merge')
+
+    def test_subtasks_merge_progress(self):
+        first = progress.SubtaskProgressTracker(self.video, interval=5)
+        second = progress.SubtaskProgressTracker(self.video, interval=5)
+
+        first.callback('s1')(ffmpeg.Progress(frame=1, fps=25.0, speed=1.0))
+        second.callback('s2')(ffmpeg.Progress(frame=1, fps=50.0, speed=2.0))
+        second.update(done=3)
+        # counted before second chunk was finished
+        first.update(done=2)
+
+        saved = self.saved()
+        self.assertEqual(saved['done'], 3)
+        self.assertEqual(saved['stage'], 'transcode')
+        self.assertEqual(set(saved['ffmpeg']), {'s1', 's2'})
+
+        self.monotonic_mock.return_value = 105.0
+        first.callback('s1')(ffmpeg.Progress(frame=2, fps=25.0, speed=1.0,
+                                             finished=True))
+
+        self.assertEqual(set(self.saved()['ffmpeg']), {'s2'})
+
+    def test_subtask_skip_foreign_video(self):
+        tracker = progress.SubtaskProgressTracker(self.video, interval=5)
+        self.video.change_status(models.Video.QUEUED, task_id=uuid4())
+
+        tracker.update(stage='merge')
+
+        self.assertEqual(self.saved()['stage'], 'transcode')
+
+    def test_admin_progress_display(self):
+        admin = VideoAdmin(models.Video, site)
+        self.video.progress = {
+            'stage': 'transcode',
+            'chunks': 10,
+            'done': 3,
+            'ffmpeg': {
+                's4': {'out_time': 1.0, 'fps': 50.0, 'speed': 2.0},
+                's5': {'out_time': 2.0, 'fps': 25.0, 'speed': 1.0},
+            }
+        }
+
+        self.assertEqual(admin.progress_display(self.video),
+                         'transcode, 3/10 chunks, 2 ffmpeg, 75 fps, 3.00x')
+
+        self.video.status = models.Video.DONE
+
+        self.assertEqual(admin.progress_display(self.video), '')
+
+
+class EventLoopProgressTestCase(TransactionTestCase):
+    """
+    ffmpeg progress is reported from fffw event loop.
+    """
+
+    def setUp(self):
+        super().setUp()
+        # created video is sent to transcoding after commit
+        self.send_task_patcher = mock.patch(
+            'video_transcoding.helpers.send_transcode_task')
+        self.send_task_patcher.start()
+        self.video = models.Video.objects.create(
+            status=models.Video.PROCESS,
+            task_id=uuid4(),
+            source='http://ya.ru/1.mp4',
+            progress={'stage': 'transcode', 'chunks': 3, 'done': 1})
+
+    def tearDown(self):
+        super().tearDown()
+        self.send_task_patcher.stop()
+
+    def report(self, tracker):
+        async def run():
+            callback = tracker.callback('s1')
+            callback(ffmpeg.Progress(frame=1, fps=25.0, speed=1.0))
+
+        asyncio.run(run())
+        tracker.flush()
+        self.video.refresh_from_db()
+        return self.video.progress
+
+    def test_video_progress(self):
+        tracker = progress.VideoProgressTracker(self.video, interval=5)
+
+        saved = self.report(tracker)
+
+        self.assertEqual(saved['ffmpeg'], {
+            's1': {'out_time': 0.0, 'fps': 25.0, 'speed': 1.0}})
+
+    def test_subtask_progress(self):
+        tracker = progress.SubtaskProgressTracker(self.video, interval=5)
+
+        saved = self.report(tracker)
+
+        self.assertEqual(saved['done'], 1)
+        self.assertEqual(saved['ffmpeg'], {
+            's1': {'out_time': 0.0, 'fps': 25.0, 'speed': 1.0}})
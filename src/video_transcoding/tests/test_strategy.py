@@ -1,12 +1,15 @@
+import asyncio
 import json
-from dataclasses import asdict
+import threading
+from dataclasses import asdict, replace
 from unittest import mock
+from urllib.parse import urlparse
 
 from django.test import TestCase
 
-from video_transcoding import strategy, defaults
+from video_transcoding import strategy, defaults, metrics
 from video_transcoding.tests import base
-from video_transcoding.transcoding import profiles, workspace
+from video_transcoding.transcoding import profiles, workspace, ffmpeg, m3u8
 
 
 class ResumableStrategyTestCase(base.ProfileMixin, base.MetadataMixin,
@@ -27,6 +30,18 @@ class ResumableStrategyTestCase(base.ProfileMixin, base.MetadataMixin,
         self.strategy.store = self.dst_ws
         self.strategy.initialize()
 
+    def read_journal(self):
+        root = self.tmp_ws.tree['tmp-basename']
+        journal = json.loads(root.get('checkpoint.json', '{}'))
+        records = root.get('checkpoints', {})
+        for name in sorted(records):
+            journal.update(json.loads(records[name]))
+        return journal
+
+    def write_journal(self, data):
+        content = json.dumps(data)
+        self.tmp_ws.tree['tmp-basename']['checkpoint.json'] = content
+
     def test_strategy_init(self):
         source_uri = 'https://example.com/source.mp4'
         basename = 'basename'
@@ -146,6 +161,193 @@ class ResumableStrategyTestCase(base.ProfileMixin, base.MetadataMixin,
         merge.assert_called_once_with(['s1', 's2'], meta=mock.sentinel.m2_rv)
         self.assertEqual(result, mock.sentinel.merge_rv)
 
+    @mock.patch.object(defaults, 'VIDEO_SPLIT_PIPELINE', True)
+    def test_process_pipelined(self):
+        with (
+            mock.patch.object(
+                self.strategy, 'split_and_process',
+                return_value=(['s1'], [mock.sentinel.s1_rv])) as m,
+            mock.patch.object(
+                self.strategy, 'merge',
+                return_value=mock.sentinel.merge_rv) as merge,
+        ):
+            result = self.strategy.process()
+
+        m.assert_called_once_with()
+        merge.assert_called_once_with(['s1'], meta=mock.sentinel.s1_rv)
+        self.assertEqual(result, mock.sentinel.merge_rv)
+
+    @mock.patch.object(defaults, 'VIDEO_SPLIT_POLL_INTERVAL', 0.01)
+    def test_split_and_process(self):
+        sources = self.tmp_ws.tree['tmp-basename']['sources']
+        sources['source-video.m3u8'] = 's1\ns2\ns3\n'  # previous attempt
+        processed = threading.Event()
+
+        def split(_):
+            sources['source-video.m3u8'] = '#EXTM3U\ns1\ns'
+            # First chunk is transcoded while splitter is still running
+            self.assertTrue(processed.wait(timeout=5))
+            sources['source-video.m3u8'] = '#EXTM3U\ns1\ns2\n#EXT-X-ENDLIST\n'
+
+        def process_segment(fn):
+            processed.set()
+            return f'{fn}_rv'
+
+        with (
+            mock.patch.object(self.strategy, 'analyze_source',
+                              return_value=mock.sentinel.src),
+            mock.patch.object(self.strategy, 'select_profile',
+                              return_value=self.profile),
+            mock.patch.object(self.strategy, 'split',
+                              side_effect=split) as split_mock,
+            mock.patch.object(self.strategy, 'process_segment',
+                              side_effect=process_segment) as m,
+        ):
+            segments, results = self.strategy.split_and_process()
+
+        split_mock.assert_called_once_with(mock.sentinel.src)
+        self.assertListEqual(segments, ['s1', 's2'])
+        self.assertListEqual(results, ['s1_rv', 's2_rv'])
+        self.assertEqual(m.call_count, 2)
+
+    @mock.patch.object(defaults, 'VIDEO_SPLIT_POLL_INTERVAL', 0.01)
+    def test_split_and_process_error(self):
+        sources = self.tmp_ws.tree['tmp-basename']['sources']
+
+        def split(_):
+            sources['source-video.m3u8'] = 's1\n'
+
+        with (
+            mock.patch.object(self.strategy, 'analyze_source'),
+            mock.patch.object(self.strategy, 'select_profile'),
+            mock.patch.object(self.strategy, 'split', side_effect=split),
+            mock.patch.object(self.strategy, 'process_segment',
+                              side_effect=RuntimeError("error")),
+        ):
+            with self.assertRaises(RuntimeError):
+                self.strategy.split_and_process()
+
+    def test_split_and_process_already_split(self):
+        self.write_journal({'sources/split.json': {}})
+        sources = self.tmp_ws.tree['tmp-basename']['sources']
+        sources['source-video.m3u8'] = 's1\ns2'
+        with (
+            mock.patch.object(self.strategy, 'analyze_source',
+                              return_value=mock.sentinel.src),
+            mock.patch.object(self.strategy, 'select_profile'),
+            mock.patch.object(self.strategy, 'split') as split,
+            mock.patch.object(self.strategy, 'process_segments',
+                              return_value=mock.sentinel.rv) as m,
+        ):
+            result = self.strategy.split_and_process()
+
+        split.assert_called_once_with(mock.sentinel.src)
+        m.assert_called_once_with(['s1', 's2'])
+        self.assertEqual(result, (['s1', 's2'], mock.sentinel.rv))
+
+    def test_get_finished_segments(self):
+        self.assertListEqual(self.strategy.get_finished_segments(), [])
+        sources = self.tmp_ws.tree['tmp-basename']['sources']
+        sources['source-video.m3u8'] = '#EXTM3U\n\ns1\ns2\ns3'
+        segments = self.strategy.get_finished_segments()
+        self.assertListEqual(segments, ['s1', 's2'])
+
+    def test_process_segments(self):
+        with mock.patch.object(self.strategy, 'process_segment',
+                               side_effect=lambda fn: f'{fn}_rv') as m:
+            result = self.strategy.process_segments(['s1', 's2'])
+
+        self.assertListEqual(result, ['s1_rv', 's2_rv'])
+        m.assert_has_calls([mock.call('s1'), mock.call('s2')])
+
+    def test_process_segments_progress(self):
+        tracker = self.strategy.tracker = mock.MagicMock()
+        meta = self.make_meta(30.0)
+        # noinspection PyTypeChecker
+        self.write_journal({'results/s1.json': asdict(meta)})
+
+        with mock.patch.object(self.strategy, '_process_segment',
+                               return_value=meta) as m:
+            self.strategy.process_segments(['s1', 's2'])
+
+        m.assert_called_once_with('s2')
+        tracker.update.assert_called_once_with(
+            stage='transcode', chunks=2, done=0)
+        self.assertEqual(tracker.chunk_done.call_count, 2)
+        self.assertIs(self.strategy.get_progress_callback('s2'),
+                      tracker.callback.return_value)
+        tracker.callback.assert_called_once_with('s2')
+
+    def test_progress_callback_speed_gauge(self):
+        tracker = self.strategy.tracker = mock.MagicMock()
+        backend = metrics.MemoryBackend()
+
+        with mock.patch.object(metrics, 'get_metrics', return_value=backend):
+            callback = self.strategy.get_progress_callback('s2', 'transcode')
+            callback(ffmpeg.Progress(speed=2.0))
+
+        tracker.callback.return_value.assert_called_once_with(
+            ffmpeg.Progress(speed=2.0))
+        self.assertEqual(backend.get('ffmpeg_speed', stage='transcode'),
+                         [2.0])
+
+    @mock.patch.object(defaults, 'VIDEO_CHUNK_CONCURRENCY', 4)
+    def test_process_segments_concurrent(self):
+        segments = [f's{i}' for i in range(10)]
+        threads = set()
+
+        def process_segment(fn):
+            threads.add(threading.current_thread().name)
+            # fffw requires an event loop in a thread
+            self.assertIsNotNone(asyncio.get_event_loop())
+            return f'{fn}_rv'
+
+        with mock.patch.object(self.strategy, 'process_segment',
+                               side_effect=process_segment):
+            result = self.strategy.process_segments(segments)
+
+        # results are returned in playlist order
+        self.assertListEqual(result, [f'{fn}_rv' for fn in segments])
+        self.assertNotIn(threading.current_thread().name, threads)
+
+    @mock.patch.object(defaults, 'VIDEO_CHUNK_CONCURRENCY', 2)
+    def test_process_segments_close_loops(self):
+        loops = []
+
+        def process_segment(fn):
+            loops.append(asyncio.get_event_loop())
+            return fn
+
+        with mock.patch.object(self.strategy, 'process_segment',
+                               side_effect=process_segment):
+            self.strategy.process_segments(['s1', 's2', 's3'])
+
+        self.assertTrue(loops)
+        for loop in loops:
+            self.assertTrue(loop.is_closed())
+
+    @mock.patch.object(defaults, 'VIDEO_CHUNK_CONCURRENCY', 2)
+    def test_process_segments_close_connections(self):
+        threads = set()
+
+        def close_all():
+            threads.add(threading.current_thread().name)
+
+        with mock.patch.object(self.strategy, 'process_segment'):
+            with mock.patch('django.db.connections.close_all',
+                            side_effect=close_all) as m:
+                self.strategy.process_segments(['s1', 's2', 's3'])
+
+        self.assertEqual(m.call_count, 3)
+        self.assertNotIn(threading.current_thread().name, threads)
+
+    @mock.patch.object(defaults, 'VIDEO_CHUNK_CONCURRENCY', 2)
+    def test_process_segments_concurrent_error(self):
+        with mock.patch.object(self.strategy, 'process_segment',
+                               side_effect=RuntimeError("error")):
+            with self.assertRaises(RuntimeError):
+                self.strategy.process_segments(['s1', 's2', 's3'])
+
     def test_merge_metadata(self):
         result_meta = None
         segment_meta = self.make_meta(600.0)
@@ -164,8 +366,7 @@ class ResumableStrategyTestCase(base.ProfileMixin, base.MetadataMixin,
     def test_analyze_source_exists(self):
         expected = self.make_meta(30.0)
         # noinspection PyTypeChecker
-        content = json.dumps(asdict(expected))
-        self.tmp_ws.tree['tmp-basename']['sources']['source.json'] = content
+        self.write_journal({'sources/source.json': asdict(expected)})
         with mock.patch.object(self.strategy, '_analyze_source') as m:
             meta = self.strategy.analyze_source()
         m.assert_not_called()
@@ -181,8 +382,8 @@ class ResumableStrategyTestCase(base.ProfileMixin, base.MetadataMixin,
             meta = self.strategy.analyze_source()
         m.assert_called_once_with()
         self.assertEqual(meta, expected)
-        c = self.tmp_ws.tree['tmp-basename']['sources']['source.json']
-        self.assertEqual(c, content)
+        c = self.read_journal()['sources/source.json']
+        self.assertEqual(c, json.loads(content))
 
     def test_analyze_source_call(self):
         t = 'video_transcoding.transcoding.extract.SourceExtractor'
@@ -198,8 +399,7 @@ class ResumableStrategyTestCase(base.ProfileMixin, base.MetadataMixin,
         src = self.make_meta(30.0)
         expected = self.profile
         # noinspection PyTypeChecker
-        content = json.dumps(asdict(expected))
-        self.tmp_ws.tree['tmp-basename']['sources']['profile.json'] = content
+        self.write_journal({'sources/profile.json': asdict(expected)})
         with mock.patch.object(self.strategy, '_select_profile') as m:
             profile = self.strategy.select_profile(src)
         m.assert_not_called()
@@ -215,8 +415,8 @@ class ResumableStrategyTestCase(base.ProfileMixin, base.MetadataMixin,
             profile = self.strategy.select_profile(src)
         m.assert_called_once_with(src)
         self.assertEqual(profile, expected)
-        c = self.tmp_ws.tree['tmp-basename']['sources']['profile.json']
-        self.assertEqual(c, content)
+        c = self.read_journal()['sources/profile.json']
+        self.assertEqual(c, json.loads(content))
 
     def test_select_profile_call(self):
         src = self.make_meta(30.0)
@@ -230,8 +430,7 @@ class ResumableStrategyTestCase(base.ProfileMixin, base.MetadataMixin,
         src = self.make_meta(600.0)
         split = self.make_meta(30.0)
         # noinspection PyTypeChecker
-        content = json.dumps(asdict(split))
-        self.tmp_ws.tree['tmp-basename']['sources']['split.json'] = content
+        self.write_journal({'sources/split.json': asdict(split)})
         with mock.patch.object(self.strategy, '_split') as m:
             result = self.strategy.split(src)
         m.assert_not_called()
@@ -247,8 +446,8 @@ class ResumableStrategyTestCase(base.ProfileMixin, base.MetadataMixin,
             result = self.strategy.split(src)
         m.assert_called_once_with(src)
         self.assertEqual(result, split)
-        c = self.tmp_ws.tree['tmp-basename']['sources']['split.json']
-        self.assertEqual(c, content)
+        c = self.read_journal()['sources/split.json']
+        self.assertEqual(c, json.loads(content))
 
     def test_split_call(self):
         src = self.make_meta(600.0)
@@ -256,10 +455,20 @@ class ResumableStrategyTestCase(base.ProfileMixin, base.MetadataMixin,
         t = 'video_transcoding.transcoding.transcoder.Splitter'
         self.strategy.profile = self.profile
 
-        with mock.patch(t, autospec=True) as m:
+        with (
+            mock.patch(t, autospec=True) as m,
+            mock.patch.object(self.tmp_ws, 'commit') as c,
+        ):
             m.return_value.return_value = split
+            m.return_value.last_progress = None
             result = self.strategy._split(src)
         self.assertEqual(result, split)
+        # playlist is committed after chunks it refers to
+        self.assertEqual(c.call_args_list, [
+            mock.call(self.strategy.video_chunk_file),
+            mock.call(self.strategy.audio_file),
+            mock.call(self.strategy.video_playlist_file),
+        ])
 
         m.assert_called_once_with(
             self.strategy.source_uri,
@@ -268,10 +477,34 @@ class ResumableStrategyTestCase(base.ProfileMixin, base.MetadataMixin,
             meta=src,
             source_video_playlist='source-video.m3u8',
             source_video_chunk='source-video-%05d.mkv',
-            source_audio='source-audio.mkv'
+            source_audio='source-audio.mkv',
+            segment_times=None,
+            progress=None,
         )
         m.return_value.assert_called_once_with()
 
+    @mock.patch.object(defaults, 'VIDEO_SPLIT_KEYFRAMES', True)
+    def test_get_segment_times(self):
+        t = 'video_transcoding.transcoding.keyframes.KeyframePlanner'
+        with mock.patch(t, autospec=True) as m:
+            m.return_value.return_value = [58.0, 121.0]
+            result = self.strategy.get_segment_times()
+
+            self.assertEqual(result, [58.0, 121.0])
+            m.assert_called_once_with(defaults.VIDEO_CHUNK_DURATION)
+            m.return_value.assert_called_once_with(self.strategy.source_uri)
+            stage, = self.strategy.stats
+            self.assertEqual(stage.stage, 'keyframes')
+
+            m.return_value.return_value = []
+            self.assertIsNone(self.strategy.get_segment_times())
+
+            m.return_value.side_effect = RuntimeError("ffprobe returned 1")
+            self.assertIsNone(self.strategy.get_segment_times())
+
+        with mock.patch.object(defaults, 'VIDEO_SPLIT_KEYFRAMES', False):
+            self.assertIsNone(self.strategy.get_segment_times())
+
     def test_get_segment_list(self):
         content = '\n'.join((
             '#M3U8',
@@ -288,8 +521,7 @@ class ResumableStrategyTestCase(base.ProfileMixin, base.MetadataMixin,
     def test_process_segment_exists(self):
         meta = self.make_meta(30.0)
         # noinspection PyTypeChecker
-        content = json.dumps(asdict(meta))
-        self.tmp_ws.tree['tmp-basename']['results']['s1.json'] = content
+        self.write_journal({'results/s1.json': asdict(meta)})
         with mock.patch.object(self.strategy, '_process_segment') as m:
             result = self.strategy.process_segment('s1')
         self.assertEqual(result, meta)
@@ -303,10 +535,98 @@ class ResumableStrategyTestCase(base.ProfileMixin, base.MetadataMixin,
                                return_value=meta) as m:
             result = self.strategy.process_segment('s1')
         self.assertEqual(result, meta)
-        c = self.tmp_ws.tree['tmp-basename']['results']['s1.json']
-        self.assertEqual(c, content)
+        c = self.read_journal()['results/s1.json']
+        self.assertEqual(c, json.loads(content))
         m.assert_called_once_with('s1')
 
+    def test_journal_single_read(self):
+        meta = self.make_meta(30.0)
+        self.write_journal({
+            f'results/{fn}.json': asdict(meta) for fn in ('s1', 's2', 's3')
+        })
+
+        with (
+            mock.patch.object(self.tmp_ws, 'read',
+                              wraps=self.tmp_ws.read) as r,
+            mock.patch.object(self.strategy, '_process_segment') as m,
+        ):
+            result = self.strategy.process_segments(['s1', 's2', 's3'])
+
+        self.assertEqual(result, [meta] * 3)
+        m.assert_not_called()
+        r.assert_called_once_with(self.strategy.journal_file)
+
+    def test_write_checkpoint(self):
+        f = self.strategy.results.file('s1.json')
+        self.assertIsNone(self.strategy.read_checkpoint(f))
+
+        self.strategy.write_checkpoint(f, {'key': 'value'})
+        self.strategy.write_checkpoint(self.strategy.profile_file, {})
+
+        self.assertEqual(self.strategy.read_checkpoint(f), {'key': 'value'})
+        self.assertEqual(self.read_journal(), {
+            'results/s1.json': {'key': 'value'},
+            'sources/profile.json': {},
+        })
+        # no separate checkpoint files are written
+        results = self.tmp_ws.tree['tmp-basename']['results']
+        self.assertNotIn('s1.json', results)
+
+    @mock.patch.object(strategy, 'JOURNAL_MAX_RECORDS', 2)
+    def test_write_checkpoint_merge_records(self):
+        self.write_journal({'sources/source.json': {}})
+        root = self.tmp_ws.tree['tmp-basename']
+
+        for i in range(5):
+            f = self.strategy.results.file(f's{i}.json')
+            self.strategy.write_checkpoint(f, {'index': i})
+            if i == 1:
+                # records are appended without rewriting snapshot
+                self.assertEqual(sorted(root['checkpoints']),
+                                 ['00000001.json', '00000002.json'])
+                self.assertEqual(json.loads(root['checkpoint.json']),
+                                 {'sources/source.json': {}})
+
+        # third record is merged to snapshot with previous ones, next
+        # records are appended until limit is reached again
+        snapshot = json.loads(root['checkpoint.json'])
+        self.assertEqual(len(snapshot), 4)
+        self.assertEqual(sorted(root['checkpoints']),
+                         ['00000001.json', '00000002.json'])
+
+        s = strategy.ResumableStrategy(
+            source_uri=self.strategy.source_uri,
+            basename='basename',
+            preset=profiles.DEFAULT_PRESET,
+        )
+        s.ws = self.tmp_ws
+        s.initialize()
+        for i in range(5):
+            f = s.results.file(f's{i}.json')
+            self.assertEqual(s.read_checkpoint(f), {'index': i})
+        self.assertEqual(s.journal_records, 2)
+
+    def test_resume_reads_count(self):
+        for i in range(100):
+            f = self.strategy.results.file(f's{i}.json')
+            self.strategy.write_checkpoint(f, {'index': i})
+
+        s = strategy.ResumableStrategy(
+            source_uri=self.strategy.source_uri,
+            basename='basename',
+            preset=profiles.DEFAULT_PRESET,
+        )
+        s.ws = self.tmp_ws
+        s.initialize()
+        with mock.patch.object(self.tmp_ws, 'read',
+                               wraps=self.tmp_ws.read) as r:
+            for i in range(100):
+                f = s.results.file(f's{i}.json')
+                self.assertEqual(s.read_checkpoint(f), {'index': i})
+
+        # snapshot and records written after last merge
+        self.assertLessEqual(r.call_count, 1 + strategy.JOURNAL_MAX_RECORDS)
+
     def test_process_segment_call(self):
         src = self.make_meta(30.0)
         dst = self.make_meta(60.0)
@@ -315,9 +635,14 @@ class ResumableStrategyTestCase(base.ProfileMixin, base.MetadataMixin,
         with (
             mock.patch.object(self.strategy, 'get_segment_meta',
                               return_value=src) as m,
-            mock.patch(target, autospec=True) as t
+            mock.patch(target, autospec=True) as t,
+            mock.patch.object(self.tmp_ws, 'get_output_uri',
+                              return_value=urlparse('file:///cache/s1')),
+            mock.patch.object(self.tmp_ws, 'commit') as c,
         ):
             t.return_value.return_value = dst
+            t.return_value.last_progress = ffmpeg.Progress(
+                out_time=30.0, total_size=1_000_000, finished=True)
 
             result = self.strategy._process_segment('s1')
 
@@ -325,24 +650,257 @@ class ResumableStrategyTestCase(base.ProfileMixin, base.MetadataMixin,
             workspace.File('tmp-basename', 'sources', 's1'))
         t.assert_called_once_with(
             'memory:tmp-basename/sources/s1',
-            'memory:tmp-basename/results/s1',
+            'file:///cache/s1',
             profile=self.profile,
-            meta=src
+            meta=src,
+            progress=None,
+        )
+        c.assert_called_once_with(
+            workspace.File('tmp-basename', 'results', 's1'))
+        # metadata refers to durable copy
+        self.assertEqual(result,
+                         replace(dst, uri='memory:tmp-basename/results/s1'))
+        transcode, = self.strategy.stats
+        self.assertEqual(transcode.stage, 'transcode')
+        self.assertEqual(transcode.duration, 30.0)
+        self.assertEqual(transcode.write_bytes, 1_000_000)
+
+    @mock.patch.object(defaults, 'VIDEO_DIRECT_HLS', True)
+    def test_process_segment_direct_hls(self):
+        src = self.make_meta(30.0)
+        dst = self.make_meta(60.0)
+        self.strategy.profile = self.profile
+        target = 'video_transcoding.transcoding.transcoder.HLSTranscoder'
+        with (
+            mock.patch.object(self.strategy, 'get_segment_meta',
+                              return_value=src),
+            mock.patch(target, autospec=True) as t,
+            mock.patch.object(self.tmp_ws, 'commit') as c,
+        ):
+            t.return_value.return_value = dst
+            t.return_value.last_progress = None
+
+            result = self.strategy._process_segment('s1.mkv')
+
+        t.assert_called_once_with(
+            'memory:tmp-basename/sources/s1.mkv',
+            'memory:tmp-basename/results/s1-%v.m3u8',
+            segments='memory:dst-basename/segment-%v-s1-%05d.ts',
+            profile=self.profile,
+            meta=src,
+            progress=None,
+        )
+        c.assert_called_once_with(self.strategy.chunk_playlist_file('s1.mkv'))
+        self.assertEqual(result, dst)
+
+    @mock.patch.object(defaults, 'VIDEO_DIRECT_HLS', True)
+    def test_process_audio_direct_hls(self):
+        src = self.make_meta(30.0)
+        dst = self.make_meta(31.0)
+        # noinspection PyTypeChecker
+        self.write_journal({'sources/split.json': asdict(src)})
+        self.strategy.profile = self.profile
+        target = ('video_transcoding.transcoding.transcoder.'
+                  'HLSAudioTranscoder')
+        with mock.patch(target, autospec=True) as t:
+            t.return_value.return_value = dst
+            t.return_value.last_progress = None
+
+            result = self.strategy._process_audio()
+
+        t.assert_called_once_with(
+            'memory:tmp-basename/sources/source-audio.mkv',
+            'memory:dst-basename/playlist-%v.m3u8',
+            segments='memory:dst-basename/segment-%v-%05d.ts',
+            playlist_type='vod',
+            profile=self.profile,
+            meta=src,
+            progress=None,
         )
         self.assertEqual(result, dst)
 
+    @mock.patch.object(defaults, 'VIDEO_DIRECT_HLS', True)
+    def test_merge_direct_hls(self):
+        self.strategy.profile = self.profile
+        results = self.tmp_ws.tree['tmp-basename']['results']
+        for fn, segments in (('s1', ['0', '1']), ('s2', ['0'])):
+            lines = ['#EXTM3U', '#EXT-X-TARGETDURATION:4']
+            for i in segments:
+                lines.extend(['#EXTINF:4.000000,',
+                              f'segment-v0-{fn}-0000{i}.ts'])
+            lines.append('#EXT-X-ENDLIST')
+            results[f'{fn}-v0.m3u8'] = '\n'.join(lines)
+        src = self.make_meta(30.0)
+        audio = self.make_meta(31.0)
+
+        with (
+            mock.patch.object(self.strategy, 'process_audio',
+                              return_value=audio),
+            mock.patch('video_transcoding.transcoding.transcoder.Segmentor',
+                       autospec=True) as t,
+        ):
+            result = self.strategy.merge(['s1.mkv', 's2.mkv'], src)
+
+        t.assert_not_called()
+        store = self.dst_ws.tree['dst-basename']
+        self.assertEqual(store['playlist-v0.m3u8'], '\n'.join([
+            '#EXTM3U',
+            '#EXT-X-VERSION:3',
+            '#EXT-X-TARGETDURATION:4',
+            '#EXT-X-MEDIA-SEQUENCE:0',
+            '#EXT-X-PLAYLIST-TYPE:VOD',
+            '#EXTINF:4.000000,',
+            'segment-v0-s1-00000.ts',
+            '#EXTINF:4.000000,',
+            'segment-v0-s1-00001.ts',
+            '#EXTINF:4.000000,',
+            'segment-v0-s2-00000.ts',
+            '#EXT-X-ENDLIST',
+            '',
+        ]))
+        self.assertIn('playlist-v0.m3u8', store['index.m3u8'])
+        self.assertEqual(result.uri, 'memory:dst-basename/index.m3u8')
+        self.assertEqual(result.audios, audio.audios)
+        self.assertEqual(result.video.bitrate, self.profile.video[0].max_rate)
+        merge, = self.strategy.stats
+        self.assertEqual(merge.stage, 'merge')
+
+    @mock.patch.object(defaults, 'VIDEO_DIRECT_HLS', True)
+    @mock.patch.object(defaults, 'VIDEO_PROGRESSIVE_HLS', True)
+    def test_publish_playlists(self):
+        self.strategy.profile = self.profile
+        self.strategy.on_publish = mock.Mock()
+        results = self.tmp_ws.tree['tmp-basename']['results']
+        for fn in ('s1', 's2', 's3'):
+            results[f'{fn}-v0.m3u8'] = '\n'.join([
+                '#EXTM3U',
+                '#EXTINF:4.000000,',
+                f'segment-v0-{fn}-00000.ts',
+                '#EXT-X-ENDLIST',
+            ])
+        segments = ['s1.mkv', 's2.mkv', 's3.mkv']
+        meta = asdict(self.make_meta(30.0))
+        s = self.strategy
+
+        def key(fn):
+            return s.checkpoint_key(s.metadata_file(s.results.file(fn)))
+
+        # second chunk is not transcoded yet
+        self.write_journal({key('s1.mkv'): meta, key('s3.mkv'): meta})
+
+        s.segment_done('s1.mkv')
+        with mock.patch.object(s, 'get_finished_segments',
+                               return_value=segments):
+            s.segment_done('s3.mkv')
+
+        store = self.dst_ws.tree['dst-basename']
+        playlist = m3u8.MediaPlaylist.loads(store['playlist-v0.m3u8'])
+        self.assertEqual(playlist.playlist_type, 'EVENT')
+        self.assertFalse(playlist.ended)
+        self.assertEqual([seg.uri for seg in playlist.segments],
+                         ['segment-v0-s1-00000.ts'])
+        self.assertIn('playlist-v0.m3u8', store['index.m3u8'])
+        self.assertIn('playlist-a0.m3u8', store['index.m3u8'])
+        self.strategy.on_publish.assert_called_once_with()
+
+        s.journal = None
+        self.write_journal({key(fn): meta for fn in segments})
+
+        s.publish_playlists(segments)
+
+        playlist = m3u8.MediaPlaylist.loads(store['playlist-v0.m3u8'])
+        self.assertEqual([seg.uri for seg in playlist.segments], [
+            'segment-v0-s1-00000.ts',
+            'segment-v0-s2-00000.ts',
+            'segment-v0-s3-00000.ts',
+        ])
+        # target duration of EVENT playlist is fixed at creation
+        self.assertEqual(playlist.target_duration, s.event_target_duration)
+        self.strategy.on_publish.assert_called_once_with()
+
+    @mock.patch.object(defaults, 'VIDEO_DIRECT_HLS', True)
+    @mock.patch.object(defaults, 'VIDEO_PROGRESSIVE_HLS', True)
+    def test_publish_playlists_error(self):
+        self.strategy.profile = self.profile
+        with mock.patch.object(self.strategy, 'read_checkpoint',
+                               side_effect=RuntimeError("my error")):
+            # does not raise
+            self.strategy.publish_playlists(['s1.mkv'])
+
+        self.assertNotIn('playlist-v0.m3u8',
+                         self.dst_ws.tree['dst-basename'])
+
+    @mock.patch.object(defaults, 'VIDEO_DIRECT_HLS', True)
+    @mock.patch.object(defaults, 'VIDEO_PROGRESSIVE_HLS', True)
+    def test_publish_playlists_lock(self):
+        """
+        Playlists are published with a lock shared by all tasks of a video.
+        """
+        self.strategy.profile = self.profile
+        lock = mock.MagicMock()
+        self.strategy.lock_publishing = lock
+
+        def publish(_):
+            # playlists are modified while lock is acquired
+            lock.return_value.__exit__.assert_not_called()
+
+        with mock.patch.object(self.strategy, '_publish_playlists',
+                               side_effect=publish) as m:
+            self.strategy.publish_playlists(['s1.mkv'])
+
+        m.assert_called_once_with(['s1.mkv'])
+        lock.return_value.__enter__.assert_called_once_with()
+        lock.return_value.__exit__.assert_called_once()
+
+        lock.side_effect = RuntimeError("Video is not processed by task")
+        with mock.patch.object(self.strategy, '_publish_playlists') as m:
+            # does not raise
+            self.strategy.publish_playlists(['s1.mkv'])
+
+        m.assert_not_called()
+
+    @mock.patch.object(defaults, 'VIDEO_DIRECT_HLS', True)
+    @mock.patch.object(defaults, 'VIDEO_PROGRESSIVE_HLS', True)
+    def test_merge_progressive_finalize(self):
+        self.strategy.profile = self.profile
+        results = self.tmp_ws.tree['tmp-basename']['results']
+        results['s1-v0.m3u8'] = '\n'.join([
+            '#EXTM3U',
+            '#EXTINF:4.000000,',
+            'segment-v0-s1-00000.ts',
+        ])
+        store = self.strategy.store
+        event = m3u8.MediaPlaylist(
+            segments=[m3u8.Segment(uri='segment-a0-00000.ts', duration=4.0)],
+            playlist_type='EVENT')
+        store.write(store.root.file('playlist-a0.m3u8'), event.dumps())
+        store.write(store.root.file('playlist-v0.m3u8'), event.dumps())
+        audio = self.make_meta(31.0)
+
+        with mock.patch.object(self.strategy, 'process_audio',
+                               return_value=audio):
+            self.strategy.merge(['s1.mkv'], self.make_meta(30.0))
+
+        tree = self.dst_ws.tree['dst-basename']
+        for name in ('playlist-a0.m3u8', 'playlist-v0.m3u8'):
+            playlist = m3u8.MediaPlaylist.loads(tree[name])
+            self.assertEqual(playlist.playlist_type, 'VOD')
+            self.assertTrue(playlist.ended)
+
     def test_merge_call(self):
         src = self.make_meta(30.0)
         dst = self.make_meta(60.0)
+        concat = 'memory:tmp-basename/results/concat.ffconcat'
         self.strategy.profile = self.profile
         target = 'video_transcoding.transcoding.transcoder.Segmentor'
         with (
             mock.patch.object(
                 self.strategy, 'write_concat_file',
-                return_value='memory:tmp-basename/results/concat.ffconcat') as m,
+                return_value=(concat, True)) as m,
             mock.patch(target, autospec=True) as t
         ):
             t.return_value.return_value = dst
+            t.return_value.last_progress = None
             result = self.strategy.merge(['s1', 's2'], src)
 
         m.assert_called_once_with(['s1', 's2'])
@@ -351,14 +909,161 @@ class ResumableStrategyTestCase(base.ProfileMixin, base.MetadataMixin,
             audio_source='memory:tmp-basename/sources/source-audio.mkv',
             dst='memory:dst-basename/index.m3u8',
             profile=self.profile,
-            meta=src
+            meta=src,
+            copy_audio=False,
+            safe_concat=True,
+            progress=None,
         )
         t.return_value.assert_called_once_with()
-        self.assertEqual(result, dst)
+        self.assertEqual(result,
+                         replace(dst, uri='memory:dst-basename/index.m3u8'))
+
+    def test_merge_fmp4_dash_manifest(self):
+        src = self.make_meta(30.0)
+        dst = self.make_meta(60.0)
+        concat = 'memory:tmp-basename/results/concat.ffconcat'
+        self.profile.container.format = profiles.FMP4
+        self.strategy.profile = self.profile
+        store = self.strategy.store
+        for i in range(2):
+            playlist = m3u8.MediaPlaylist(
+                segments=[m3u8.Segment(uri=f'segment-{i}-00000.m4s',
+                                       duration=4.0)],
+                map_uri=f'init-{i}.mp4',
+            )
+            store.write(store.root.file(f'playlist-{i}.m3u8'),
+                        playlist.dumps())
+        target = 'video_transcoding.transcoding.transcoder.Segmentor'
+        with (
+            mock.patch.object(
+                self.strategy, 'write_concat_file',
+                return_value=(concat, True)),
+            mock.patch(target, autospec=True) as t
+        ):
+            t.return_value.return_value = dst
+            t.return_value.last_progress = None
+            result = self.strategy.merge(['s1', 's2'], src)
+
+        self.assertEqual(result,
+                         replace(dst, uri='memory:dst-basename/index.m3u8'))
+        content = self.dst_ws.tree['dst-basename']['index.mpd']
+        # audio playlist is first, video playlist is second
+        self.assertIn('<Initialization sourceURL="init-0.mp4" />', content)
+        self.assertIn('<SegmentURL media="segment-1-00000.m4s" />', content)
+        self.assertLess(content.index('segment-1-00000.m4s'),
+                        content.index('segment-0-00000.m4s'))
+
+    @mock.patch.object(defaults, 'VIDEO_AUDIO_PREENCODE', True)
+    def test_merge_call_preencoded_audio(self):
+        src = self.make_meta(30.0)
+        audio = self.make_meta(31.0)
+        concat = 'memory:tmp-basename/results/concat.ffconcat'
+        self.strategy.profile = self.profile
+        target = 'video_transcoding.transcoding.transcoder.Segmentor'
+        with (
+            mock.patch.object(
+                self.strategy, 'write_concat_file',
+                return_value=(concat, False)),
+            mock.patch.object(self.strategy, 'process_audio',
+                              return_value=audio),
+            mock.patch(target, autospec=True) as t
+        ):
+            t.return_value.return_value = self.make_meta(60.0)
+            t.return_value.last_progress = None
+            self.strategy.merge(['s1', 's2'], src)
+
+        t.assert_called_once_with(
+            video_source='memory:tmp-basename/results/concat.ffconcat',
+            audio_source='memory:tmp-basename/results/audio.mkv',
+            dst='memory:dst-basename/index.m3u8',
+            profile=self.profile,
+            meta=replace(src, audios=audio.audios),
+            copy_audio=True,
+            safe_concat=False,
+            progress=None,
+        )
+
+    @mock.patch.object(defaults, 'VIDEO_AUDIO_PREENCODE', True)
+    def test_audio_stage(self):
+        started = threading.Event()
+
+        def process_audio():
+            self.assertTrue(started.wait(timeout=5))
+            return mock.sentinel.audio
+
+        with mock.patch.object(self.strategy, 'process_audio',
+                               side_effect=process_audio) as m:
+            with self.strategy.audio_stage():
+                # audio is transcoded in parallel with video
+                started.set()
+        m.assert_called_once_with()
+
+    @mock.patch.object(defaults, 'VIDEO_AUDIO_PREENCODE', True)
+    def test_audio_stage_error(self):
+        with mock.patch.object(self.strategy, 'process_audio',
+                               side_effect=RuntimeError("error")):
+            with self.assertRaises(RuntimeError):
+                with self.strategy.audio_stage():
+                    pass
+
+    def test_audio_stage_disabled(self):
+        with mock.patch.object(self.strategy, 'process_audio') as m:
+            with self.strategy.audio_stage():
+                pass
+        m.assert_not_called()
+
+    def test_process_audio_exists(self):
+        meta = self.make_meta(30.0)
+        # noinspection PyTypeChecker
+        self.write_journal({'results/audio.mkv.json': asdict(meta)})
+        with mock.patch.object(self.strategy, '_process_audio') as m:
+            result = self.strategy.process_audio()
+        self.assertEqual(result, meta)
+        m.assert_not_called()
+
+    def test_process_audio_missing(self):
+        meta = self.make_meta(30.0)
+        # noinspection PyTypeChecker
+        content = json.dumps(asdict(meta))
+        with mock.patch.object(self.strategy, '_process_audio',
+                               return_value=meta) as m:
+            result = self.strategy.process_audio()
+        self.assertEqual(result, meta)
+        c = self.read_journal()['results/audio.mkv.json']
+        self.assertEqual(c, json.loads(content))
+        m.assert_called_once_with()
+
+    def test_process_audio_call(self):
+        src = self.make_meta(30.0)
+        dst = self.make_meta(31.0)
+        # noinspection PyTypeChecker
+        self.write_journal({'sources/split.json': asdict(src)})
+        self.strategy.profile = self.profile
+        target = 'video_transcoding.transcoding.transcoder.AudioTranscoder'
+        with (
+            mock.patch(target, autospec=True) as t,
+            mock.patch.object(self.tmp_ws, 'commit') as c,
+        ):
+            t.return_value.return_value = dst
+            t.return_value.last_progress = None
+
+            result = self.strategy._process_audio()
+
+        t.assert_called_once_with(
+            'memory:tmp-basename/sources/source-audio.mkv',
+            'memory:tmp-basename/results/audio.mkv',
+            profile=self.profile,
+            meta=src,
+            progress=None,
+        )
+        c.assert_called_once_with(self.strategy.audio_result_file)
+        self.assertEqual(
+            result, replace(dst, uri='memory:tmp-basename/results/audio.mkv'))
 
     def test_write_concat_file(self):
         result = self.strategy.write_concat_file(['s1', 's2'])
-        self.assertEqual(result, 'memory:tmp-basename/results/concat.ffconcat')
+        self.assertEqual(result,
+                         ('memory:tmp-basename/results/concat.ffconcat', True))
         content = self.tmp_ws.tree['tmp-basename']['results']['concat.ffconcat']
         self.assertEqual(content, '\n'.join([
             "ffconcat version 1.0",
@@ -366,6 +1071,35 @@ class ResumableStrategyTestCase(base.ProfileMixin, base.MetadataMixin,
             "file 's2'",
         ]))
 
+    def test_write_concat_file_cached(self):
+        def get_input_uri(f):
+            if f.basename == 's2':
+                return urlparse('file:///cache/s2')
+            return self.tmp_ws.get_absolute_uri(f)
+
+        with mock.patch.object(self.tmp_ws, 'get_input_uri',
+                               side_effect=get_input_uri):
+            result = self.strategy.write_concat_file(['s1', 's2'])
+
+        self.assertEqual(result,
+                         ('memory:tmp-basename/results/concat.ffconcat', False))
+        content = self.tmp_ws.tree['tmp-basename']['results']['concat.ffconcat']
+        self.assertEqual(content, '\n'.join([
+            "ffconcat version 1.0",
+            "file 's1'",
+            "file 'file:///cache/s2'",
+        ]))
+
+    @mock.patch.object(defaults, 'VIDEO_LOCAL_CACHE_DIR', '/cache')
+    def test_strategy_init_local_cache(self):
+        s = strategy.ResumableStrategy(
+            source_uri='https://example.com/source.mp4',
+            basename='basename',
+            preset=profiles.DEFAULT_PRESET
+        )
+        self.assertIsInstance(s.ws, workspace.CachedWorkspace)
+        self.assertNotIsInstance(s.store, workspace.CachedWorkspace)
+
     def test_get_segment_meta(self):
         src = workspace.File('tmp-basename', 'sources', 's1')
         meta = self.make_meta(30.0)
@@ -378,3 +1112,155 @@ class ResumableStrategyTestCase(base.ProfileMixin, base.MetadataMixin,
             'memory:tmp-basename/sources/s1'
         )
         self.assertEqual(result, meta)
+
+
+class DistributedStrategyTestCase(base.ProfileMixin, base.MetadataMixin,
+                                  TestCase):
+    def setUp(self):
+        super().setUp()
+        self.profile = self.default_profile()
+        self.fan_out = mock.Mock()
+        self.strategy = strategy.DistributedStrategy(
+            source_uri='https://example.com/source.mp4',
+            basename='basename',
+            preset=profiles.DEFAULT_PRESET,
+            fan_out=self.fan_out,
+        )
+        self.tmp_ws = base.MemoryWorkspace('tmp-basename')
+        self.dst_ws = base.MemoryWorkspace('dst-basename')
+        self.strategy.ws = self.tmp_ws
+        self.strategy.store = self.dst_ws
+        self.strategy.initialize()
+        # noinspection PyTypeChecker
+        journal = {'sources/profile.json': asdict(self.profile)}
+        self.tmp_ws.tree['tmp-basename']['checkpoint.json'] = json.dumps(
+            journal)
+        sources = self.tmp_ws.tree['tmp-basename']['sources']
+        sources['source-video.m3u8'] = 's1\ns2'
+
+    def test_process(self):
+        with mock.patch.object(self.strategy, 'prepare',
+                               return_value=['s1', 's2']) as m:
+            result = self.strategy.process()
+
+        self.assertIsNone(result)
+        m.assert_called_once_with()
+        self.fan_out.assert_called_once_with(['s1', 's2'])
+
+    def test_cleanup(self):
+        self.strategy.cleanup(is_error=False)
+
+        # temporary files are kept for chunk tasks
+        self.assertIn('tmp-basename', self.tmp_ws.tree)
+        self.assertIn('dst-basename', self.dst_ws.tree)
+
+        self.strategy.cleanup(is_error=True)
+
+        self.assertIn('tmp-basename', self.tmp_ws.tree)
+        self.assertEqual(self.dst_ws.tree, {})
+
+    def test_transcode_segment(self):
+        self.strategy.profile = None
+        with mock.patch.object(self.strategy, 'process_segment',
+                               return_value=mock.sentinel.rv) as m:
+            result = self.strategy.transcode_segment('s1')
+
+        self.assertEqual(result, mock.sentinel.rv)
+        m.assert_called_once_with('s1')
+        self.assertEqual(self.strategy.profile, self.profile)
+
+    def test_transcode_segment_progress(self):
+        tracker = self.strategy.tracker = mock.MagicMock()
+        results = self.tmp_ws.tree['tmp-basename']['results']
+        for fn in ('s1', 's1.json', 's2.json', 'audio.mkv.json'):
+            results[fn] = '{}'
+
+        with mock.patch.object(self.strategy, '_process_segment',
+                               return_value=self.make_meta(30.0)):
+            self.strategy.transcode_segment('s3')
+
+        # chunks transcoded by other tasks are counted too
+        tracker.update.assert_called_once_with(done=3)
+        tracker.chunk_done.assert_not_called()
+
+    def test_restore_missing_profile(self):
+        del self.tmp_ws.tree['tmp-basename']['checkpoint.json']
+
+        with self.assertRaises(RuntimeError):
+            self.strategy.restore()
+
+    def test_results_checkpoint_files(self):
+        self.strategy.restore()
+        meta = asdict(self.make_meta(30.0))
+        f = self.strategy.results.file('s1.json')
+        self.assertIsNone(self.strategy.read_checkpoint(f))
+
+        self.strategy.write_checkpoint(f, meta)
+
+        # chunk results are written by multiple tasks, so they are stored
+        # in separate files
+        results = self.tmp_ws.tree['tmp-basename']['results']
+        self.assertEqual(json.loads(results['s1.json']), json.loads(
+            json.dumps(meta)))
+        self.assertEqual(self.strategy.read_checkpoint(f), meta)
+        journal = self.tmp_ws.tree['tmp-basename']['checkpoint.json']
+        self.assertNotIn('results/s1.json', json.loads(journal))
+
+    def test_checkpoint_exists_single_listing(self):
+        results = self.tmp_ws.tree['tmp-basename']['results']
+        for fn in ('s1', 's2'):
+            results[f'{fn}.json'] = '{}'
+        self.strategy.restore()
+
+        with (
+            mock.patch.object(self.tmp_ws, 'list_collection',
+                              wraps=self.tmp_ws.list_collection) as lc,
+            mock.patch.object(self.tmp_ws, 'exists') as ex,
+        ):
+            for fn in ('s1', 's2', 's3'):
+                f = self.strategy.results.file(f'{fn}.json')
+                self.assertEqual(self.strategy.checkpoint_exists(f),
+                                 fn != 's3')
+
+        ex.assert_not_called()
+        lc.assert_called_once_with(
+            workspace.Collection('tmp-basename', 'results'))
+
+    def test_transcode_audio(self):
+        with mock.patch.object(self.strategy, 'process_audio',
+                               return_value=mock.sentinel.rv) as m:
+            result = self.strategy.transcode_audio()
+
+        self.assertEqual(result, mock.sentinel.rv)
+        m.assert_called_once_with()
+        self.assertEqual(self.strategy.profile, self.profile)
+
+    def test_finalize(self):
+        results = self.tmp_ws.tree['tmp-basename']['results']
+        for fn, duration in (('s1', 30.0), ('s2', 20.0)):
+            # noinspection PyTypeChecker
+            results[f'{fn}.json'] = json.dumps(asdict(self.make_meta(duration)))
+
+        with mock.patch.object(self.strategy, 'merge',
+                               return_value=mock.sentinel.rv) as m:
+            result = self.strategy.finalize()
+
+        self.assertEqual(result, mock.sentinel.rv)
+        m.assert_called_once_with(['s1', 's2'],
+                                  meta=self.make_meta(30.0, 20.0))
+        self.assertEqual(self.tmp_ws.tree, {})
+        self.assertIn('dst-basename', self.dst_ws.tree)
+
+    def test_finalize_missing_segment(self):
+        results = self.tmp_ws.tree['tmp-basename']['results']
+        # noinspection PyTypeChecker
+        results['s1.json'] = json.dumps(asdict(self.make_meta(30.0)))
+
+        with mock.patch.object(self.strategy, 'merge') as m:
+            with self.assertRaises(RuntimeError):
+                self.strategy.finalize()
+
+        m.assert_not_called()
+        # temporary files are kept to resume processing
+        self.assertIn('tmp-basename', self.tmp_ws.tree)
+        self.assertEqual(self.dst_ws.tree, {})
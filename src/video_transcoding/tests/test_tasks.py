@@ -6,7 +6,7 @@ from uuid import UUID, uuid4
 from billiard.exceptions import SoftTimeLimitExceeded
 from celery.exceptions import Retry
 
-from video_transcoding import models, tasks
+from video_transcoding import models, tasks, defaults, progress, metrics
 from video_transcoding.tests import base
 from video_transcoding.transcoding import profiles
 
@@ -59,6 +59,52 @@ class TranscodeTaskVideoStateTestCase(base.BaseTestCase):
         self.assertEqual(self.video.task_id, UUID(result.task_id))
         self.assertIsNotNone(self.video.basename)
 
+    def test_lock_video_reset_progress(self):
+        self.video.progress = {'stage': 'merge'}
+        self.video.save()
+
+        self.run_task()
+
+        video = self.handle_mock.call_args[0][0]
+        self.assertIsNone(video.progress)
+
+    def test_lock_video_reset_published(self):
+        self.video.published = True
+        self.video.save()
+
+        self.run_task()
+
+        video = self.handle_mock.call_args[0][0]
+        self.assertFalse(video.published)
+        self.video.refresh_from_db()
+        self.assertFalse(self.video.published)
+
+    def test_mark_published(self):
+        self.video.change_status(models.Video.PROCESS)
+
+        tasks.TranscodeVideo.mark_published(self.video.pk, uuid4())
+        self.video.refresh_from_db()
+        self.assertFalse(self.video.published)
+
+        tasks.TranscodeVideo.mark_published(self.video.pk,
+                                            self.video.task_id)
+        self.video.refresh_from_db()
+        self.assertTrue(self.video.published)
+
+    def test_lock_published(self):
+        self.video.change_status(models.Video.PROCESS)
+        lock = tasks.TranscodeVideo.lock_published
+
+        with self.assertRaises(RuntimeError):
+            with lock(self.video.pk, uuid4()):
+                self.fail("foreign video locked")  # pragma: no cover
+
+        with mock.patch.object(models.Video.objects, 'select_for_update',
+                               wraps=models.Video.objects.select_for_update
+                               ) as m:
+            with lock(self.video.pk, self.video.task_id):
+                m.assert_called_once_with()
+
     def test_mark_error(self):
         """
         Video transcoding failed with ERROR status and error message saved.
@@ -72,6 +118,27 @@ class TranscodeTaskVideoStateTestCase(base.BaseTestCase):
         self.assertEqual(self.video.status, models.Video.ERROR)
         self.assertEqual(self.video.error, repr(error))
 
+    def test_task_metrics(self):
+        """
+        Task results and in-flight tasks are counted.
+        """
+        backend = metrics.MemoryBackend()
+        with mock.patch.object(metrics, 'get_metrics', return_value=backend):
+            self.run_task()
+            self.video.change_status(models.Video.QUEUED)
+            self.handle_mock.side_effect = RuntimeError("my error")
+            self.run_task()
+            # postrun signal doesn't get task state for eager apply(throw=True)
+            tasks.transcode_video.apply(task_id=str(self.video.task_id),
+                                        args=(self.video.id,))
+
+        labels = {'task': 'TranscodeVideo'}
+        self.assertEqual(backend.get('tasks_in_progress', **labels),
+                         [1, -1] * 3)
+        for status in ('success', 'error', 'retry'):
+            self.assertEqual(
+                backend.get('tasks_total', status=status, **labels), [1])
+
     def test_skip_incorrect_status(self):
         """
         Unexpected video statuses lead to task retry.
@@ -152,6 +219,24 @@ class TranscodeTaskVideoStateTestCase(base.BaseTestCase):
         self.assertEqual(self.video.error, repr(exc))
         self.retry_mock.assert_called_once_with(countdown=10)
 
+    @mock.patch.object(defaults, 'VIDEO_TRANSCODING_STRATEGY',
+                       tasks.DISTRIBUTED)
+    def test_keep_status_for_chunk_tasks(self):
+        """
+        Video status is changed by merge callback in distributed mode.
+        """
+        self.handle_mock.return_value = None
+
+        self.run_task()
+
+        self.video.refresh_from_db()
+        self.assertEqual(self.video.status, models.Video.PROCESS)
+        self.assertIsNone(self.video.error)
+
+    @mock.patch.object(defaults, 'VIDEO_PROGRESS_INTERVAL', 0)
+    def test_init_tracker_disabled(self):
+        self.assertIsNone(tasks.transcode_video.init_tracker(self.video))
+
     def test_init_preset_default(self):
         preset = tasks.transcode_video.init_preset(None)
         self.assertEqual(preset, profiles.DEFAULT_PRESET)
@@ -298,7 +383,17 @@ class ProcessVideoTestCase(base.MetadataMixin, base.BaseTestCase):
             source_uri=self.video.source,
             basename=self.video.basename.hex,
             preset=tasks.transcode_video.init_preset(self.video.preset),
+            tracker=mock.ANY,
+            on_publish=mock.ANY,
+            lock_publishing=mock.ANY,
         )
+        tracker = self.strategy_mock.call_args.kwargs['tracker']
+        self.assertIsInstance(tracker, progress.VideoProgressTracker)
+        self.assertEqual(tracker.video_id, self.video.pk)
+        kwargs = self.strategy_mock.call_args.kwargs
+        args = (self.video.pk, self.video.task_id)
+        self.assertEqual(kwargs['on_publish'].args, args)
+        self.assertEqual(kwargs['lock_publishing'].args, args)
         self.strategy_mock.return_value.assert_called_once_with()
 
         # noinspection PyTypeChecker
@@ -310,3 +405,283 @@ class ProcessVideoTestCase(base.MetadataMixin, base.BaseTestCase):
         duration = min(s['duration'] for s in streams)
         expected['duration'] = duration
         self.assertEqual(result, expected)
+
+    def test_process_video_stats(self):
+        self.strategy_mock.return_value.stats = [
+            metrics.StageStats('analyze', wall_time=1.0),
+            metrics.StageStats('transcode', wall_time=10.0, duration=30.0),
+        ]
+
+        result = self.run_task()
+
+        self.assertEqual(result['stats']['analyze']['wall_time'], 1.0)
+        self.assertEqual(result['stats']['transcode']['realtime_factor'],
+                         3.0)
+
+    @mock.patch.object(defaults, 'VIDEO_TRANSCODING_STRATEGY',
+                       tasks.DISTRIBUTED)
+    def test_process_video_distributed(self):
+        target = 'video_transcoding.strategy.DistributedStrategy'
+        with mock.patch(target) as m:
+            m.return_value.return_value = None
+            result = self.run_task()
+
+        self.assertIsNone(result)
+        m.return_value.assert_called_once_with()
+        fan_out = m.call_args.kwargs['fan_out']
+        self.assertEqual(fan_out.args, (self.video.pk,))
+        self.strategy_mock.assert_not_called()
+
+    @mock.patch('celery.chord')
+    def test_fan_out(self, m: mock.Mock):
+        task_id = str(uuid4())
+        tasks.transcode_video.push_request(id=task_id)
+        try:
+            tasks.transcode_video.fan_out(self.video.pk, ['s1', 's2'])
+        finally:
+            tasks.transcode_video.pop_request()
+
+        m.assert_called_once_with([
+            tasks.transcode_segment.si(self.video.pk, task_id, 's1'),
+            tasks.transcode_segment.si(self.video.pk, task_id, 's2'),
+        ])
+        m.return_value.assert_called_once_with(
+            tasks.merge_segments.si(self.video.pk, task_id))
+
+
+    @mock.patch('celery.chord')
+    def test_fan_out_priority_queue(self, m: mock.Mock):
+        task_id = str(uuid4())
+        rk = 'video_transcoding.0'
+        tasks.transcode_video.push_request(
+            id=task_id, delivery_info={'routing_key': rk})
+        try:
+            tasks.transcode_video.fan_out(self.video.pk, ['s1'])
+        finally:
+            tasks.transcode_video.pop_request()
+
+        m.assert_called_once_with([
+            tasks.transcode_segment.si(self.video.pk, task_id, 's1').set(
+                routing_key=rk),
+        ])
+        m.return_value.assert_called_once_with(
+            tasks.merge_segments.si(self.video.pk, task_id).set(
+                routing_key=rk))
+
+    @mock.patch.object(defaults, 'VIDEO_AUDIO_PREENCODE', True)
+    @mock.patch('celery.chord')
+    def test_fan_out_audio(self, m: mock.Mock):
+        task_id = str(uuid4())
+        tasks.transcode_video.push_request(id=task_id)
+        try:
+            tasks.transcode_video.fan_out(self.video.pk, ['s1'])
+        finally:
+            tasks.transcode_video.pop_request()
+
+        m.assert_called_once_with([
+            tasks.transcode_audio.si(self.video.pk, task_id),
+            tasks.transcode_segment.si(self.video.pk, task_id, 's1'),
+        ])
+
+
+class RouteVideoTestCase(base.MetadataMixin, base.BaseTestCase):
+    """ Tests source analysis for priority routing."""
+
+    def setUp(self):
+        super().setUp()
+        self.video = models.Video.objects.create(
+            status=models.Video.QUEUED,
+            task_id=uuid4(),
+            source='ftp://ya.ru/1.mp4')
+        self.tiers_patcher = mock.patch.object(
+            defaults, 'VIDEO_PRIORITY_TIERS', [5.0, 60.0])
+        self.tiers_patcher.start()
+        self.extractor_patcher = mock.patch(
+            'video_transcoding.transcoding.extract.SourceExtractor')
+        self.extractor_mock = self.extractor_patcher.start()
+        self.get_meta_data = self.extractor_mock.return_value.get_meta_data
+        self.get_meta_data.return_value = self.make_meta(120.0)
+
+    def tearDown(self):
+        super().tearDown()
+        self.tiers_patcher.stop()
+        self.extractor_patcher.stop()
+
+    def run_task(self):
+        return tasks.route_video.apply(task_id=str(self.video.task_id),
+                                       args=(self.video.pk,),
+                                       throw=True)
+
+    def test_route_video(self):
+        self.run_task()
+
+        self.get_meta_data.assert_called_once_with(self.video.source)
+        self.apply_async_mock.assert_called_once_with(
+            args=(self.video.pk,),
+            countdown=10,
+            routing_key='video_transcoding.0')
+        self.video.refresh_from_db()
+        self.assertEqual(self.video.status, models.Video.QUEUED)
+        result = self.apply_async_mock.return_value
+        self.assertEqual(self.video.task_id, UUID(result.task_id))
+
+    def test_analysis_error(self):
+        self.get_meta_data.side_effect = RuntimeError()
+
+        self.run_task()
+
+        self.apply_async_mock.assert_called_once_with(
+            args=(self.video.pk,),
+            countdown=10)
+
+    def test_skip_resent_video(self):
+        task_id = str(self.video.task_id)
+        self.video.task_id = uuid4()
+        self.video.save()
+
+        tasks.route_video.apply(task_id=task_id, args=(self.video.pk,),
+                                throw=True)
+
+        self.get_meta_data.assert_not_called()
+        self.apply_async_mock.assert_not_called()
+
+
+class DistributedTasksTestCase(base.MetadataMixin, base.BaseTestCase):
+    """
+    Tests chunk transcoding and merge tasks.
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.task_id = str(uuid4())
+        self.video = models.Video.objects.create(
+            status=models.Video.PROCESS,
+            task_id=self.task_id,
+            basename=uuid4(),
+            source='ftp://ya.ru/1.mp4')
+        self.strategy_patcher = mock.patch(
+            'video_transcoding.strategy.DistributedStrategy')
+        self.strategy_mock = self.strategy_patcher.start()
+        self.retry_patcher = mock.patch.object(
+            tasks.MediaSubtask, 'retry', side_effect=Retry)
+        self.retry_mock = self.retry_patcher.start()
+
+    def tearDown(self):
+        super().tearDown()
+        self.strategy_patcher.stop()
+        self.retry_patcher.stop()
+
+    def test_transcode_segment(self):
+        result = tasks.transcode_segment.apply(
+            args=(self.video.pk, self.task_id, 's1'), throw=True)
+
+        self.assertIsNone(result.result)
+        self.strategy_mock.assert_called_once_with(
+            source_uri=self.video.source,
+            basename=self.video.basename.hex,
+            preset=profiles.DEFAULT_PRESET,
+            tracker=mock.ANY,
+            on_publish=mock.ANY,
+            lock_publishing=mock.ANY,
+        )
+        method = self.strategy_mock.return_value.transcode_segment
+        method.assert_called_once_with('s1')
+        tracker = self.strategy_mock.call_args.kwargs['tracker']
+        self.assertIsInstance(tracker, progress.SubtaskProgressTracker)
+        self.video.refresh_from_db()
+        self.assertEqual(self.video.status, models.Video.PROCESS)
+
+    def test_transcode_segment_error(self):
+        error = RuntimeError("my error")
+        method = self.strategy_mock.return_value.transcode_segment
+        method.side_effect = error
+
+        tasks.transcode_segment.apply(
+            args=(self.video.pk, self.task_id, 's1'), throw=True)
+
+        self.video.refresh_from_db()
+        self.assertEqual(self.video.status, models.Video.ERROR)
+        self.assertEqual(self.video.error, repr(error))
+
+        # Next failed chunk doesn't change error
+        method.side_effect = RuntimeError("another")
+        models.Video.objects.filter(pk=self.video.pk).update(
+            status=models.Video.PROCESS, task_id=uuid4())
+
+        tasks.transcode_segment.apply(
+            args=(self.video.pk, self.task_id, 's2'), throw=True)
+
+        self.video.refresh_from_db()
+        self.assertEqual(self.video.error, repr(error))
+
+    def test_transcode_segment_retry(self):
+        method = self.strategy_mock.return_value.transcode_segment
+        method.side_effect = SoftTimeLimitExceeded()
+
+        with self.assertRaises(Retry):
+            tasks.transcode_segment.apply(
+                args=(self.video.pk, self.task_id, 's1'), throw=True)
+
+        self.video.refresh_from_db()
+        self.assertEqual(self.video.status, models.Video.PROCESS)
+
+    def test_transcode_segment_skip(self):
+        self.video.change_status(models.Video.ERROR)
+
+        tasks.transcode_segment.apply(
+            args=(self.video.pk, self.task_id, 's1'), throw=True)
+
+        self.strategy_mock.assert_not_called()
+
+    def test_transcode_audio(self):
+        result = tasks.transcode_audio.apply(
+            args=(self.video.pk, self.task_id), throw=True)
+
+        self.assertIsNone(result.result)
+        method = self.strategy_mock.return_value.transcode_audio
+        method.assert_called_once_with()
+
+    def test_transcode_audio_error(self):
+        error = RuntimeError("my error")
+        method = self.strategy_mock.return_value.transcode_audio
+        method.side_effect = error
+
+        result = tasks.transcode_audio.apply(
+            args=(self.video.pk, self.task_id), throw=True)
+
+        self.assertEqual(result.result, repr(error))
+        self.video.refresh_from_db()
+        self.assertEqual(self.video.status, models.Video.ERROR)
+
+    def test_merge_segments(self):
+        meta = self.make_meta(30.0)
+        self.strategy_mock.return_value.finalize.return_value = meta
+
+        tasks.merge_segments.apply(
+            args=(self.video.pk, self.task_id), throw=True)
+
+        self.strategy_mock.return_value.finalize.assert_called_once_with()
+        self.video.refresh_from_db()
+        self.assertEqual(self.video.status, models.Video.DONE)
+        self.assertEqual(self.video.duration, timedelta(seconds=30.0))
+        self.assertEqual(self.video.metadata,
+                         tasks.transcode_video.get_video_metadata(meta))
+
+    def test_merge_segments_error(self):
+        error = RuntimeError("missing segment")
+        self.strategy_mock.return_value.finalize.side_effect = error
+
+        tasks.merge_segments.apply(
+            args=(self.video.pk, self.task_id), throw=True)
+
+        self.video.refresh_from_db()
+        self.assertEqual(self.video.status, models.Video.ERROR)
+        self.assertEqual(self.video.error, repr(error))
+
+    def test_merge_segments_skip(self):
+        self.video.change_status(models.Video.ERROR)
+
+        tasks.merge_segments.apply(
+            args=(self.video.pk, self.task_id), throw=True)
+
+        self.strategy_mock.assert_not_called()
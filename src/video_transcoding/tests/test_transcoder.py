@@ -15,6 +15,7 @@ from video_transcoding.transcoding import (
     inputs,
     codecs,
     outputs,
+    ffmpeg,
 )
 
 
@@ -44,20 +45,75 @@ class TranscoderTestCase(ProcessorBaseTestCase):
         m.assert_called_once_with()
 
     def test_process(self):
+        ff = mock.MagicMock()
         with (
             mock.patch.object(self.transcoder, 'prepare_ffmpeg',
-                              return_value=mock.sentinel.ff) as prepare_ffmpeg,
+                              return_value=ff) as prepare_ffmpeg,
             mock.patch.object(self.transcoder, 'run') as run,
+            mock.patch.object(self.transcoder, 'get_encoded_metadata',
+                              return_value=mock.sentinel.rv) as get_encoded,
             mock.patch.object(self.transcoder, 'get_result_metadata',
-                              return_value=mock.sentinel.rv) as get_result_metadata
+                              ) as get_result_metadata
         ):
             result = self.transcoder.process()
 
         prepare_ffmpeg.assert_called_once_with(self.meta)
-        run.assert_called_once_with(mock.sentinel.ff)
-        get_result_metadata.assert_called_once_with('dst.ts')
+        run.assert_called_once_with(ff)
+        get_encoded.assert_called_once_with(ff)
+        get_result_metadata.assert_not_called()
         self.assertEqual(result, mock.sentinel.rv)
 
+    def test_process_verify(self):
+        encoded = self.make_meta(30.0, uri='dst.ts')
+        probed = self.make_meta(30.0, uri='dst.ts')
+        probed.videos[0].frames += 1
+        with (
+            mock.patch.object(defaults, 'VIDEO_VERIFY_RESULTS', True),
+            mock.patch.object(self.transcoder, 'prepare_ffmpeg'),
+            mock.patch.object(self.transcoder, 'run'),
+            mock.patch.object(self.transcoder, 'get_encoded_metadata',
+                              return_value=encoded),
+            mock.patch.object(self.transcoder, 'get_result_metadata',
+                              return_value=probed) as get_result_metadata,
+            self.assertLogs(self.transcoder.logger, 'WARNING') as logs,
+        ):
+            result = self.transcoder.process()
+
+        get_result_metadata.assert_called_once_with('dst.ts')
+        self.assertEqual(result, probed)
+        self.assertIn("Frames mismatch", logs.output[0])
+
+    def test_get_encoded_metadata(self):
+        self.profile.video.append(
+            replace(self.profile.video[0], id='v2', frame_rate=25.0))
+        ff = self.transcoder.prepare_ffmpeg(self.meta)
+        self.transcoder.last_progress = ffmpeg.Progress(frame=899,
+                                                        finished=True)
+
+        result = self.transcoder.get_encoded_metadata(ff)
+
+        self.assertEqual(result.uri, 'dst.ts')
+        self.assertEqual(result.audios, [])
+        self.assertEqual(len(result.videos), 2)
+        first, second = result.videos
+        src = self.meta.video
+        self.assertEqual(first.duration, src.duration)
+        self.assertEqual(first.start, src.start)
+        self.assertEqual(first.scenes, src.scenes)
+        self.assertEqual(first.width, self.profile.video[0].width)
+        self.assertEqual(first.height, self.profile.video[0].height)
+        self.assertEqual(first.frames, 899)
+        self.assertEqual(first.bitrate, 0)
+        self.assertEqual(second.frame_rate, 25.0)
+        self.assertEqual(second.frames, 750)
+
+    def test_get_encoded_metadata_without_progress(self):
+        ff = self.transcoder.prepare_ffmpeg(self.meta)
+
+        result = self.transcoder.get_encoded_metadata(ff)
+
+        self.assertEqual(result.video.frames, 900)
+
     def test_run(self):
         ff = mock.MagicMock()
         ff.run.return_value = (0, 'output', 'error')
@@ -78,6 +134,46 @@ class TranscoderTestCase(ProcessorBaseTestCase):
         self.assertEqual(ctx.exception.args[0],
                          'invalid ffmpeg return code 2')
 
+    def test_run_progress(self):
+        callback = mock.MagicMock()
+        self.transcoder.progress = callback
+        ff = self.transcoder.prepare_ffmpeg(self.meta)
+
+        with mock.patch.object(ff, 'runner') as runner:
+            runner.return_value.return_value = (0, '', '')
+            self.transcoder.run(ff)
+
+        args = runner.call_args.args
+        self.assertIn(b'-progress', args)
+        self.assertEqual(args[args.index(b'-progress') + 1], b'pipe:1')
+        ff.handle_stdout('frame=10\n')
+        ff.handle_stdout('progress=end\n')
+        callback.assert_called_once_with(
+            ffmpeg.Progress(frame=10, finished=True))
+
+    def test_run_error_progress(self):
+        """
+        Failed ffmpeg without final progress report is reported as finished.
+        """
+        callback = mock.MagicMock()
+        self.transcoder.progress = callback
+        ff = self.transcoder.prepare_ffmpeg(self.meta)
+
+        def run():
+            ff.handle_stdout('speed=2.0x\n')
+            ff.handle_stdout('progress=continue\n')
+            return 1, '', 'error'
+
+        with mock.patch.object(ff, 'runner') as runner:
+            runner.return_value.side_effect = run
+            with self.assertRaises(RuntimeError):
+                self.transcoder.run(ff)
+
+        self.assertEqual(callback.call_args_list, [
+            mock.call(ffmpeg.Progress(speed=2.0)),
+            mock.call(ffmpeg.Progress(speed=2.0, finished=True)),
+        ])
+
     def test_prepare_ffmpeg(self):
         with (
             mock.patch.object(
@@ -210,6 +306,75 @@ class TranscoderTestCase(ProcessorBaseTestCase):
         self.assertEqual(result, self.meta)
 
 
+class AudioTranscoderTestCase(ProcessorBaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.transcoder = transcoder.AudioTranscoder(
+            'src.mkv',
+            'dst.mkv',
+            profile=self.profile,
+            meta=self.meta,
+        )
+
+    def test_process(self):
+        with (
+            mock.patch.object(self.transcoder, 'prepare_ffmpeg',
+                              return_value=mock.sentinel.ff) as prepare_ffmpeg,
+            mock.patch.object(self.transcoder, 'run') as run,
+            mock.patch.object(self.transcoder, 'get_result_metadata',
+                              return_value=mock.sentinel.rv) as get_result_metadata
+        ):
+            result = self.transcoder.process()
+
+        prepare_ffmpeg.assert_called_once_with(self.meta)
+        run.assert_called_once_with(mock.sentinel.ff)
+        get_result_metadata.assert_called_once_with('dst.mkv')
+        self.assertEqual(result, mock.sentinel.rv)
+
+    def test_get_result_metadata(self):
+        target = 'video_transcoding.transcoding.extract.AudioResultExtractor'
+        with mock.patch(target, autospec=True) as m:
+            m.return_value.get_meta_data.return_value = self.meta
+
+            result = self.transcoder.get_result_metadata('uri')
+
+        m.assert_called_once_with()
+        m.return_value.get_meta_data.assert_called_once_with('uri')
+        self.assertEqual(result, self.meta)
+
+    def test_prepare_ffmpeg(self):
+        self.profile.audio.append(profiles.AudioTrack(
+            codec='libfdk_aac',
+            id='a2',
+            bitrate=64_000,
+            channels=1,
+            sample_rate=44100,
+        ))
+
+        ff = self.transcoder.prepare_ffmpeg(self.meta)
+
+        expected = [
+            '-loglevel', 'level+info', '-y',
+            '-i', 'src.mkv',
+            '-map', '0:a:0',
+            '-c:a:0', 'libfdk_aac',
+            '-b:a:0', 128000,
+            '-ar:a:0', 48000,
+            '-ac:a:0', 2,
+            '-map', '0:a:0',
+            '-c:a:1', 'libfdk_aac',
+            '-b:a:1', 64000,
+            '-ar:a:1', 44100,
+            '-ac:a:1', 1,
+            '-vn',
+            '-f', 'matroska',
+            '-copyts', '-avoid_negative_ts', 'disabled',
+            '-method', 'PUT',
+            'dst.mkv',
+        ]
+        self.assertEqual(ff.get_args(), ensure_binary(expected))
+
+
 class SplitterTestCase(ProcessorBaseTestCase):
 
     def setUp(self):
@@ -269,6 +434,86 @@ class SplitterTestCase(ProcessorBaseTestCase):
         ]
         self.assertEqual(ff.get_args(), ensure_binary(expected))
 
+    def test_prepare_ffmpeg_segment_times(self):
+        self.splitter.segment_times = [58.04, 121.0]
+
+        ff = self.splitter.prepare_ffmpeg(self.meta)
+
+        args = ff.get_args()
+        self.assertNotIn(b'-segment_time', args)
+        index = args.index(b'-segment_times')
+        self.assertEqual(args[index + 1], b'58.040000,121.000000')
+
+
+class HLSTranscoderTestCase(ProcessorBaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.transcoder = transcoder.HLSTranscoder(
+            'src.ts',
+            '/results/s1-%v.m3u8',
+            segments='/dst/segment-%v-s1-%05d.ts',
+            profile=self.profile,
+            meta=self.meta,
+        )
+
+    def test_get_result_metadata(self):
+        target = 'video_transcoding.transcoding.extract.HLSExtractor'
+        with mock.patch(target, autospec=True) as m:
+            m.return_value.get_meta_data.return_value = self.meta
+
+            result = self.transcoder.get_result_metadata('/results/s1-%v.m3u8')
+
+        m.return_value.get_meta_data.assert_called_once_with(
+            '/results/s1-v0.m3u8')
+        self.assertEqual(result.videos, self.meta.videos)
+        self.assertEqual(result.audios, [])
+
+    def test_prepare_ffmpeg(self):
+        ff = self.transcoder.prepare_ffmpeg(self.meta)
+
+        args = ff.get_args()
+        self.assertEqual(args[-14:], ensure_binary([
+            '-copyts', '-avoid_negative_ts', 'disabled',
+            '-hls_time', self.profile.container.segment_duration,
+            '-hls_playlist_type', 'vod',
+            '-var_stream_map', 'v:0,name:v0',
+            '-hls_segment_filename', '/dst/segment-%v-s1-%05d.ts',
+            '-muxdelay', '0',
+            '/results/s1-%v.m3u8',
+        ]))
+
+
+class HLSAudioTranscoderTestCase(ProcessorBaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.transcoder = transcoder.HLSAudioTranscoder(
+            'audio.mkv',
+            '/dst/playlist-%v.m3u8',
+            segments='/dst/segment-%v-%05d.ts',
+            profile=self.profile,
+            meta=self.meta,
+        )
+
+    def test_get_result_metadata(self):
+        target = 'video_transcoding.transcoding.extract.HLSExtractor'
+        with mock.patch(target, autospec=True) as m:
+            m.return_value.get_meta_data.return_value = self.meta
+
+            result = self.transcoder.get_result_metadata(
+                '/dst/playlist-%v.m3u8')
+
+        m.return_value.get_meta_data.assert_called_once_with(
+            '/dst/playlist-a0.m3u8')
+        self.assertEqual(result.audios, self.meta.audios)
+        self.assertEqual(result.videos, [])
+
+    def test_prepare_ffmpeg(self):
+        ff = self.transcoder.prepare_ffmpeg(self.meta)
+
+        args = ff.get_args()
+        self.assertIn(b'a:0,name:a0', args)
+        self.assertEqual(args[-1], b'/dst/playlist-%v.m3u8')
+
 
 class SegmentorTestCase(ProcessorBaseTestCase):
 
@@ -343,3 +588,91 @@ class SegmentorTestCase(ProcessorBaseTestCase):
             '/dst/playlist-%v.m3u8'
         ]
         self.assertEqual(ff.get_args(), ensure_binary(expected))
+
+    def test_prepare_ffmpeg_unsafe_concat(self):
+        self.segmentor.safe_concat = False
+
+        ff = self.segmentor.prepare_ffmpeg(self.meta)
+
+        args = ff.get_args()
+        self.assertEqual(args[3:7], ensure_binary([
+            '-safe', '0', '-i', '/results/source-video.m3u8',
+        ]))
+
+    def test_prepare_ffmpeg_copy_audio(self):
+        self.segmentor.copy_audio = True
+        self.meta.audios.append(deepcopy(self.meta.audio))
+        self.profile.audio.append(profiles.AudioTrack(
+            codec='libfdk_aac',
+            id='a2',
+            bitrate=64_000,
+            channels=1,
+            sample_rate=44100,
+        ))
+
+        ff = self.segmentor.prepare_ffmpeg(self.meta)
+        vsm = ' '.join([
+            'a:0,agroup:a0:bandwidth:128000',
+            'a:1,agroup:a1:bandwidth:64000',
+            'v:0,agroup:a0:bandwidth:1500000',
+            'v:0,agroup:a1:bandwidth:1500000',
+        ])
+
+        expected = [
+            '-loglevel', 'level+info', '-y',
+            '-i', '/results/source-video.m3u8',
+            '-i', '/sources/source-audio.mkv',
+            '-map', '0:v:0',
+            '-c:v:0', 'copy',
+            '-b:v:0', 1500000,
+            '-map', '1:a:0',
+            '-c:a:0', 'copy',
+            '-b:a:0', 128000,
+            '-map', '1:a:1',
+            '-c:a:1', 'copy',
+            '-b:a:1', 64000,
+            '-copyts', '-avoid_negative_ts', 'auto',
+            '-hls_time', 1.0,
+            '-hls_playlist_type', 'vod',
+            '-var_stream_map', vsm,
+            '-hls_segment_filename', '/dst/segment-%v-%05d.ts',
+            '-muxdelay', 0,
+            '-reset_timestamps', 1,
+            '/dst/playlist-%v.m3u8'
+        ]
+        self.assertEqual(ff.get_args(), ensure_binary(expected))
+
+    def test_prepare_ffmpeg_single_file(self):
+        self.profile.container.single_file = True
+
+        ff = self.segmentor.prepare_ffmpeg(self.meta)
+
+        args = ff.get_args()
+        self.assertEqual(args[-9:], ensure_binary([
+            '-hls_segment_filename', '/dst/segment-%v.ts',
+            '-muxdelay', 0,
+            '-reset_timestamps', 1,
+            '-hls_flags', 'single_file',
+            '/dst/playlist-%v.m3u8'
+        ]))
+
+        self.profile.container.format = profiles.FMP4
+
+        args = self.segmentor.prepare_ffmpeg(self.meta).get_args()
+
+        self.assertIn(b'/dst/segment-%v.m4s', args)
+
+    def test_prepare_ffmpeg_fmp4(self):
+        self.profile.container.format = profiles.FMP4
+
+        ff = self.segmentor.prepare_ffmpeg(self.meta)
+
+        args = ff.get_args()
+        self.assertEqual(args[-11:], ensure_binary([
+            '-hls_segment_filename', '/dst/segment-%v-%05d.m4s',
+            '-muxdelay', 0,
+            '-reset_timestamps', 1,
+            '-hls_segment_type', 'fmp4',
+            '-hls_fmp4_init_filename', 'init-%v.mp4',
+            '/dst/playlist-%v.m3u8'
+        ]))
@@ -1,5 +1,10 @@
+import io
+import os
+import socket
+import tempfile
 from functools import partial
-from unittest import mock
+from unittest import mock, skipUnless
+from urllib.parse import urlparse, parse_qs
 
 import requests
 from django.test import TestCase
@@ -7,6 +12,16 @@ from django.test import TestCase
 from video_transcoding import defaults
 from video_transcoding.transcoding import workspace
 
+try:
+    import boto3
+    import moto
+    from botocore.config import Config
+except ImportError:  # pragma: no cover
+    boto3 = moto = Config = None
+
+# Min multipart upload part size accepted by S3
+PART_SIZE = 5 * 1024 * 1024
+
 
 class ResourceTestCase(TestCase):
     def setUp(self):
@@ -95,6 +110,14 @@ class FileSystemWorkspaceTestCase(TestCase):
         self.assertFalse(self.ws.exists(self.dir))
         m.assert_called_once_with('/tmp/dir/first/second/dir/')
 
+    @mock.patch('os.stat')
+    def test_size(self, m: mock.Mock):
+        m.return_value.st_size = 7
+        self.assertEqual(self.ws.size(self.file), 7)
+        m.assert_called_once_with('/tmp/dir/first/second/file.txt')
+        m.side_effect = FileNotFoundError()
+        self.assertIsNone(self.ws.size(self.file))
+
     @mock.patch('builtins.open',
                 new_callable=partial(mock.mock_open, read_data='read_data'))
     def test_read(self, m: mock.Mock):
@@ -102,11 +125,42 @@ class FileSystemWorkspaceTestCase(TestCase):
         self.assertEqual(content, 'read_data')
         m.assert_called_once_with('/tmp/dir/first/second/file.txt', 'r')
 
+    def test_list_collection(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            self.ws = workspace.FileSystemWorkspace(tmp)
+            os.makedirs(os.path.join(tmp, 'first', 'second', 'dir'))
+            self.ws.write(self.file, 'content')
+
+            result = self.ws.list_collection(workspace.Collection('first',
+                                                                  'second'))
+
+            self.assertEqual(sorted(map(repr, result)), [
+                '/first/second/dir/',
+                '/first/second/file.txt',
+            ])
+            self.assertIsInstance(
+                [r for r in result if r.basename == 'dir'][0],
+                workspace.Collection)
+            self.assertEqual(self.ws.list_collection(self.dir.collection('x')),
+                             [])
+
     @mock.patch('builtins.open', new_callable=mock.mock_open)
     def test_write(self, m: mock.Mock):
         self.ws.write(self.file, 'content')
         m.return_value.write.assert_called_once_with('content')
 
+    def test_read_write_stream(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            self.ws = workspace.FileSystemWorkspace(tmp)
+            self.ws.ensure_collection('first/second')
+            content = b'x' * (workspace.STREAM_CHUNK_SIZE + 1)
+
+            self.ws.write_stream(self.file, io.BytesIO(content))
+
+            chunks = list(self.ws.read_stream(self.file))
+            self.assertEqual(len(chunks), 2)
+            self.assertEqual(b''.join(chunks), content)
+
 
 class WebDAVWorkspaceTestCase(TestCase):
     def setUp(self):
@@ -124,6 +178,10 @@ class WebDAVWorkspaceTestCase(TestCase):
             defaults.VIDEO_REQUEST_TIMEOUT,
         )
         self.session_kwargs = {'timeout': timeout}
+        self.upload_kwargs = {'timeout': (
+            defaults.VIDEO_CONNECT_TIMEOUT,
+            defaults.VIDEO_UPLOAD_TIMEOUT,
+        )}
         self.status_patcher = mock.patch.object(self.response,
                                                 'raise_for_status')
         self.status_mock = self.status_patcher.start()
@@ -239,6 +297,55 @@ class WebDAVWorkspaceTestCase(TestCase):
                       **self.session_kwargs),
         ])
 
+    def test_size(self):
+        self.response.headers['Content-Length'] = '7'
+        self.assertEqual(self.ws.size(self.file), 7)
+        self.session_mock.assert_called_once_with(
+            'HEAD', 'https://domain.com/path/first/second/file.txt',
+            **self.session_kwargs)
+        self.status_mock.assert_called()
+
+        self.response.status_code = requests.codes.not_found
+        self.assertIsNone(self.ws.size(self.file))
+
+    def test_list_collection(self):
+        self.response.status_code = requests.codes.multi_status
+        self.response._content = b'''<?xml version="1.0" encoding="utf-8"?>
+<D:multistatus xmlns:D="DAV:">
+<D:response><D:href>/path/first/second/</D:href><D:propstat><D:prop>
+<D:resourcetype><D:collection/></D:resourcetype>
+</D:prop></D:propstat></D:response>
+<D:response><D:href>/path/first/second/dir/</D:href><D:propstat><D:prop>
+<D:resourcetype><D:collection/></D:resourcetype>
+</D:prop></D:propstat></D:response>
+<D:response><D:href>https://domain.com/path/first/second/my%20file.txt</D:href>
+<D:propstat><D:prop><D:resourcetype/></D:prop></D:propstat></D:response>
+</D:multistatus>'''
+
+        result = self.ws.list_collection(workspace.Collection('first',
+                                                              'second'))
+
+        self.assertEqual(result, [
+            workspace.Collection('first', 'second', 'dir'),
+            workspace.File('first', 'second', 'my file.txt'),
+        ])
+        self.assertIsInstance(result[0], workspace.Collection)
+        self.assertIsInstance(result[1], workspace.File)
+        self.session_mock.assert_called_once_with(
+            'PROPFIND', 'https://domain.com/path/first/second/',
+            headers={'Depth': '1', 'Content-Type': 'application/xml'},
+            data=workspace.PROPFIND_BODY,
+            **self.session_kwargs)
+        self.status_mock.assert_called()
+
+    def test_list_collection_not_found(self):
+        self.response.status_code = requests.codes.not_found
+
+        result = self.ws.list_collection(self.dir)
+
+        self.assertEqual(result, [])
+        self.status_mock.assert_not_called()
+
     def test_read(self):
         self.response._content = b'read_data'
         content = self.ws.read(self.file)
@@ -253,10 +360,545 @@ class WebDAVWorkspaceTestCase(TestCase):
         self.ws.write(self.file, 'content')
         self.session_mock.assert_has_calls([
             mock.call('PUT', 'https://domain.com/path/first/second/file.txt',
-                      data='content')
+                      data='content', **self.upload_kwargs)
+        ])
+        self.status_mock.assert_called()
+
+    def test_read_stream(self):
+        self.response._content = b'read_data'
+        self.response._content_consumed = True
+
+        content = b''.join(self.ws.read_stream(self.file))
+
+        self.assertEqual(content, b'read_data')
+        self.session_mock.assert_has_calls([
+            mock.call('GET', 'https://domain.com/path/first/second/file.txt',
+                      stream=True, **self.session_kwargs)
         ])
         self.status_mock.assert_called()
 
+    def test_write_stream(self):
+        stream = io.BytesIO(b'content')
+
+        self.ws.write_stream(self.file, stream)
+
+        self.session_mock.assert_has_calls([
+            mock.call('PUT', 'https://domain.com/path/first/second/file.txt',
+                      data=stream, **self.upload_kwargs)
+        ])
+        self.status_mock.assert_called()
+
+    def test_session(self):
+        adapter = self.ws.session.get_adapter('https://domain.com/')
+
+        self.assertIsInstance(adapter, workspace.KeepAliveAdapter)
+        self.assertEqual(adapter._pool_maxsize,
+                         defaults.VIDEO_WEBDAV_POOL_SIZE)
+        retry = adapter.max_retries
+        self.assertEqual(retry.total, defaults.VIDEO_WEBDAV_MAX_RETRIES)
+        self.assertEqual(retry.backoff_factor,
+                         defaults.VIDEO_WEBDAV_RETRY_BACKOFF)
+        self.assertIn('PUT', retry.allowed_methods)
+        self.assertIn('PROPFIND', retry.allowed_methods)
+        self.assertNotIn('POST', retry.allowed_methods)
+        options = adapter.poolmanager.connection_pool_kw['socket_options']
+        self.assertIn((socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1), options)
+
+        with mock.patch.object(defaults, 'VIDEO_WEBDAV_TCP_KEEPALIVE', False):
+            session = workspace.init_session()
+        adapter = session.get_adapter('http://domain.com/')
+        self.assertNotIsInstance(adapter, workspace.KeepAliveAdapter)
+        self.assertNotIn('socket_options',
+                         adapter.poolmanager.connection_pool_kw)
+
+
+@skipUnless(moto, "moto is not installed")
+class S3WorkspaceTestCase(TestCase):
+    def setUp(self):
+        super().setUp()
+        self.env_patcher = mock.patch.dict(os.environ, {
+            'AWS_ACCESS_KEY_ID': 'testing',
+            'AWS_SECRET_ACCESS_KEY': 'testing',
+        })
+        self.env_patcher.start()
+        self.aws = moto.mock_aws()
+        self.aws.start()
+        self.s3 = boto3.client('s3', region_name='us-east-1',
+                               config=Config(signature_version='s3v4'))
+        self.s3.create_bucket(Bucket='bucket')
+        # records calls made by workspace
+        self.client = mock.Mock(wraps=self.s3)
+        self.staging = tempfile.TemporaryDirectory()
+        self.ws = workspace.S3Workspace('s3://bucket/path/',
+                                        client=self.client,
+                                        staging=self.staging.name)
+        self.file = workspace.File('first', 'second', 'file.txt')
+        self.dir = workspace.Collection('first', 'second')
+
+    def tearDown(self):
+        super().tearDown()
+        self.staging.cleanup()
+        self.aws.stop()
+        self.env_patcher.stop()
+
+    def keys(self):
+        resp = self.s3.list_objects_v2(Bucket='bucket')
+        return [o['Key'] for o in resp.get('Contents', [])]
+
+    def names(self):
+        return [c[0] for c in self.client.method_calls]
+
+    def test_get_absolute_uri(self):
+        uri = self.ws.get_absolute_uri(self.file).geturl()
+        self.assertEqual(
+            uri, 'https://s3.amazonaws.com/bucket/path/first/second/file.txt')
+        uri = self.ws.get_absolute_uri(self.dir).geturl()
+        self.assertEqual(
+            uri, 'https://s3.amazonaws.com/bucket/path/first/second/')
+
+        with mock.patch.object(defaults, 'VIDEO_S3_ENDPOINT_URL',
+                               'http://minio:9000'):
+            ws = workspace.S3Workspace('s3://bucket', client=self.client)
+        uri = ws.get_absolute_uri(self.file).geturl()
+        self.assertEqual(uri, 'http://minio:9000/bucket/first/second/file.txt')
+
+    def test_get_key(self):
+        self.assertEqual(self.ws.get_key(self.file),
+                         'path/first/second/file.txt')
+        self.assertEqual(self.ws.get_key(self.dir), 'path/first/second/')
+        self.assertEqual(self.ws.get_key(self.ws.root), 'path/')
+        ws = workspace.S3Workspace('s3://bucket', client=self.client)
+        self.assertEqual(ws.get_key(ws.root), '')
+
+    def test_get_input_uri(self):
+        uri = self.ws.get_input_uri(self.file)
+
+        self.assertEqual(uri.path, '/path/first/second/file.txt')
+        query = parse_qs(uri.query)
+        self.assertIn('X-Amz-Signature', query)
+        self.assertEqual(query['X-Amz-Expires'],
+                         [str(defaults.VIDEO_S3_PRESIGNED_URL_EXPIRES)])
+
+    def test_commit(self):
+        f = self.dir.file('segment-%v-%05d.ts')
+        uri = self.ws.get_output_uri(f)
+        self.assertEqual(uri.scheme, 'file')
+        self.assertTrue(uri.path.startswith(self.staging.name))
+        dirname = os.path.dirname(uri.path)
+        names = ['segment-v0-00000.ts', 'segment-v0-00001.ts',
+                 'segment-a0-00000.ts', 'segment-v0-s1-00000.ts']
+        for fn in names:
+            with open(os.path.join(dirname, fn), 'wb') as fd:
+                fd.write(fn.encode())
+
+        self.ws.commit(f)
+
+        self.assertEqual(self.keys(), [
+            'path/first/second/segment-a0-00000.ts',
+            'path/first/second/segment-v0-00000.ts',
+            'path/first/second/segment-v0-00001.ts',
+        ])
+        content = self.ws.read(self.dir.file('segment-v0-00001.ts'))
+        self.assertEqual(content, 'segment-v0-00001.ts')
+        # uploaded files are removed from staging directory
+        self.assertEqual(os.listdir(dirname), ['segment-v0-s1-00000.ts'])
+
+    def test_commit_file(self):
+        uri = self.ws.get_output_uri(self.file)
+        with open(uri.path, 'w') as fd:
+            fd.write('content')
+
+        self.ws.commit(self.file)
+
+        self.assertEqual(self.ws.read(self.file), 'content')
+        self.assertFalse(os.path.exists(uri.path))
+
+    def test_create_collection(self):
+        c = self.ws.ensure_collection('/another/collection')
+
+        self.assertEqual(c.path, '/another/collection')
+        self.assertEqual(self.client.method_calls, [])
+
+    def test_read_write(self):
+        self.ws.write(self.file, 'content')
+
+        self.assertEqual(self.keys(), ['path/first/second/file.txt'])
+        self.assertEqual(self.ws.read(self.file), 'content')
+
+    def test_read_stream(self):
+        content = 'x' * (workspace.STREAM_CHUNK_SIZE + 1)
+        self.ws.write(self.file, content)
+
+        chunks = list(self.ws.read_stream(self.file))
+
+        self.assertEqual(len(chunks), 2)
+        self.assertEqual(b''.join(chunks), content.encode())
+
+    def test_read_range(self):
+        self.ws.write(self.file, '0123456789')
+
+        self.assertEqual(self.ws.read_range(self.file, 2, 4), b'234')
+        self.assertEqual(self.ws.read_range(self.file, 7), b'789')
+
+    def test_exists(self):
+        self.assertFalse(self.ws.exists(self.file))
+        self.assertFalse(self.ws.exists(self.dir))
+
+        self.ws.write(self.dir.file('file.txt.json'), '{}')
+
+        self.assertFalse(self.ws.exists(self.file))
+        self.assertTrue(self.ws.exists(self.dir))
+
+        self.ws.write(self.file, 'content')
+
+        self.assertTrue(self.ws.exists(self.file))
+
+    def test_size(self):
+        self.assertIsNone(self.ws.size(self.file))
+        self.ws.write(self.dir.file('file.txt.json'), '{}')
+        self.assertIsNone(self.ws.size(self.file))
+
+        self.ws.write(self.file, 'content')
+
+        self.assertEqual(self.ws.size(self.file), 7)
+
+    def test_exists_sibling_prefix(self):
+        self.ws.write(workspace.File('first', 'secondary', 'file.txt'), '')
+
+        self.assertFalse(self.ws.exists(self.dir))
+
+    def test_delete_collection(self):
+        for i in range(5):
+            self.ws.write(self.dir.file(f'{i}.txt'), 'content')
+        self.ws.write(workspace.File('first', 'other.txt'), 'content')
+        self.ws.write(workspace.File('first', 'secondary', 'file.txt'), '')
+
+        with mock.patch.object(self.ws, 'batch_size', 2):
+            self.ws.delete_collection(self.dir)
+
+        self.assertEqual(self.keys(), ['path/first/other.txt',
+                                       'path/first/secondary/file.txt'])
+        self.assertEqual(self.names().count('delete_objects'), 3)
+
+        try:
+            self.ws.delete_collection(self.dir)
+        except Exception:  # pragma: no cover
+            self.fail("exception raised")
+
+    def test_list_collection(self):
+        self.ws.write(self.dir.file('b.txt'), 'content')
+        self.ws.write(self.dir.file('c', 'd.txt'), 'content')
+        self.ws.write(self.dir.file('e', 'f', 'g.txt'), 'content')
+        self.ws.write(self.dir.file('a.txt'), 'content')
+        self.ws.write(workspace.File('first', 'secondary', 'file.txt'), '')
+        # directory placeholder created by some S3 clients
+        self.s3.put_object(Bucket='bucket', Key='path/first/second/',
+                           Body=b'')
+
+        with mock.patch.object(self.ws, 'batch_size', 2):
+            result = self.ws.list_collection(self.dir)
+
+        self.assertEqual(sorted(map(repr, result)), [
+            '/first/second/a.txt',
+            '/first/second/b.txt',
+            '/first/second/c/',
+            '/first/second/e/',
+        ])
+        self.assertIsInstance(
+            [r for r in result if r.basename == 'c'][0],
+            workspace.Collection)
+        # results are paged
+        self.assertEqual(self.names().count('list_objects_v2'), 3)
+        self.assertEqual(self.ws.list_collection(self.dir.collection('x')),
+                         [])
+
+    @mock.patch.object(defaults, 'VIDEO_S3_MULTIPART_CHUNK_SIZE', PART_SIZE)
+    def test_write_stream_single_part(self):
+        self.ws.write_stream(self.file, io.BytesIO(b'0123'))
+
+        self.assertEqual(self.names(), ['put_object'])
+        self.assertEqual(self.ws.read_range(self.file, 0), b'0123')
+
+    @mock.patch.object(defaults, 'VIDEO_S3_MULTIPART_CHUNK_SIZE', PART_SIZE)
+    def test_write_stream_multipart(self):
+        content = os.urandom(2 * PART_SIZE + 10)
+
+        self.ws.write_stream(self.file, io.BytesIO(content))
+
+        self.assertEqual(self.names(), [
+            'create_multipart_upload',
+            'upload_part',
+            'upload_part',
+            'upload_part',
+            'complete_multipart_upload',
+        ])
+        self.assertEqual(self.ws.read_range(self.file, 0), content)
+
+    @mock.patch.object(defaults, 'VIDEO_S3_MULTIPART_CHUNK_SIZE', PART_SIZE)
+    def test_write_stream_abort(self):
+        content = os.urandom(PART_SIZE + 10)
+        with mock.patch.object(self.client, 'complete_multipart_upload',
+                               side_effect=RuntimeError()):
+            with self.assertRaises(RuntimeError):
+                self.ws.write_stream(self.file, io.BytesIO(content))
+
+        self.assertEqual(self.names()[-1], 'abort_multipart_upload')
+        uploads = self.s3.list_multipart_uploads(Bucket='bucket')
+        self.assertEqual(uploads.get('Uploads', []), [])
+        self.assertFalse(self.ws.exists(self.file))
+
+
+class MatchOutputsTestCase(TestCase):
+    def setUp(self):
+        super().setUp()
+        self.tmp = tempfile.TemporaryDirectory()
+        for fn in ('playlist-0.m3u8', 'playlist-a0.m3u8', 'index.m3u8',
+                   's1-v0.m3u8', 's1-v1.m3u8', 's10-v0.m3u8'):
+            with open(os.path.join(self.tmp.name, fn), 'w'):
+                pass
+
+    def tearDown(self):
+        super().tearDown()
+        self.tmp.cleanup()
+
+    def match(self, pattern):
+        paths = workspace.match_outputs(os.path.join(self.tmp.name, pattern))
+        return [os.path.basename(p) for p in paths]
+
+    def test_match_outputs(self):
+        self.assertEqual(self.match('playlist-%v.m3u8'),
+                         ['playlist-0.m3u8', 'playlist-a0.m3u8'])
+        self.assertEqual(self.match('s1-%v.m3u8'),
+                         ['s1-v0.m3u8', 's1-v1.m3u8'])
+        self.assertEqual(self.match('index.m3u8'), ['index.m3u8'])
+        self.assertEqual(self.match('missing.m3u8'), ['missing.m3u8'])
+        self.assertEqual(self.match('missing/s1-%v.m3u8'), [])
+
+
+class LocalCacheTestCase(TestCase):
+    def setUp(self):
+        super().setUp()
+        self.tmp = tempfile.TemporaryDirectory()
+        self.cache = workspace.LocalCache(self.tmp.name, max_size=10)
+
+    def tearDown(self):
+        super().tearDown()
+        self.tmp.cleanup()
+
+    def put(self, name: str, size: int, mtime: int):
+        uri = urlparse(f'https://domain.com/{name}')
+        path = self.cache.prepare(uri)
+        with open(path, 'wb') as f:
+            f.write(b'x' * size)
+        os.utime(path, (mtime, mtime))
+        self.cache.add(uri)
+        return uri
+
+    def test_get_path(self):
+        uri = urlparse('https://domain.com/path/file.txt')
+        self.assertEqual(self.cache.get_path(uri),
+                         os.path.join(self.tmp.name, 'domain.com/path/file.txt'))
+
+    def test_get(self):
+        uri = urlparse('https://domain.com/path/file.txt')
+        self.assertIsNone(self.cache.get(uri))
+
+        self.put('path/file.txt', 1, 1000)
+
+        self.assertEqual(self.cache.get(uri), self.cache.get_path(uri))
+        # access time is updated
+        self.assertGreater(os.stat(self.cache.get_path(uri)).st_mtime, 1000)
+
+    def test_evict_least_recently_used(self):
+        first = self.put('a/first', 4, 1000)
+        second = self.put('a/second', 4, 2000)
+        # first file is used recently
+        self.cache.get(first)
+
+        third = self.put('b/third', 4, 3000)
+
+        self.assertIsNotNone(self.cache.get(first))
+        self.assertIsNone(self.cache.get(second))
+        self.assertIsNotNone(self.cache.get(third))
+
+    def test_keep_added_file(self):
+        uri = self.put('large', 20, 1000)
+
+        self.assertIsNotNone(self.cache.get(uri))
+
+    def test_index_sizes(self):
+        self.put('a/first', 4, 1000)
+        with mock.patch('os.walk') as m:
+            self.put('a/second', 4, 2000)
+        m.assert_not_called()
+        self.assertEqual(self.cache.total, 8)
+
+    def test_rescan(self):
+        first = self.put('a/first', 4, 1000)
+        # file added by another process
+        other = workspace.LocalCache(self.tmp.name, max_size=10)
+        second = urlparse('https://domain.com/a/second')
+        with open(other.prepare(second), 'wb') as f:
+            f.write(b'x' * 4)
+        os.utime(other.get_path(second), (2000, 2000))
+        self.cache.scanned_at -= self.cache.scan_interval + 1
+
+        self.put('b/third', 4, 3000)
+
+        self.assertIsNone(self.cache.get(first))
+        self.assertIsNotNone(self.cache.get(second))
+
+    def test_prepare_removes_stale_outputs(self):
+        self.put('a/s1-v0.m3u8', 1, 1000)
+        self.put('a/s1-v1.m3u8', 1, 1000)
+        pattern = urlparse('https://domain.com/a/s1-%v.m3u8')
+
+        path = self.cache.prepare(pattern)
+
+        self.assertEqual(path, self.cache.get_path(pattern))
+        self.assertEqual(os.listdir(os.path.dirname(path)), [])
+        self.assertEqual(self.cache.total, 0)
+
+    def test_discard(self):
+        first = self.put('a/first', 1, 1000)
+        second = self.put('b/second', 1, 1000)
+
+        self.cache.discard(urlparse('https://domain.com/a/'))
+        self.cache.discard(second)
+        self.cache.discard(second)
+
+        self.assertIsNone(self.cache.get(first))
+        self.assertIsNone(self.cache.get(second))
+        self.assertEqual(self.cache.total, 0)
+
+
+class CachedWorkspaceTestCase(TestCase):
+    def setUp(self):
+        super().setUp()
+        self.remote_dir = tempfile.TemporaryDirectory()
+        self.cache_dir = tempfile.TemporaryDirectory()
+        self.remote = workspace.FileSystemWorkspace(self.remote_dir.name)
+        self.cache = workspace.LocalCache(self.cache_dir.name, 1024)
+        self.ws = workspace.CachedWorkspace(self.remote, self.cache)
+        self.dir = self.ws.ensure_collection('first/second')
+        self.file = self.dir.file('file.txt')
+
+    def tearDown(self):
+        super().tearDown()
+        self.remote_dir.cleanup()
+        self.cache_dir.cleanup()
+
+    def test_get_absolute_uri(self):
+        self.assertEqual(self.ws.get_absolute_uri(self.file),
+                         self.remote.get_absolute_uri(self.file))
+
+    def test_write_through(self):
+        self.ws.write(self.file, 'content')
+
+        self.assertEqual(self.remote.read(self.file), 'content')
+        local = self.ws.get_local_uri(self.file)
+        self.assertEqual(local.scheme, 'file')
+        self.assertTrue(local.path.startswith(self.cache_dir.name))
+        with mock.patch.object(self.remote, 'read') as m:
+            self.assertEqual(self.ws.read(self.file), 'content')
+        m.assert_not_called()
+        self.assertEqual(self.ws.get_input_uri(self.file), local)
+
+    def test_read_not_cached(self):
+        self.remote.write(self.file, 'content')
+
+        self.assertIsNone(self.ws.get_local_uri(self.file))
+        self.assertEqual(self.ws.read(self.file), 'content')
+        self.assertEqual(b''.join(self.ws.read_stream(self.file)), b'content')
+        self.assertEqual(self.ws.get_input_uri(self.file),
+                         self.remote.get_absolute_uri(self.file))
+
+    def test_read_stale_copy(self):
+        # local copy left by another task on this host
+        self.ws.write(self.file, 'content')
+        other = workspace.CachedWorkspace(self.remote, self.cache)
+        # processing was resumed on another host
+        self.remote.write(self.file, 'changed content')
+
+        self.assertEqual(other.read(self.file), 'changed content')
+        self.assertEqual(other.get_input_uri(self.file),
+                         self.remote.get_absolute_uri(self.file))
+        self.assertEqual(b''.join(other.read_stream(self.file)),
+                         b'changed content')
+
+    def test_revalidate_copy(self):
+        self.ws.write_stream(self.file, io.BytesIO(b'content'))
+        other = workspace.CachedWorkspace(self.remote, self.cache)
+
+        with mock.patch.object(self.remote, 'size',
+                               wraps=self.remote.size) as m:
+            local = other.get_input_uri(self.file)
+            self.assertEqual(other.get_input_uri(self.file), local)
+
+        m.assert_called_once_with(self.file)
+        self.assertTrue(local.path.startswith(self.cache_dir.name))
+
+    def test_read_uncommitted_output(self):
+        self.remote.write(self.file, '')
+        chunk = self.dir.file('file.00001')
+        self.ws.get_output_uri(self.dir.file('file.%05d'))
+        self.assertIsNone(self.ws.get_local_uri(chunk))
+        uri = self.ws.get_output_uri(self.file)
+        with open(uri.path, 'w') as f:
+            f.write('partial')
+        with open(uri.path.replace('file.txt', 'file.00001'), 'w') as f:
+            f.write('chunk')
+
+        self.assertEqual(self.ws.read(self.file), 'partial')
+        self.assertIsNotNone(self.ws.get_local_uri(chunk))
+
+    def test_output_commit(self):
+        uri = self.ws.get_output_uri(self.file)
+        self.assertTrue(uri.path.startswith(self.cache_dir.name))
+        with open(uri.path, 'wb') as f:
+            f.write(b'content')
+
+        self.ws.commit(self.file)
+
+        self.assertEqual(self.remote.read(self.file), 'content')
+        self.assertEqual(self.ws.get_input_uri(self.file), uri)
+
+    def test_output_commit_pattern(self):
+        f = self.dir.file('s1-%v.m3u8')
+        uri = self.ws.get_output_uri(f)
+        for variant in ('v0', 'v1'):
+            with open(uri.path.replace('%v', variant), 'w') as fd:
+                fd.write(variant)
+
+        self.ws.commit(f)
+
+        for variant in ('v0', 'v1'):
+            committed = self.dir.file(f's1-{variant}.m3u8')
+            self.assertEqual(self.remote.read(committed), variant)
+            self.assertIsNotNone(self.ws.get_local_uri(committed))
+
+    def test_write_stream(self):
+        self.ws.write_stream(self.file, io.BytesIO(b'content'))
+
+        self.assertEqual(self.remote.read(self.file), 'content')
+        with mock.patch.object(self.remote, 'read_stream') as m:
+            content = b''.join(self.ws.read_stream(self.file))
+        m.assert_not_called()
+        self.assertEqual(content, b'content')
+
+    def test_delete_collection(self):
+        self.ws.write(self.file, 'content')
+
+        self.ws.delete_collection(self.dir)
+
+        self.assertFalse(self.ws.exists(self.file))
+        self.assertIsNone(self.ws.get_local_uri(self.file))
+
+    def test_list_collection(self):
+        self.ws.write(self.file, 'content')
+
+        self.assertEqual(self.ws.list_collection(self.dir), [self.file])
+
 
 class InitWorkspaceTestCase(TestCase):
     def test_init_file(self):
@@ -277,6 +919,14 @@ class InitWorkspaceTestCase(TestCase):
         uri = ws.get_absolute_uri(ws.root).geturl()
         self.assertEqual(uri, 'https://domain.com/root/')
 
+    @mock.patch('video_transcoding.transcoding.workspace.get_s3_client')
+    def test_init_s3(self, m: mock.Mock):
+        ws = workspace.init('s3://bucket/root/')
+        self.assertIsInstance(ws, workspace.S3Workspace)
+        self.assertEqual(ws.client, m.return_value)
+        uri = ws.get_absolute_uri(ws.root).geturl()
+        self.assertEqual(uri, 'https://s3.amazonaws.com/bucket/root/')
+
     def test_init_value_error(self):
         with self.assertRaises(ValueError):
             workspace.init('not_a_scheme://domain.com/')
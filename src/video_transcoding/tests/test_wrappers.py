@@ -3,7 +3,7 @@ from unittest import TestCase, mock
 from fffw.encoding import Stream
 from fffw.graph import VIDEO
 
-from video_transcoding.transcoding import inputs
+from video_transcoding.transcoding import inputs, ffmpeg
 from video_transcoding.transcoding.ffprobe import FFProbe
 
 
@@ -45,3 +45,55 @@ class InputsTestCase(TestCase):
                                 allowed_extensions='m3u8')
         self.assertIsInstance(src, inputs.Input)
         self.assertEqual(src.allowed_extensions, 'm3u8')
+
+
+class FFMPEGWrapperTestCase(TestCase):
+    def setUp(self):
+        self.callback = mock.MagicMock()
+        self.ff = ffmpeg.FFMPEG(input='input.mp4', overwrite=True)
+
+    def test_progress_disabled(self):
+        self.assertNotIn('-progress', self.ff.get_cmd())
+        self.assertEqual(self.ff.handle_stdout('line'), 'line')
+
+    def test_track_progress(self):
+        self.ff.track_progress(self.callback)
+
+        self.assertEqual(self.ff.get_cmd(),
+                         'ffmpeg -y -progress pipe:1 -i input.mp4')
+        lines = [
+            'frame=250',
+            'fps=49.5',
+            'stream_0_0_q=28.0',
+            'bitrate=N/A',
+            'total_size=1048576',
+            'out_time_us=10000000',
+            'out_time_ms=10000000',
+            'out_time=00:00:10.000000',
+            'speed=1.98x',
+            'progress=continue',
+            'frame=300',
+            'fps=N/A',
+            'out_time_ms=12000000',
+            'speed=N/A',
+            'progress=end',
+        ]
+        for line in lines:
+            self.assertEqual(self.ff.handle_stdout(f'{line}\n'), '')
+
+        self.assertEqual(self.callback.call_args_list, [
+            mock.call(ffmpeg.Progress(frame=250, fps=49.5, out_time=10.0,
+                                      speed=1.98, total_size=1048576)),
+            mock.call(ffmpeg.Progress(frame=300, out_time=12.0,
+                                      finished=True)),
+        ])
+
+    def test_skip_invalid_lines(self):
+        parser = ffmpeg.ProgressParser(self.callback)
+
+        parser('')
+        parser('garbage\n')
+        parser('out_time_us=-9223372036854775807\n')
+        parser('progress=continue\n')
+
+        self.callback.assert_called_once_with(ffmpeg.Progress())
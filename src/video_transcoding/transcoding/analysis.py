@@ -45,6 +45,23 @@ class VideoResultAnalyzer(ffprobe.Analyzer):
     """
 
 
+class AudioResultAnalyzer(ffprobe.Analyzer):
+    """
+    Analyzer for multi-stream audio transcoding results in MKV container.
+    """
+
+    def get_duration(self, track: Dict[str, Any]) -> meta.TS:
+        """
+        Augment track duration with a value from container.
+
+        This is legit because all streams are encoded from the same source.
+        """
+        duration = super().get_duration(track)
+        if duration:
+            return duration
+        return self.maybe_parse_duration(self.info.format.get('duration'))
+
+
 class FFProbeHLSAnalyzer(ffprobe.Analyzer):
     """
     Analyzer for multi-variant HLS results.
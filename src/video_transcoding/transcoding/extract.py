@@ -1,6 +1,6 @@
 import abc
 import json
-from typing import List, cast, Any
+from typing import List, cast, Any, Callable, TypeVar
 
 from pymediainfo import MediaInfo
 
@@ -9,28 +9,71 @@ from fffw.graph import meta
 from video_transcoding.transcoding import analysis
 from video_transcoding.transcoding.ffprobe import FFProbe
 from video_transcoding.transcoding.metadata import Metadata
+from video_transcoding.transcoding.probe_cache import (
+    get_probe_cache,
+    get_validators,
+)
 from video_transcoding.utils import LoggerMixin
 
+T = TypeVar('T')
+
 
 class Extractor(LoggerMixin, abc.ABC):
+    # Use probe cache for analysis results. Intermediate files are analyzed
+    # once, so validating them in cache costs an extra request.
+    cache_results = False
+
     @abc.abstractmethod
     def get_meta_data(self, uri: str) -> Metadata:  # pragma: no cover
         raise NotImplementedError()
 
     def ffprobe(self, uri: str, timeout: float = 60.0, **kwargs: Any) -> ffprobe.ProbeInfo:
-        self.logger.debug("Probing %s", uri)
-        ff = FFProbe(uri, show_format=True, show_streams=True, output_format='json', **kwargs)
-        ret, output, errors = ff.run(timeout=timeout)
-        if ret != 0:  # pragma: no cover
-            raise RuntimeError(f"ffprobe returned {ret}")
-        return ffprobe.ProbeInfo(**json.loads(output))
+        def probe() -> ffprobe.ProbeInfo:
+            self.logger.debug("Probing %s", uri)
+            ff = FFProbe(uri, show_format=True, show_streams=True, output_format='json', **kwargs)
+            ret, output, errors = ff.run(timeout=timeout)
+            if ret != 0:  # pragma: no cover
+                raise RuntimeError(f"ffprobe returned {ret}")
+            return ffprobe.ProbeInfo(**json.loads(output))
+
+        return self.cached('ffprobe', uri, probe, **kwargs)
 
     def mediainfo(self, uri: str) -> MediaInfo:
-        self.logger.debug("Mediainfo %s", uri)
-        return MediaInfo.parse(uri)
+        def parse() -> MediaInfo:
+            self.logger.debug("Mediainfo %s", uri)
+            return MediaInfo.parse(uri)
+
+        return self.cached('mediainfo', uri, parse)
+
+    def cached(self, kind: str, uri: str, func: Callable[[], T],
+               **kwargs: Any) -> T:
+        """
+        Returns analysis result from probe cache or computes it.
+
+        Result is cached only if file version can be validated, so modified
+        files are analyzed again.
+        """
+        if not self.cache_results:
+            return func()
+        cache = get_probe_cache()
+        if cache is None:
+            return func()
+        validators = get_validators(uri)
+        if validators is None:
+            return func()
+        key = cache.make_key(kind, uri, validators, **kwargs)
+        result = cache.get(key)
+        if result is not None:
+            self.logger.debug("Using cached %s for %s", kind, uri)
+            return cast(T, result)
+        result = func()
+        cache.set(key, result)
+        return result
 
 
 class SourceExtractor(Extractor):
+    # Source is analyzed again on retries and by priority routing.
+    cache_results = True
 
     def get_meta_data(self, uri: str) -> Metadata:
         info = self.mediainfo(uri)
@@ -110,6 +153,20 @@ class VideoResultExtractor(MKVExtractor):
         )
 
 
+class AudioResultExtractor(MKVExtractor):
+    """
+    Extracts metadata from audio transcoding results.
+    """
+
+    def get_meta_data(self, uri: str) -> Metadata:
+        streams = analysis.AudioResultAnalyzer(self.ffprobe(uri)).analyze()
+        return Metadata(
+            uri=uri,
+            videos=[],
+            audios=cast(List[meta.AudioMeta], streams),
+        )
+
+
 class HLSExtractor(Extractor):
     """
     Extracts metadata from HLS results.
@@ -0,0 +1,121 @@
+from dataclasses import dataclass
+from typing import Optional, Callable, Dict, Any
+
+from fffw import encoding
+from fffw.encoding import vector
+from fffw.wrapper import param
+
+
+@dataclass
+class Progress:
+    """
+    A single ffmpeg progress report.
+    """
+    frame: int = 0
+    fps: float = 0.0
+    # Output timestamp, seconds
+    out_time: float = 0.0
+    # Processing speed relative to realtime
+    speed: float = 0.0
+    # Output size, bytes
+    total_size: int = 0
+    # ffmpeg has finished processing
+    finished: bool = False
+
+
+ProgressCallback = Callable[[Progress], None]
+
+
+def chain(*callbacks: ProgressCallback) -> ProgressCallback:
+    """
+    :return: a callback passing progress reports to all callbacks.
+    """
+    def callback(progress: Progress) -> None:
+        for c in callbacks:
+            c(progress)
+    return callback
+
+
+def to_float(value: Optional[str]) -> float:
+    """
+    Converts ffmpeg progress value to float, skipping N/A values.
+    """
+    try:
+        return float((value or '').rstrip('x'))
+    except ValueError:
+        return 0.0
+
+
+class ProgressParser:
+    """
+    Parses `key=value` blocks written by ffmpeg with `-progress` option.
+
+    Each block ends with `progress` key, and is passed to a callback as a
+    Progress object.
+    """
+
+    def __init__(self, callback: ProgressCallback) -> None:
+        self.callback = callback
+        self.values: Dict[str, str] = {}
+
+    def __call__(self, line: str) -> None:
+        key, sep, value = line.strip().partition('=')
+        if not sep:
+            return
+        self.values[key] = value
+        if key == 'progress':
+            values, self.values = self.values, {}
+            self.callback(self.parse(values))
+
+    @staticmethod
+    def parse(values: Dict[str, str]) -> Progress:
+        # out_time_ms is in microseconds too for historical reasons
+        out_time = values.get('out_time_us', values.get('out_time_ms'))
+        return Progress(
+            frame=int(to_float(values.get('frame'))),
+            fps=to_float(values.get('fps')),
+            out_time=max(to_float(out_time) / 1_000_000, 0.0),
+            speed=to_float(values.get('speed')),
+            total_size=int(to_float(values.get('total_size'))),
+            finished=values.get('progress') == 'end',
+        )
+
+
+@dataclass
+class FFMPEG(encoding.FFMPEG):
+    """
+    Extends ffmpeg wrapper with progress reporting.
+    """
+    progress: Optional[str] = param()
+    """ Progress report URL, i.e. `pipe:1`."""
+
+    def __post_init__(self) -> None:
+        self.progress_parser: Optional[ProgressParser] = None
+        super().__post_init__()
+
+    def track_progress(self, callback: ProgressCallback) -> None:
+        """
+        Enables progress reporting to ffmpeg stdout.
+
+        :param callback: a function called with each progress report.
+        """
+        self.progress = 'pipe:1'
+        self.progress_parser = ProgressParser(callback)
+
+    def handle_stdout(self, line: str) -> str:
+        if self.progress_parser is None:
+            return super().handle_stdout(line)
+        self.progress_parser(line)
+        return ''
+
+
+class FFMPEGFactory(vector.FFMPEGFactory):
+    def __call__(self, **kwargs: Any) -> FFMPEG:
+        return FFMPEG(**kwargs)
+
+
+class SIMD(vector.SIMD):
+    """
+    Vectorized ffmpeg wrapper with progress reporting.
+    """
+    ffmpeg_wrapper = FFMPEGFactory()
@@ -10,6 +10,8 @@ class FFProbe(ffprobe.FFProbe):
     Extends ffprobe wrapper with new arguments and output filtering.
     """
     allowed_extensions: Optional[str] = None
+    select_streams: Optional[str] = None
+    show_entries: Optional[str] = None
 
     def handle_stderr(self, line: str) -> str:
         if '[error]' in line:
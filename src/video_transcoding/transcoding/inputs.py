@@ -1,5 +1,5 @@
-from dataclasses import dataclass
-from typing import Any
+from dataclasses import dataclass, fields, Field
+from typing import Any, Optional, Tuple
 
 from fffw.encoding import inputs, Stream
 from fffw.wrapper import param
@@ -8,6 +8,22 @@ from fffw.wrapper import param
 @dataclass
 class Input(inputs.Input):
     allowed_extensions: str = param()
+    safe: Optional[str] = param()
+
+    @property
+    def _fields(self) -> Tuple[Field, ...]:
+        """
+        Puts demuxer options declared here before input file name.
+        """
+        base = {f.name for f in fields(inputs.Input)}
+        extra = [f for f in fields(self) if f.name not in base]
+        result = []
+        for f in fields(self):
+            if f.name == 'input_file':
+                result.extend(extra)
+            if f.name in base:
+                result.append(f)
+        return tuple(result)
 
 
 def input_file(filename: str, *streams: Stream, **kwargs: Any) -> Input:
@@ -0,0 +1,127 @@
+from dataclasses import dataclass
+from typing import List, Iterable, Optional
+
+from video_transcoding.transcoding.ffprobe import FFProbe
+from video_transcoding.utils import LoggerMixin
+
+
+@dataclass
+class Packet:
+    """
+    Source video packet.
+    """
+    # Presentation timestamp, seconds
+    pts: float
+    # Compressed size, bytes
+    size: int
+    keyframe: bool
+
+
+def parse_packet(line: str) -> Optional[Packet]:
+    """
+    Parses `pts_time,size,flags` line of ffprobe csv output.
+
+    :return: packet or None for packets without timestamp.
+    """
+    try:
+        pts, size, flags = line.strip().split(',')[:3]
+        return Packet(pts=float(pts), size=int(size), keyframe='K' in flags)
+    except ValueError:
+        return None
+
+
+class KeyframePlanner(LoggerMixin):
+    """
+    Chooses source split points at keyframes so that all chunks require
+    approximately equal encoding work.
+
+    Encoding cost of each frame is a constant (decoding, scaling) plus a part
+    proportional to it's compressed size, which estimates scene complexity.
+    """
+
+    def __init__(self, chunk_duration: float, timeout: float = 600.0) -> None:
+        """
+        :param chunk_duration: desired average chunk duration, seconds.
+        :param timeout: source probe timeout, seconds.
+        """
+        super().__init__()
+        self.chunk_duration = chunk_duration
+        self.timeout = timeout
+
+    def __call__(self, uri: str) -> List[float]:
+        """
+        :param uri: source media uri.
+        :return: split points for ffmpeg segment muxer `segment_times`.
+        """
+        return self.plan(self.probe(uri))
+
+    def probe(self, uri: str) -> List[Packet]:
+        """
+        Reads all packets of first video stream with ffprobe.
+        """
+        self.logger.debug("Probing packets %s", uri)
+        ff = FFProbe(uri,
+                     select_streams='v:0',
+                     show_entries='packet=pts_time,size,flags',
+                     output_format='csv=p=0')
+        ret, output, errors = ff.run(timeout=self.timeout)
+        if ret != 0:
+            raise RuntimeError(f"ffprobe returned {ret}")
+        packets = []
+        for line in output.splitlines():
+            packet = parse_packet(line)
+            if packet is not None:
+                packets.append(packet)
+        return packets
+
+    def plan(self, packets: Iterable[Packet]) -> List[float]:
+        """
+        :param packets: source video packets.
+        :return: keyframe timestamps to split source at.
+        """
+        # Packets are in decoding order, keyframes are always presented
+        # after preceding packets, so sort them by presentation time.
+        packets = sorted(packets, key=lambda p: p.pts)
+        if not packets:
+            return []
+        duration = packets[-1].pts - packets[0].pts
+        count = round(duration / self.chunk_duration)
+        if count < 2:
+            return []
+        mean_size = sum(p.size for p in packets) / len(packets) or 1.0
+
+        # cumulative cost of all frames preceding each keyframe
+        keyframes: List[float] = []
+        costs: List[float] = []
+        total = 0.0
+        for p in packets:
+            if p.keyframe and p is not packets[0]:
+                keyframes.append(p.pts)
+                costs.append(total)
+            total += 1.0 + p.size / mean_size
+
+        # Chunks shorter than a half of average are merged with neighbours
+        min_cost = total / count / 2
+        result: List[float] = []
+        start = 0
+        last = 0.0
+        for i in range(1, count):
+            target = total * i / count
+            # keyframe with cumulative cost closest to target
+            best = None
+            for j in range(start, len(costs)):
+                if best is None or (abs(costs[j] - target) <
+                                    abs(costs[best] - target)):
+                    best = j
+                elif costs[j] > target:
+                    break
+            if best is None:
+                break
+            start = best + 1
+            if costs[best] - last < min_cost:
+                continue
+            result.append(keyframes[best])
+            last = costs[best]
+        if result and total - last < min_cost:
+            result.pop()
+        return result
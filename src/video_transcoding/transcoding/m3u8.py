@@ -0,0 +1,348 @@
+"""
+HLS playlists model.
+
+Master and media playlists are built from transcoding profile and result
+metadata, so manifests may be (re)written without touching media segments.
+"""
+import math
+import re
+from dataclasses import dataclass, field
+from typing import List, Optional, Iterable, Tuple, Dict
+
+from video_transcoding.transcoding.metadata import Metadata
+from video_transcoding.transcoding.profiles import (
+    Profile,
+    VideoTrack,
+    AudioTrack,
+)
+
+# ffmpeg multiplies variant bitrate to get BANDWIDTH attribute
+BANDWIDTH_FACTOR = 1.1
+
+# H.264 profile_idc and constraint flags for avc1 codec string
+AVC_PROFILES = {
+    'baseline': '42E0',
+    'main': '4D40',
+    'high': '6400',
+}
+
+# H.264 levels as (max macroblocks per second, max frame size in macroblocks,
+# level_idc)
+AVC_LEVELS = [
+    (40500, 1620, 0x1e),  # 3.0
+    (108000, 3600, 0x1f),  # 3.1
+    (216000, 5120, 0x20),  # 3.2
+    (245760, 8192, 0x28),  # 4.0
+    (522240, 8704, 0x2a),  # 4.2
+    (589824, 22080, 0x32),  # 5.0
+    (983040, 36864, 0x33),  # 5.1
+    (2073600, 36864, 0x34),  # 5.2
+]
+
+# Byte range as length and offset, bytes
+ByteRange = Tuple[int, int]
+
+# Attribute list item, quoted strings may contain commas
+ATTR_RE = re.compile(r'([A-Z0-9-]+)=("[^"]*"|[^,]*)')
+
+# RFC 6381 codec strings for audio encoders
+AUDIO_CODECS = {
+    'aac': 'mp4a.40.2',
+    'libfdk_aac': 'mp4a.40.2',
+    'mp3': 'mp4a.40.34',
+    'libmp3lame': 'mp4a.40.34',
+    'ac3': 'ac-3',
+    'eac3': 'ec-3',
+}
+
+
+def video_codec(track: VideoTrack) -> Optional[str]:
+    """
+    :return: RFC 6381 codec string for a video track or None if unknown.
+    """
+    if track.codec not in ('libx264', 'h264'):
+        return None
+    profile = AVC_PROFILES.get(track.profile)
+    if profile is None:
+        return None
+    fs = math.ceil(track.width / 16) * math.ceil(track.height / 16)
+    mbps = fs * track.frame_rate
+    level = next((idc for max_mbps, max_fs, idc in AVC_LEVELS
+                  if mbps <= max_mbps and fs <= max_fs),
+                 AVC_LEVELS[-1][2])
+    return f'avc1.{profile}{level:02X}'
+
+
+def audio_codec(track: AudioTrack) -> Optional[str]:
+    """
+    :return: RFC 6381 codec string for an audio track or None if unknown.
+    """
+    return AUDIO_CODECS.get(track.codec)
+
+
+def format_attrs(attrs: Dict[str, Optional[str]]) -> str:
+    """
+    Formats tag attribute list skipping missing values.
+    """
+    return ','.join(f'{k}={v}' for k, v in attrs.items() if v is not None)
+
+
+def parse_attrs(value: str) -> Dict[str, str]:
+    """
+    Parses tag attribute list, quotes are removed from string values.
+    """
+    return {k: v.strip('"') for k, v in ATTR_RE.findall(value)}
+
+
+def parse_byterange(value: str, offset: int = 0) -> ByteRange:
+    """
+    Parses `<length>[@<offset>]` byte range.
+
+    :param offset: default offset if it's not present in value.
+    """
+    length, _, start = value.partition('@')
+    return int(length), int(start) if start else offset
+
+
+def format_byterange(value: ByteRange) -> str:
+    return '{}@{}'.format(*value)
+
+
+def quoted(value: Optional[str]) -> Optional[str]:
+    return None if value is None else f'"{value}"'
+
+
+@dataclass
+class Segment:
+    """
+    Media segment of a media playlist.
+    """
+    uri: str
+    # Segment duration, seconds
+    duration: float
+    # Segment position in a file containing multiple segments
+    byterange: Optional[ByteRange] = None
+
+
+@dataclass
+class MediaPlaylist:
+    """
+    Media playlist with segments of a single rendition.
+    """
+    segments: List[Segment] = field(default_factory=list)
+    # VOD, EVENT or None for live playlists
+    playlist_type: Optional[str] = 'VOD'
+    media_sequence: int = 0
+    version: int = 3
+    # Playlist has EXT-X-ENDLIST tag
+    ended: bool = True
+    # Media initialization section uri (EXT-X-MAP) for fMP4 segments
+    map_uri: Optional[str] = None
+    map_byterange: Optional[ByteRange] = None
+    # EXT-X-TARGETDURATION value that must not change when segments are
+    # appended to EVENT playlist, computed from segments if not set
+    fixed_target_duration: Optional[int] = None
+
+    @property
+    def target_duration(self) -> int:
+        if self.fixed_target_duration is not None:
+            return self.fixed_target_duration
+        return max((math.ceil(s.duration) for s in self.segments), default=0)
+
+    @property
+    def duration(self) -> float:
+        return sum(s.duration for s in self.segments)
+
+    @classmethod
+    def loads(cls, content: str) -> "MediaPlaylist":
+        """
+        Parses m3u8 media playlist.
+
+        Tags not supported by model are skipped.
+        """
+        playlist = cls(playlist_type=None, ended=False)
+        duration = None
+        byterange = None
+        for line in content.splitlines():
+            line = line.strip()
+            if line.startswith('#EXTINF:'):
+                duration = float(line[len('#EXTINF:'):].split(',')[0])
+            elif line.startswith('#EXT-X-BYTERANGE:'):
+                # Sub-range without offset follows previous sub-range
+                offset = 0
+                if playlist.segments and playlist.segments[-1].byterange:
+                    length, start = playlist.segments[-1].byterange
+                    offset = start + length
+                byterange = parse_byterange(line.split(':', 1)[1], offset)
+            elif line.startswith('#EXT-X-PLAYLIST-TYPE:'):
+                playlist.playlist_type = line.split(':', 1)[1]
+            elif line.startswith('#EXT-X-TARGETDURATION:'):
+                playlist.fixed_target_duration = int(line.split(':', 1)[1])
+            elif line.startswith('#EXT-X-MEDIA-SEQUENCE:'):
+                playlist.media_sequence = int(line.split(':', 1)[1])
+            elif line.startswith('#EXT-X-VERSION:'):
+                playlist.version = int(line.split(':', 1)[1])
+            elif line == '#EXT-X-ENDLIST':
+                playlist.ended = True
+            elif line.startswith('#EXT-X-MAP:'):
+                attrs = parse_attrs(line.split(':', 1)[1])
+                playlist.map_uri = attrs.get('URI')
+                if 'BYTERANGE' in attrs:
+                    playlist.map_byterange = parse_byterange(
+                        attrs['BYTERANGE'])
+            elif line and not line.startswith('#') and duration is not None:
+                playlist.segments.append(Segment(uri=line, duration=duration,
+                                                 byterange=byterange))
+                duration = None
+                byterange = None
+        return playlist
+
+    @classmethod
+    def join(cls, playlists: Iterable["MediaPlaylist"]) -> "MediaPlaylist":
+        """
+        Joins media playlists of consecutive chunks to a single VOD media
+        playlist.
+        """
+        result = cls()
+        for p in playlists:
+            result.segments.extend(p.segments)
+        return result
+
+    def dumps(self) -> str:
+        """
+        :return: m3u8 media playlist.
+        """
+        version = self.version
+        if any(s.byterange for s in self.segments):
+            # EXT-X-BYTERANGE requires protocol version 4
+            version = max(version, 4)
+        lines = [
+            '#EXTM3U',
+            f'#EXT-X-VERSION:{version}',
+            f'#EXT-X-TARGETDURATION:{self.target_duration}',
+            f'#EXT-X-MEDIA-SEQUENCE:{self.media_sequence}',
+        ]
+        if self.playlist_type:
+            lines.append(f'#EXT-X-PLAYLIST-TYPE:{self.playlist_type}')
+        if self.map_uri:
+            attrs = {'URI': quoted(self.map_uri)}
+            if self.map_byterange:
+                attrs['BYTERANGE'] = quoted(
+                    format_byterange(self.map_byterange))
+            lines.append(f'#EXT-X-MAP:{format_attrs(attrs)}')
+        for s in self.segments:
+            lines.append(f'#EXTINF:{s.duration:.6f},')
+            if s.byterange:
+                byterange = format_byterange(s.byterange)
+                lines.append(f'#EXT-X-BYTERANGE:{byterange}')
+            lines.append(s.uri)
+        if self.ended:
+            lines.append('#EXT-X-ENDLIST')
+        return '\n'.join(lines) + '\n'
+
+
+@dataclass
+class Rendition:
+    """
+    Alternative rendition (EXT-X-MEDIA tag) of a master playlist.
+    """
+    uri: str
+    group_id: str
+    name: str
+    type: str = 'AUDIO'
+    default: bool = True
+
+    def dumps(self) -> str:
+        return '#EXT-X-MEDIA:' + format_attrs({
+            'TYPE': self.type,
+            'GROUP-ID': quoted(self.group_id),
+            'NAME': quoted(self.name),
+            'DEFAULT': 'YES' if self.default else 'NO',
+            'URI': quoted(self.uri),
+        })
+
+
+@dataclass
+class Variant:
+    """
+    Variant stream (EXT-X-STREAM-INF tag) of a master playlist.
+    """
+    uri: str
+    # Peak bitrate, bits per second
+    bandwidth: int
+    resolution: Optional[Tuple[int, int]] = None
+    codecs: List[str] = field(default_factory=list)
+    # Audio rendition group id
+    audio: Optional[str] = None
+
+    def dumps(self) -> str:
+        resolution = None
+        if self.resolution is not None:
+            resolution = '{}x{}'.format(*self.resolution)
+        attrs = format_attrs({
+            'BANDWIDTH': str(self.bandwidth),
+            'RESOLUTION': resolution,
+            'CODECS': quoted(','.join(self.codecs)) if self.codecs else None,
+            'AUDIO': quoted(self.audio),
+        })
+        return f'#EXT-X-STREAM-INF:{attrs}\n{self.uri}'
+
+
+@dataclass
+class MasterPlaylist:
+    """
+    Master playlist listing variant streams and renditions.
+    """
+    variants: List[Variant] = field(default_factory=list)
+    renditions: List[Rendition] = field(default_factory=list)
+    version: int = 3
+
+    @classmethod
+    def from_profile(cls, profile: Profile, meta: Metadata,
+                     video_playlist: str = 'playlist-v{}.m3u8',
+                     audio_playlist: str = 'playlist-a{}.m3u8',
+                     ) -> "MasterPlaylist":
+        """
+        Builds master playlist with a variant for each audio group and video
+        track, same as ffmpeg hls muxer with agroup in var_stream_map.
+
+        :param profile: transcoding profile with bitrate hints.
+        :param meta: resulting media metadata.
+        :param video_playlist: media playlist name template for video tracks.
+        :param audio_playlist: media playlist name template for audio tracks.
+        """
+        playlist = cls()
+        for i, _ in enumerate(profile.audio):
+            playlist.renditions.append(Rendition(uri=audio_playlist.format(i),
+                                                 group_id=f'a{i}',
+                                                 name=f'audio_{i}'))
+        groups: List[Tuple[int, Optional[AudioTrack]]] = [
+            (i, a) for i, a in enumerate(profile.audio)] or [(0, None)]
+        for i, audio in groups:
+            for j, (track, vm) in enumerate(zip(profile.video, meta.videos)):
+                bitrate = track.max_rate
+                codecs = [video_codec(track)]
+                if audio is not None:
+                    bitrate += audio.bitrate
+                    codecs.append(audio_codec(audio))
+                # CODECS must list all codecs or must not be present
+                known = [c for c in codecs if c is not None]
+                if len(known) != len(codecs):
+                    known = []
+                playlist.variants.append(Variant(
+                    uri=video_playlist.format(j),
+                    bandwidth=round(bitrate * BANDWIDTH_FACTOR),
+                    resolution=(vm.width, vm.height),
+                    codecs=known,
+                    audio=f'a{i}' if audio is not None else None,
+                ))
+        return playlist
+
+    def dumps(self) -> str:
+        """
+        :return: m3u8 master playlist.
+        """
+        lines = ['#EXTM3U', f'#EXT-X-VERSION:{self.version}']
+        lines.extend(r.dumps() for r in self.renditions)
+        lines.extend(v.dumps() for v in self.variants)
+        return '\n'.join(lines) + '\n'
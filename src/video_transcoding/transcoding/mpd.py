@@ -0,0 +1,144 @@
+"""
+DASH manifest for fragmented MP4 (CMAF) HLS results.
+
+Init and media segments written by HLS muxer are referenced as is, so the same
+media is served both with HLS and DASH.
+"""
+from typing import List, Optional
+from xml.etree import ElementTree
+
+from video_transcoding.transcoding import m3u8
+from video_transcoding.transcoding.metadata import Metadata
+from video_transcoding.transcoding.profiles import Profile
+
+NAMESPACE = 'urn:mpeg:dash:schema:mpd:2011'
+# SegmentList addressing is allowed only in full profile
+PROFILE = 'urn:mpeg:dash:profile:full:2011'
+CHANNEL_CONFIGURATION = ('urn:mpeg:dash:23003:3:'
+                         'audio_channel_configuration:2011')
+# SegmentTimeline time units per second
+TIMESCALE = 1000
+
+
+def format_duration(seconds: float) -> str:
+    """
+    :return: ISO 8601 duration.
+    """
+    return f'PT{seconds:.3f}S'
+
+
+def format_range(byterange: m3u8.ByteRange) -> str:
+    """
+    :return: HTTP-style inclusive byte range.
+    """
+    length, offset = byterange
+    return f'{offset}-{offset + length - 1}'
+
+
+def segment_list(playlist: m3u8.MediaPlaylist) -> ElementTree.Element:
+    """
+    Builds SegmentList with explicit timeline from media playlist segments.
+    """
+    sl = ElementTree.Element('SegmentList', timescale=str(TIMESCALE))
+    if playlist.map_uri:
+        init = ElementTree.SubElement(sl, 'Initialization',
+                                      sourceURL=playlist.map_uri)
+        if playlist.map_byterange:
+            init.set('range', format_range(playlist.map_byterange))
+    timeline = ElementTree.SubElement(sl, 'SegmentTimeline')
+    # Segment boundaries are rounded from cumulative duration to prevent
+    # rounding error accumulation.
+    position = 0.0
+    last: Optional[ElementTree.Element] = None
+    repeat = 0
+    for segment in playlist.segments:
+        start = round(position * TIMESCALE)
+        position += segment.duration
+        duration = round(position * TIMESCALE) - start
+        if last is not None and last.get('d') == str(duration):
+            repeat += 1
+            last.set('r', str(repeat))
+            continue
+        attrs = {'d': str(duration)}
+        if last is None:
+            attrs = {'t': str(start), **attrs}
+        last = ElementTree.SubElement(timeline, 'S', attrs)
+        repeat = 0
+    for segment in playlist.segments:
+        url = ElementTree.SubElement(sl, 'SegmentURL', media=segment.uri)
+        if segment.byterange:
+            url.set('mediaRange', format_range(segment.byterange))
+    return sl
+
+
+def manifest(profile: Profile, meta: Metadata,
+             videos: List[m3u8.MediaPlaylist],
+             audios: List[m3u8.MediaPlaylist]) -> str:
+    """
+    Builds static DASH manifest.
+
+    :param profile: transcoding profile with bitrate hints.
+    :param meta: resulting media metadata.
+    :param videos: media playlists for each video track from profile.
+    :param audios: media playlists for each audio track from profile.
+    :return: MPD xml.
+    """
+    duration = max((p.duration for p in videos + audios), default=0.0)
+    root = ElementTree.Element('MPD', {
+        'xmlns': NAMESPACE,
+        'profiles': PROFILE,
+        'type': 'static',
+        'mediaPresentationDuration': format_duration(duration),
+        'minBufferTime': format_duration(
+            profile.container.segment_duration or 0.0),
+    })
+    period = ElementTree.SubElement(root, 'Period', start='PT0S')
+
+    if videos:
+        adaptation = ElementTree.SubElement(period, 'AdaptationSet', {
+            'contentType': 'video',
+            'mimeType': 'video/mp4',
+            'segmentAlignment': 'true',
+            'startWithSAP': '1',
+        })
+        for i, (track, vm, playlist) in enumerate(
+                zip(profile.video, meta.videos, videos)):
+            attrs = {
+                'id': f'v{i}',
+                'bandwidth': str(track.max_rate),
+                'width': str(vm.width),
+                'height': str(vm.height),
+                'frameRate': f'{vm.frame_rate:g}',
+            }
+            codec = m3u8.video_codec(track)
+            if codec:
+                attrs['codecs'] = codec
+            r = ElementTree.SubElement(adaptation, 'Representation', attrs)
+            r.append(segment_list(playlist))
+
+    if audios:
+        adaptation = ElementTree.SubElement(period, 'AdaptationSet', {
+            'contentType': 'audio',
+            'mimeType': 'audio/mp4',
+            'segmentAlignment': 'true',
+            'startWithSAP': '1',
+        })
+        for i, (audio, playlist) in enumerate(zip(profile.audio, audios)):
+            attrs = {
+                'id': f'a{i}',
+                'bandwidth': str(audio.bitrate),
+                'audioSamplingRate': str(audio.sample_rate),
+            }
+            codec = m3u8.audio_codec(audio)
+            if codec:
+                attrs['codecs'] = codec
+            r = ElementTree.SubElement(adaptation, 'Representation', attrs)
+            ElementTree.SubElement(r, 'AudioChannelConfiguration',
+                                   schemeIdUri=CHANNEL_CONFIGURATION,
+                                   value=str(audio.channels))
+            r.append(segment_list(playlist))
+
+    ElementTree.indent(root)
+    content = ElementTree.tostring(root, encoding='unicode',
+                                   xml_declaration=True)
+    return content + '\n'
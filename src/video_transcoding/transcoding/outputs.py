@@ -20,6 +20,9 @@ class HLSOutput(Output):
     master_pl_name: Optional[str] = None
     muxdelay: Optional[str] = None
     reset_timestamps: Optional[int] = 0
+    hls_segment_type: Optional[str] = None
+    hls_fmp4_init_filename: Optional[str] = None
+    hls_flags: Optional[str] = None
 
 
 @dataclass
@@ -31,6 +34,7 @@ class SegmentOutput(Output):
     segment_list: Optional[str] = None
     segment_list_type: Optional[str] = None
     segment_time: Optional[float] = None
+    segment_times: Optional[str] = None
 
 
 @dataclass
@@ -0,0 +1,149 @@
+import abc
+import copy
+import hashlib
+import json
+import os
+from collections import OrderedDict
+from functools import lru_cache
+from threading import Lock
+from typing import Any, Optional, Tuple
+from urllib.parse import urlparse
+
+import requests
+
+from video_transcoding import defaults
+from video_transcoding.utils import LoggerMixin
+
+Validators = Tuple[Any, ...]
+
+
+def get_validators(uri: str) -> Optional[Validators]:
+    """
+    Returns values that change whenever file content changes.
+
+    Local files are validated with size and modification time, HTTP
+    resources with ETag or Last-Modified header and content length.
+    Returns None if file can't be validated and so must not be cached.
+    """
+    parsed = urlparse(uri)
+    if parsed.scheme in ('', 'file'):
+        try:
+            st = os.stat(parsed.path)
+        except OSError:
+            return None
+        return st.st_size, st.st_mtime_ns
+    if parsed.scheme in ('http', 'https'):
+        timeout = (defaults.VIDEO_CONNECT_TIMEOUT,
+                   defaults.VIDEO_REQUEST_TIMEOUT)
+        try:
+            resp = requests.head(uri, timeout=timeout, allow_redirects=True)
+        except requests.RequestException:
+            return None
+        if resp.status_code != 200:
+            return None
+        etag = resp.headers.get('ETag')
+        modified = resp.headers.get('Last-Modified')
+        if not etag and not modified:
+            return None
+        return etag, modified, resp.headers.get('Content-Length')
+    return None
+
+
+class ProbeCache(LoggerMixin, abc.ABC):
+    """
+    Storage for media analysis results.
+    """
+
+    @staticmethod
+    def make_key(kind: str, uri: str, validators: Validators,
+                 **kwargs: Any) -> str:
+        """
+        Returns cache key for analysis of given file version.
+        """
+        data = json.dumps([kind, uri, validators, kwargs],
+                          sort_keys=True, default=str)
+        digest = hashlib.sha1(data.encode('utf-8')).hexdigest()
+        return f'video_transcoding:probe:{digest}'
+
+    @abc.abstractmethod
+    def get(self, key: str) -> Any:  # pragma: no cover
+        """
+        Returns cached value or None.
+        """
+        raise NotImplementedError()
+
+    @abc.abstractmethod
+    def set(self, key: str, value: Any) -> None:  # pragma: no cover
+        """
+        Stores value in cache.
+        """
+        raise NotImplementedError()
+
+
+class MemoryProbeCache(ProbeCache):
+    """
+    Per-process cache with least recently used eviction.
+
+    Values are copied on get and set, so callers can't modify cached
+    results shared between threads.
+    """
+
+    def __init__(self, max_size: int) -> None:
+        super().__init__()
+        self.max_size = max_size
+        self.items: OrderedDict[str, Any] = OrderedDict()
+        self.lock = Lock()
+
+    def get(self, key: str) -> Any:
+        with self.lock:
+            try:
+                self.items.move_to_end(key)
+            except KeyError:
+                return None
+            value = self.items[key]
+        return copy.deepcopy(value)
+
+    def set(self, key: str, value: Any) -> None:
+        value = copy.deepcopy(value)
+        with self.lock:
+            self.items[key] = value
+            self.items.move_to_end(key)
+            while len(self.items) > self.max_size:
+                self.items.popitem(last=False)
+
+
+class DjangoProbeCache(ProbeCache):
+    """
+    Cache shared between workers via Django cache backend.
+
+    Size limit and eviction are handled by cache backend itself.
+    """
+
+    def __init__(self, alias: str, timeout: Optional[float]) -> None:
+        super().__init__()
+        self.alias = alias
+        self.timeout = timeout
+
+    @property
+    def cache(self) -> Any:
+        from django.core.cache import caches
+        return caches[self.alias]
+
+    def get(self, key: str) -> Any:
+        return self.cache.get(key)
+
+    def set(self, key: str, value: Any) -> None:
+        self.cache.set(key, value, timeout=self.timeout)
+
+
+@lru_cache(maxsize=None)
+def get_probe_cache() -> Optional[ProbeCache]:
+    """
+    Returns probe cache configured with VIDEO_PROBE_CACHE_* settings.
+    """
+    if defaults.VIDEO_PROBE_CACHE_ALIAS:
+        return DjangoProbeCache(defaults.VIDEO_PROBE_CACHE_ALIAS,
+                                defaults.VIDEO_PROBE_CACHE_TIMEOUT)
+    if defaults.VIDEO_PROBE_CACHE_SIZE > 0:
+        return MemoryProbeCache(defaults.VIDEO_PROBE_CACHE_SIZE)
+    return None
@@ -1,8 +1,14 @@
 from dataclasses import dataclass
-from typing import List, Optional, Any, Dict
+from functools import cached_property
+from itertools import product
+from typing import List, Optional, Any, Dict, Tuple, Sequence, Union
 
 from fffw.graph import VideoMeta, AudioMeta
 
+# HLS segment container formats
+MPEGTS = 'mpegts'
+FMP4 = 'fmp4'
+
 
 @dataclass
 class VideoTrack:
@@ -70,6 +76,10 @@ class VideoCondition:
             (not self.max_dar or meta.dar <= self.max_dar)
         )
 
+    @classmethod
+    def from_native(cls, data: Dict[str, Any]) -> "VideoCondition":
+        return cls(**data)
+
 
 @dataclass
 class AudioCondition:
@@ -90,6 +100,10 @@ class AudioCondition:
             meta.sampling_rate >= self.min_sample_rate
         )
 
+    @classmethod
+    def from_native(cls, data: Dict[str, Any]) -> "AudioCondition":
+        return cls(**data)
+
 
 @dataclass
 class VideoProfile:
@@ -99,6 +113,18 @@ class VideoProfile:
     condition: VideoCondition
     segment_duration: float
     video: List[str]  # List of VideoTrack ids defined in a preset
+    container_format: str = MPEGTS
+    single_file: bool = False
+
+    @classmethod
+    def from_native(cls, data: Dict[str, Any]) -> "VideoProfile":
+        return cls(
+            condition=VideoCondition.from_native(data['condition']),
+            segment_duration=data['segment_duration'],
+            video=list(data['video']),
+            container_format=data.get('container_format', MPEGTS),
+            single_file=data.get('single_file', False),
+        )
 
 
 @dataclass
@@ -109,6 +135,13 @@ class AudioProfile:
     condition: AudioCondition
     audio: List[str]  # List of AudioTrack ids defined in a preset
 
+    @classmethod
+    def from_native(cls, data: Dict[str, Any]) -> "AudioProfile":
+        return cls(
+            condition=AudioCondition.from_native(data['condition']),
+            audio=list(data['audio']),
+        )
+
 
 @dataclass
 class Container:
@@ -116,6 +149,11 @@ class Container:
     Output file format
     """
     segment_duration: Optional[float] = None
+    # HLS segments format: MPEG-TS or fragmented MP4 (CMAF)
+    format: str = MPEGTS
+    # All segments of a rendition are written to a single file and are
+    # addressed with byte ranges.
+    single_file: bool = False
 
     @classmethod
     def from_native(cls, data: Dict[str, Any]) -> "Container":
@@ -150,31 +188,98 @@ class Preset:
     video: List[VideoTrack]
     audio: List[AudioTrack]
 
+    @classmethod
+    def from_native(cls, data: Dict[str, Any]) -> "Preset":
+        return cls(
+            video_profiles=list(map(VideoProfile.from_native,
+                                    data['video_profiles'])),
+            audio_profiles=list(map(AudioProfile.from_native,
+                                    data['audio_profiles'])),
+            video=list(map(VideoTrack.from_native, data['video'])),
+            audio=list(map(AudioTrack.from_native, data['audio'])),
+        )
+
+    @cached_property
+    def selector(self) -> "ProfileSelector":
+        """
+        Profile selection structure compiled on first use.
+        """
+        return ProfileSelector(self)
+
     def select_profile(self,
                        video: VideoMeta,
                        audio: AudioMeta) -> Profile:
-        video_profile = None
-        for vp in self.video_profiles:
-            if vp.condition.is_valid(video):
-                video_profile = vp
-                break
-        if video_profile is None:
-            raise RuntimeError("No compatible video profiles")
+        return self.selector.select(video, audio)
 
-        audio_profile = None
-        for ap in self.audio_profiles:
-            if ap.condition.is_valid(audio):
-                audio_profile = ap
-                break
-        if audio_profile is None:
-            raise RuntimeError("No compatible audio profiles")
 
+Condition = Union[VideoCondition, AudioCondition]
+
+
+class ProfileSelector:
+    """
+    Profile selection structure compiled once per preset.
+
+    Keeps profile conditions in preset order, because first matching profile
+    wins, and resolved profiles for every pair of video and audio profiles,
+    so selection costs only condition checks.
+    """
+
+    def __init__(self, preset: Preset) -> None:
+        self.video_conditions = [vp.condition for vp in preset.video_profiles]
+        self.audio_conditions = [ap.condition for ap in preset.audio_profiles]
+        # Tracks are kept in preset order
+        video_ids = {v.id: i for i, v in enumerate(preset.video)}
+        audio_ids = {a.id: i for i, a in enumerate(preset.audio)}
+        video_tracks = [
+            [preset.video[i] for i in sorted(
+                video_ids[t] for t in set(vp.video) if t in video_ids)]
+            for vp in preset.video_profiles
+        ]
+        audio_tracks = [
+            [preset.audio[i] for i in sorted(
+                audio_ids[t] for t in set(ap.audio) if t in audio_ids)]
+            for ap in preset.audio_profiles
+        ]
+        self.profiles: Dict[Tuple[int, int], Profile] = {}
+        for (i, vp), j in product(enumerate(preset.video_profiles),
+                                  range(len(preset.audio_profiles))):
+            self.profiles[i, j] = Profile(
+                video=video_tracks[i],
+                audio=audio_tracks[j],
+                container=Container(segment_duration=vp.segment_duration,
+                                    format=vp.container_format,
+                                    single_file=vp.single_file),
+            )
+
+    @staticmethod
+    def find(conditions: Sequence[Condition], meta: Any) -> Optional[int]:
+        """
+        :return: index of first condition satisfied by stream metadata.
+        """
+        for i, c in enumerate(conditions):
+            if c.is_valid(meta):
+                return i
+        return None
+
+    def select(self, video: VideoMeta, audio: AudioMeta) -> Profile:
+        """
+        :return: a copy of resolved profile for source streams metadata.
+        """
+        i = self.find(self.video_conditions, video)
+        if i is None:
+            raise RuntimeError("No compatible video profiles")
+        j = self.find(self.audio_conditions, audio)
+        if j is None:
+            raise RuntimeError("No compatible audio profiles")
+        profile = self.profiles[i, j]
         # noinspection PyTypeChecker
         return Profile(
-            video=[v for v in self.video if v.id in video_profile.video],
-            audio=[a for a in self.audio if a.id in audio_profile.audio],
+            video=list(profile.video),
+            audio=list(profile.audio),
             container=Container(
-                segment_duration=video_profile.segment_duration),
+                segment_duration=profile.container.segment_duration,
+                format=profile.container.format,
+                single_file=profile.container.single_file),
         )
 
 
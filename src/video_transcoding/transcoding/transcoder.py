@@ -1,35 +1,51 @@
 import abc
 import os.path
+from dataclasses import replace
 from itertools import product
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional, cast
 from urllib.parse import urljoin
 
 from fffw import encoding
-from fffw.encoding.vector import SIMD, Vector
-from fffw.graph import VIDEO, AUDIO
+from fffw.encoding.vector import Vector
+from fffw.graph import VIDEO, AUDIO, meta
 
 from video_transcoding import defaults
-from video_transcoding.transcoding import codecs, inputs, outputs, extract
+from video_transcoding.transcoding import (
+    codecs,
+    inputs,
+    outputs,
+    extract,
+    ffmpeg,
+)
 from video_transcoding.transcoding.metadata import Metadata
-from video_transcoding.transcoding.profiles import Profile
+from video_transcoding.transcoding.profiles import Profile, FMP4
 from video_transcoding.utils import LoggerMixin
 
-
 class Processor(LoggerMixin, abc.ABC):
     """
     A single processing step abstract class.
     """
     requires_video: bool = True
     requires_audio: bool = True
+    last_progress: Optional[ffmpeg.Progress] = None
+    """
+    Last ffmpeg progress report.
+    """
 
     def __init__(self, src: str, dst: str, *,
                  profile: Profile,
-                 meta: Metadata) -> None:
+                 meta: Metadata,
+                 progress: Optional[ffmpeg.ProgressCallback] = None,
+                 ) -> None:
+        """
+        :param progress: a function called with ffmpeg progress reports.
+        """
         super().__init__()
         self.src = src
         self.dst = dst
         self.profile = profile
         self.meta = meta
+        self.progress = progress
 
     def __call__(self) -> Metadata:
         return self.process()
@@ -51,20 +67,46 @@ class Processor(LoggerMixin, abc.ABC):
         """
         raise NotImplementedError()
 
-    @staticmethod
-    def run(ff: encoding.FFMPEG) -> None:
+    def run(self, ff: encoding.FFMPEG) -> None:
         """ Starts ffmpeg process and captures errors from it's logs"""
-        return_code, output, error = ff.run()
+        if isinstance(ff, ffmpeg.FFMPEG):
+            ff.track_progress(self.handle_progress)
+        try:
+            return_code, output, error = ff.run()
+        finally:
+            last = self.last_progress
+            if last is not None and not last.finished:
+                # ffmpeg has failed without final progress report
+                self.handle_progress(replace(last, finished=True))
         if return_code != 0:
             # Check return code and error messages
             error = error or f"invalid ffmpeg return code {return_code}"
             raise RuntimeError(error)
 
+    def handle_progress(self, progress: ffmpeg.Progress) -> None:
+        """
+        Keeps last ffmpeg progress report and passes it to progress callback.
+        """
+        self.last_progress = progress
+        if self.progress is not None:
+            self.progress(progress)
+
     @abc.abstractmethod
     def prepare_ffmpeg(self, src: Metadata
                        ) -> encoding.FFMPEG:  # pragma: no cover
         raise NotImplementedError
 
+    def prepare_audio_codecs(self) -> List[codecs.AudioCodec]:
+        audio_codecs = []
+        for audio in self.profile.audio:
+            audio_codecs.append(codecs.AudioCodec(
+                codec=audio.codec,
+                bitrate=audio.bitrate,
+                channels=audio.channels,
+                rate=audio.sample_rate,
+            ))
+        return audio_codecs
+
 
 class Transcoder(Processor):
     """
@@ -72,10 +114,62 @@ class Transcoder(Processor):
     """
     requires_audio = False
 
+    def process(self) -> Metadata:
+        ff = self.prepare_ffmpeg(self.meta)
+        self.run(ff)
+        dst = self.get_encoded_metadata(ff)
+        if not defaults.VIDEO_VERIFY_RESULTS:
+            return dst
+        probed = self.get_result_metadata(self.dst)
+        self.verify_metadata(dst, probed)
+        return probed
+
     def get_result_metadata(self, uri: str) -> Metadata:
         dst = extract.VideoResultExtractor().get_meta_data(uri)
         return dst
 
+    def get_encoded_metadata(self, ff: encoding.FFMPEG) -> Metadata:
+        """
+        Builds result metadata without probing resulting file.
+
+        Stream parameters are computed by ffmpeg graph from source metadata
+        and profile, frames count is taken from last ffmpeg progress report.
+
+        :param ff: finished ffmpeg command.
+        :return: metadata object with video streams.
+        """
+        video_codecs = [c for o in ff.outputs for c in o.codecs
+                        if c.kind == VIDEO]
+        if len(video_codecs) != len(self.profile.video):  # pragma: no cover
+            raise RuntimeError("video streams mismatch")
+        last = self.last_progress
+        videos: List[meta.VideoMeta] = []
+        for codec, track in zip(video_codecs, self.profile.video):
+            vm = cast(meta.VideoMeta, codec.meta)
+            frames = round(float(vm.duration) * track.frame_rate)
+            if last is not None and last.frame and not videos:
+                # ffmpeg reports frames count for first video stream only
+                frames = last.frame
+            # Missing bitrate is OK because it varies among segments.
+            videos.append(replace(vm,
+                                  frame_rate=track.frame_rate,
+                                  frames=frames,
+                                  bitrate=0))
+        return Metadata(uri=self.dst, videos=videos, audios=[])
+
+    def verify_metadata(self, encoded: Metadata, probed: Metadata) -> None:
+        """
+        Reports differences between encoded and probed result metadata.
+        """
+        if len(encoded.videos) != len(probed.videos):
+            self.logger.warning("Video streams mismatch for %s: %s != %s",
+                                self.dst, encoded.videos, probed.videos)
+            return
+        for e, p in zip(encoded.videos, probed.videos):
+            if e.frames != p.frames:
+                self.logger.warning("Frames mismatch for %s: %s != %s",
+                                    self.dst, e.frames, p.frames)
+
     def prepare_ffmpeg(self, src: Metadata) -> encoding.FFMPEG:
         """
         Prepares ffmpeg command for a given source
@@ -96,11 +190,11 @@ class Transcoder(Processor):
     def scale_and_encode(self,
                          source: inputs.Input,
                          video_codecs: List[codecs.VideoCodec],
-                         dst: outputs.Output) -> SIMD:
+                         dst: outputs.Output) -> ffmpeg.SIMD:
         # ffmpeg wrapper with vectorized processing capabilities
-        simd = SIMD(source, dst,
-                    overwrite=True,
-                    loglevel='repeat+level+info')
+        simd = ffmpeg.SIMD(source, dst,
+                           overwrite=True,
+                           loglevel='repeat+level+info')
         # per-video-track scaling
         scaling_params = [
             (video.width, video.height) for video in self.profile.video
@@ -145,6 +239,141 @@ class Transcoder(Processor):
         return video_codecs
 
 
+class HLSTranscoder(Transcoder):
+    """
+    Transcodes source chunk directly to HLS segments for each video track.
+
+    Segments of all chunks are stored in the same collection, so their names
+    must be unique for each chunk. Chunk playlists are joined to media
+    playlists after all chunks are transcoded.
+    """
+
+    def __init__(self, src: str, dst: str, *,
+                 segments: str,
+                 profile: Profile,
+                 meta: Metadata,
+                 progress: Optional[ffmpeg.ProgressCallback] = None,
+                 ) -> None:
+        """
+        :param dst: chunk playlist uri template with `%v` for variant name.
+        :param segments: segment uri template with `%v` for variant name and
+            `%05d` for segment number.
+        """
+        super().__init__(src, dst, profile=profile, meta=meta,
+                         progress=progress)
+        self.segments = segments
+
+    def get_result_metadata(self, uri: str) -> Metadata:
+        videos: List[meta.VideoMeta] = []
+        for i in range(len(self.profile.video)):
+            playlist = uri.replace('%v', f'v{i}')
+            videos.extend(extract.HLSExtractor().get_meta_data(playlist).videos)
+        return Metadata(uri=uri, videos=videos, audios=[])
+
+    def prepare_output(self,
+                       video_codecs: List[encoding.VideoCodec],
+                       ) -> encoding.Output:
+        var_stream_map = ' '.join(f'v:{i},name:v{i}'
+                                  for i in range(len(video_codecs)))
+        return outputs.HLSOutput(
+            output_file=self.dst,
+            codecs=[*video_codecs],
+            hls_time=self.profile.container.segment_duration,
+            hls_playlist_type='vod',
+            hls_segment_filename=self.segments,
+            var_stream_map=var_stream_map,
+            muxdelay='0',
+            # timestamps are continuous between chunks because of copyts
+            avoid_negative_ts='disabled',
+            copyts=True,
+        )
+
+
+class AudioTranscoder(Processor):
+    """
+    Source audio transcoding logic.
+
+    Encodes source audio to all audio tracks from profile, so they can be
+    copied to HLS without encoding.
+    """
+    requires_video = False
+
+    def get_result_metadata(self, uri: str) -> Metadata:
+        dst = extract.AudioResultExtractor().get_meta_data(uri)
+        return dst
+
+    def prepare_ffmpeg(self, src: Metadata) -> encoding.FFMPEG:
+        audio_streams = [s for s in src.streams if s.kind == AUDIO]
+        source = inputs.input_file(self.src, *audio_streams)
+        audio_codecs = [source.audio > c for c in self.prepare_audio_codecs()]
+        out = self.prepare_output(audio_codecs)
+        return ffmpeg.FFMPEG(input=source,
+                             output=out,
+                             loglevel='level+info',
+                             overwrite=True)
+
+    def prepare_output(self,
+                       codecs_list: List[encoding.Codec],
+                       ) -> encoding.Output:
+        return outputs.FileOutput(
+            output_file=self.dst,
+            method='PUT',
+            codecs=codecs_list,
+            format='matroska',
+            avoid_negative_ts='disabled',
+            copyts=True,
+        )
+
+
+class HLSAudioTranscoder(AudioTranscoder):
+    """
+    Transcodes source audio directly to HLS segments for each audio track.
+    """
+
+    def __init__(self, src: str, dst: str, *,
+                 segments: str,
+                 profile: Profile,
+                 meta: Metadata,
+                 playlist_type: str = 'vod',
+                 progress: Optional[ffmpeg.ProgressCallback] = None,
+                 ) -> None:
+        """
+        :param dst: media playlist uri template with `%v` for variant name.
+        :param segments: segment uri template with `%v` for variant name and
+            `%05d` for segment number.
+        :param playlist_type: `vod` or `event` to update playlist after each
+            segment.
+        """
+        super().__init__(src, dst, profile=profile, meta=meta,
+                         progress=progress)
+        self.segments = segments
+        self.playlist_type = playlist_type
+
+    def get_result_metadata(self, uri: str) -> Metadata:
+        audios: List[meta.AudioMeta] = []
+        for i in range(len(self.profile.audio)):
+            playlist = uri.replace('%v', f'a{i}')
+            audios.extend(extract.HLSExtractor().get_meta_data(playlist).audios)
+        return Metadata(uri=uri, videos=[], audios=audios)
+
+    def prepare_output(self,
+                       codecs_list: List[encoding.Codec],
+                       ) -> encoding.Output:
+        var_stream_map = ' '.join(f'a:{i},name:a{i}'
+                                  for i in range(len(codecs_list)))
+        return outputs.HLSOutput(
+            output_file=self.dst,
+            codecs=codecs_list,
+            hls_time=self.profile.container.segment_duration,
+            hls_playlist_type=self.playlist_type,
+            hls_segment_filename=self.segments,
+            var_stream_map=var_stream_map,
+            muxdelay='0',
+            avoid_negative_ts='disabled',
+            copyts=True,
+        )
+
+
 class Splitter(Processor):
     """
     Source splitting logic.
@@ -155,11 +384,19 @@ class Splitter(Processor):
                  source_video_playlist: str,
                  source_video_chunk: str,
                  source_audio: str,
+                 segment_times: Optional[List[float]] = None,
+                 progress: Optional[ffmpeg.ProgressCallback] = None,
                  ) -> None:
-        super().__init__(src, dst, profile=profile, meta=meta)
+        """
+        :param segment_times: source split points, seconds; source is split
+            every VIDEO_CHUNK_DURATION seconds if not set.
+        """
+        super().__init__(src, dst, profile=profile, meta=meta,
+                         progress=progress)
         self.source_video_playlist = source_video_playlist
         self.source_video_chunk = source_video_chunk
         self.source_audio = source_audio
+        self.segment_times = segment_times
 
     def get_result_metadata(self, uri: str) -> Metadata:
         extractor = extract.SplitExtractor(
@@ -184,9 +421,9 @@ class Splitter(Processor):
         audio_codecs = [source.audio > codecs.Copy(kind=AUDIO)]
         video_out = self.prepare_video_output(video_codecs)
         audio_out = self.prepare_audio_output(audio_codecs)
-        ff = encoding.FFMPEG(input=source,
-                             loglevel='level+info',
-                             overwrite=True)
+        ff = ffmpeg.FFMPEG(input=source,
+                           loglevel='level+info',
+                           overwrite=True)
         ff > video_out
         ff > audio_out
         return ff
@@ -205,7 +442,7 @@ class Splitter(Processor):
 
     def get_video_output_kwargs(self, codecs_list: List[encoding.Codec]
                                 ) -> Dict[str, Any]:
-        return dict(
+        kwargs: Dict[str, Any] = dict(
             codecs=codecs_list,
             format='stream_segment',
             segment_format='mkv',
@@ -213,9 +450,15 @@ class Splitter(Processor):
             copyts=True,
             segment_list=urljoin(self.dst, self.source_video_playlist),
             segment_list_type='m3u8',
-            segment_time=defaults.VIDEO_CHUNK_DURATION,
             output_file=urljoin(self.dst, self.source_video_chunk),
         )
+        if self.segment_times:
+            # timestamps are not shifted because of copyts
+            kwargs['segment_times'] = ','.join(
+                f'{t:.6f}' for t in self.segment_times)
+        else:
+            kwargs['segment_time'] = defaults.VIDEO_CHUNK_DURATION
+        return kwargs
 
     def get_audio_output_kwargs(self, codecs_list: List[encoding.Codec]
                                 ) -> Dict[str, Any]:
@@ -242,9 +485,22 @@ class Segmentor(Processor):
     def __init__(self, *,
                  video_source: str, audio_source: str,
                  dst: str, profile: Profile,
-                 meta: Metadata) -> None:
-        super().__init__(video_source, dst, profile=profile, meta=meta)
+                 meta: Metadata,
+                 copy_audio: bool = False,
+                 safe_concat: bool = True,
+                 progress: Optional[ffmpeg.ProgressCallback] = None,
+                 ) -> None:
+        """
+        :param copy_audio: audio source contains encoded audio tracks from
+            profile (see AudioTranscoder).
+        :param safe_concat: video source is a ffconcat file with relative
+            file names only.
+        """
+        super().__init__(video_source, dst, profile=profile, meta=meta,
+                         progress=progress)
         self.audio = audio_source
+        self.copy_audio = copy_audio
+        self.safe_concat = safe_concat
 
     def get_result_metadata(self, uri: str) -> Metadata:
         dst = extract.HLSExtractor().get_meta_data(uri)
@@ -252,7 +508,8 @@ class Segmentor(Processor):
 
     def prepare_ffmpeg(self, src: Metadata) -> encoding.FFMPEG:
         video_streams = [s for s in src.streams if s.kind == VIDEO]
-        video_source = inputs.input_file(self.src, *video_streams)
+        kwargs = {} if self.safe_concat else {'safe': '0'}
+        video_source = inputs.input_file(self.src, *video_streams, **kwargs)
         video_codecs = [s > codecs.Copy(kind=VIDEO, bitrate=s.meta.bitrate)
                         for s in video_source.streams
                         if s.kind == VIDEO]
@@ -264,7 +521,13 @@ class Segmentor(Processor):
 
         audio_streams = [s for s in src.streams if s.kind == AUDIO]
         audio_source = inputs.input_file(self.audio, *audio_streams)
-        audio_codecs = [audio_source.audio > c for c in self.prepare_audio_codecs()]
+        if self.copy_audio:
+            audio_codecs = [s > codecs.Copy(kind=AUDIO)
+                            for s in audio_source.streams
+                            if s.kind == AUDIO]
+        else:
+            audio_codecs = [audio_source.audio > c
+                            for c in self.prepare_audio_codecs()]
 
         if len(audio_codecs) != len(self.profile.audio):  # pragma: no cover
             raise RuntimeError("audio streams mismatch")
@@ -273,24 +536,13 @@ class Segmentor(Processor):
             ac.bitrate = at.bitrate
 
         out = self.prepare_output(video_codecs + audio_codecs)
-        ff = encoding.FFMPEG(input=video_source,
-                             output=out,
-                             loglevel='level+info',
-                             overwrite=True)
+        ff = ffmpeg.FFMPEG(input=video_source,
+                           output=out,
+                           loglevel='level+info',
+                           overwrite=True)
         ff.add_input(audio_source)
         return ff
 
-    def prepare_audio_codecs(self) -> List[codecs.AudioCodec]:
-        audio_codecs = []
-        for audio in self.profile.audio:
-            audio_codecs.append(codecs.AudioCodec(
-                codec=audio.codec,
-                bitrate=audio.bitrate,
-                channels=audio.channels,
-                rate=audio.sample_rate,
-            ))
-        return audio_codecs
-
     def prepare_output(self,
                        codecs_list: List[encoding.Codec]
                        ) -> encoding.Output:
@@ -301,7 +553,7 @@ class Segmentor(Processor):
     def get_output_kwargs(self,
                           codecs_list: List[encoding.Codec]
                           ) -> Dict[str, Any]:
-        return dict(
+        kwargs: Dict[str, Any] = dict(
             hls_time=self.profile.container.segment_duration,
             hls_playlist_type='vod',
             codecs=codecs_list,
@@ -314,6 +566,23 @@ class Segmentor(Processor):
             hls_segment_filename=urljoin(self.dst, 'segment-%v-%05d.ts'),
             master_pl_name=os.path.basename(self.dst),
         )
+        ext = 'ts'
+        if self.profile.container.format == FMP4:
+            # Same init and media segments are referenced from DASH manifest
+            ext = 'm4s'
+            kwargs.update(
+                hls_segment_type='fmp4',
+                hls_fmp4_init_filename='init-%v.mp4',
+                hls_segment_filename=urljoin(self.dst,
+                                             f'segment-%v-%05d.{ext}'),
+            )
+        if self.profile.container.single_file:
+            # Segments are addressed with EXT-X-BYTERANGE in a single file
+            kwargs.update(
+                hls_flags='single_file',
+                hls_segment_filename=urljoin(self.dst, f'segment-%v.{ext}'),
+            )
+        return kwargs
 
     @staticmethod
     def get_var_stream_map(codecs_list: List[encoding.Codec]) -> str:
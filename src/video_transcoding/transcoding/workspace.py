@@ -1,16 +1,73 @@
 import abc
 import http
 import os
+import re
 import shutil
+import socket
+import threading
+import time
+from collections import OrderedDict
+from contextlib import suppress
+from functools import lru_cache
 from pathlib import Path
-from typing import Optional, Any
-from urllib.parse import urlparse, ParseResult
+from typing import Optional, Any, IO, List, Dict, Iterator, Pattern, Set
+from urllib.parse import urlparse, ParseResult, unquote
+from xml.etree import ElementTree
 
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection
+from urllib3.util.retry import Retry
 
 from video_transcoding import defaults
 from video_transcoding.utils import LoggerMixin
 
+# Chunk size for streaming reads, bytes
+STREAM_CHUNK_SIZE = 64 * 1024
+
+# ffmpeg output filename fields: `%v` for HLS variant and `%05d` for segment
+# number
+OUTPUT_PATTERN_RE = re.compile(r'%(v|0?\d*d)')
+
+
+def output_regex(basename: str) -> Optional[Pattern[str]]:
+    """
+    :param basename: ffmpeg output filename.
+    :returns: regex matching filenames written by ffmpeg, or None if
+        basename contains no filename fields.
+    """
+    if not OUTPUT_PATTERN_RE.search(basename):
+        return None
+    parts = []
+    pos = 0
+    for m in OUTPUT_PATTERN_RE.finditer(basename):
+        parts.append(re.escape(basename[pos:m.start()]))
+        # variant names don't contain dashes used as separators
+        parts.append(r'[^-]+' if m.group(1) == 'v' else r'\d+')
+        pos = m.end()
+    parts.append(re.escape(basename[pos:]))
+    return re.compile(''.join(parts))
+
+
+def match_outputs(path: str) -> List[str]:
+    """
+    Lists local files written by ffmpeg to a path.
+
+    :param path: local file path, basename may contain ffmpeg filename
+        fields.
+    :returns: matching file paths, or path itself if it is not a pattern.
+    """
+    dirname, basename = os.path.split(path)
+    regex = output_regex(basename)
+    if regex is None:
+        return [path]
+    try:
+        names = os.listdir(dirname)
+    except FileNotFoundError:
+        return []
+    return sorted(os.path.join(dirname, fn) for fn in names
+                  if regex.fullmatch(fn))
+
 
 class Resource(abc.ABC):
     """
@@ -101,15 +158,69 @@ class Workspace(LoggerMixin, abc.ABC):
     def write(self, f: File, content: str) -> None:  # pragma: no cover
         raise NotImplementedError
 
+    @abc.abstractmethod
+    def read_stream(self, f: File) -> Iterator[bytes]:  # pragma: no cover
+        """
+        Reads file content by chunks without keeping it in memory.
+        """
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def write_stream(self, f: File,
+                     stream: IO[bytes]) -> None:  # pragma: no cover
+        """
+        Writes file content from a file-like object.
+        """
+        raise NotImplementedError
+
     @abc.abstractmethod
     def exists(self, r: Resource) -> bool:  # pragma: no cover
         raise NotImplementedError
 
+    @abc.abstractmethod
+    def size(self, f: File) -> Optional[int]:  # pragma: no cover
+        """
+        :returns: file size in bytes, or None if file does not exist.
+        """
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def list_collection(self, c: Collection
+                        ) -> List[Resource]:  # pragma: no cover
+        """
+        Lists direct children of a collection.
+
+        :returns: files and collections in a collection, empty list if
+            collection does not exist.
+        """
+        raise NotImplementedError
+
     def __init__(self, uri: ParseResult) -> None:
         super().__init__()
         self.uri = uri._replace(path=uri.path.rstrip('/'))
         self.root = Collection()
 
+    def get_input_uri(self, f: File) -> ParseResult:
+        """
+        :returns: uri for ffmpeg to read a file from.
+        """
+        return self.get_absolute_uri(f)
+
+    def get_output_uri(self, f: File) -> ParseResult:
+        """
+        :returns: uri for ffmpeg to write a file to, `commit` must be called
+            after file is written.
+        """
+        return self.get_absolute_uri(f)
+
+    def commit(self, f: File) -> None:
+        """
+        Finishes writing a file to an uri returned by `get_output_uri`.
+
+        File basename may contain ffmpeg filename fields (i.e. `%v` and
+        `%05d`) to commit all files written by HLS muxer.
+        """
+
     def ensure_collection(self, path: str) -> Collection:
         """
         Ensures that a directory with relative path exists.
@@ -145,6 +256,29 @@ class FileSystemWorkspace(Workspace):
         self.logger.debug("exists %s", uri.path)
         return os.path.exists(uri.path)
 
+    def size(self, f: File) -> Optional[int]:
+        uri = self.get_absolute_uri(f)
+        self.logger.debug("stat %s", uri.path)
+        try:
+            return os.stat(uri.path).st_size
+        except FileNotFoundError:
+            return None
+
+    def list_collection(self, c: Collection) -> List[Resource]:
+        uri = self.get_absolute_uri(c)
+        self.logger.debug("scandir %s", uri.path)
+        result: List[Resource] = []
+        try:
+            with os.scandir(uri.path) as it:
+                for entry in it:
+                    if entry.is_dir():
+                        result.append(c.collection(entry.name))
+                    else:
+                        result.append(c.file(entry.name))
+        except FileNotFoundError:
+            self.logger.warning("dir not found: %s", uri.path)
+        return result
+
     def read(self, r: File) -> str:
         uri = self.get_absolute_uri(r)
         self.logger.debug("read %s", uri.path)
@@ -157,11 +291,76 @@ class FileSystemWorkspace(Workspace):
         with open(uri.path, 'w') as f:
             f.write(content)
 
+    def read_stream(self, r: File) -> Iterator[bytes]:
+        uri = self.get_absolute_uri(r)
+        self.logger.debug("read %s", uri.path)
+        with open(uri.path, 'rb') as f:
+            yield from iter(lambda: f.read(STREAM_CHUNK_SIZE), b'')
+
+    def write_stream(self, r: File, stream: IO[bytes]) -> None:
+        uri = self.get_absolute_uri(r)
+        self.logger.debug("write %s", uri.path)
+        with open(uri.path, 'wb') as f:
+            shutil.copyfileobj(stream, f)
+
+
+PROPFIND_BODY = (
+    '<?xml version="1.0" encoding="utf-8"?>'
+    '<propfind xmlns="DAV:"><prop><resourcetype/></prop></propfind>'
+)
+
+
+# Requests retried on connection errors and server errors. MKCOL is safe to
+# repeat because "collection exists" response is ignored.
+RETRY_METHODS = frozenset({
+    'HEAD', 'GET', 'PUT', 'DELETE', 'OPTIONS', 'PROPFIND', 'MKCOL',
+})
+
+
+class KeepAliveAdapter(HTTPAdapter):
+    """
+    HTTP adapter enabling TCP keep-alive for pooled connections, so idle
+    connections are not dropped by firewalls while ffmpeg is running.
+    """
+
+    def init_poolmanager(self, *args: Any, **kwargs: Any) -> None:
+        kwargs['socket_options'] = [
+            *HTTPConnection.default_socket_options,
+            (socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1),
+        ]
+        super().init_poolmanager(  # type: ignore[no-untyped-call]
+            *args, **kwargs)
+
+
+def init_session() -> requests.Session:
+    """
+    Initializes HTTP session with connection pool and retry policy.
+    """
+    retry = Retry(
+        total=defaults.VIDEO_WEBDAV_MAX_RETRIES,
+        backoff_factor=defaults.VIDEO_WEBDAV_RETRY_BACKOFF,
+        status_forcelist=(500, 502, 503, 504),
+        allowed_methods=RETRY_METHODS,
+        # last response is checked with raise_for_status
+        raise_on_status=False,
+    )
+    if defaults.VIDEO_WEBDAV_TCP_KEEPALIVE:
+        adapter: HTTPAdapter = KeepAliveAdapter(
+            pool_maxsize=defaults.VIDEO_WEBDAV_POOL_SIZE,
+            max_retries=retry)
+    else:
+        adapter = HTTPAdapter(pool_maxsize=defaults.VIDEO_WEBDAV_POOL_SIZE,
+                              max_retries=retry)
+    session = requests.Session()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
 
 class WebDAVWorkspace(Workspace):
     def __init__(self, base: str) -> None:
         super().__init__(urlparse(base))
-        self.session = requests.Session()
+        self.session = init_session()
 
     def create_collection(self, c: Collection) -> None:
         self._mkcol(self.root)
@@ -192,6 +391,48 @@ class WebDAVWorkspace(Workspace):
         resp.raise_for_status()
         return True
 
+    def size(self, f: File) -> Optional[int]:
+        uri = self.get_absolute_uri(f)
+        self.logger.debug("head %s", uri.geturl())
+        timeout = (defaults.VIDEO_CONNECT_TIMEOUT,
+                   defaults.VIDEO_REQUEST_TIMEOUT,)
+        resp = self.session.request("HEAD", uri.geturl(), timeout=timeout)
+        if resp.status_code == http.HTTPStatus.NOT_FOUND:
+            return None
+        resp.raise_for_status()
+        return int(resp.headers['Content-Length'])
+
+    def list_collection(self, c: Collection) -> List[Resource]:
+        uri = self.get_absolute_uri(c)
+        if not uri.path.endswith('/'):
+            uri = uri._replace(path=uri.path + '/')
+        self.logger.debug("propfind %s", uri.geturl())
+        timeout = (defaults.VIDEO_CONNECT_TIMEOUT,
+                   defaults.VIDEO_REQUEST_TIMEOUT,)
+        resp = self.session.request(
+            "PROPFIND", uri.geturl(),
+            headers={'Depth': '1', 'Content-Type': 'application/xml'},
+            data=PROPFIND_BODY,
+            timeout=timeout)
+        if resp.status_code == http.HTTPStatus.NOT_FOUND:
+            self.logger.warning("collection not found: %s", uri.geturl())
+            return []
+        resp.raise_for_status()
+        result: List[Resource] = []
+        root = ElementTree.fromstring(resp.content)
+        for item in root.iter('{DAV:}response'):
+            href = item.findtext('{DAV:}href', default='')
+            path = unquote(urlparse(href).path)
+            if path.rstrip('/') == unquote(uri.path).rstrip('/'):
+                # Depth:1 response includes requested collection itself
+                continue
+            name = path.rstrip('/').rsplit('/', 1)[-1]
+            if item.find('.//{DAV:}resourcetype/{DAV:}collection') is not None:
+                result.append(c.collection(name))
+            else:
+                result.append(c.file(name))
+        return result
+
     def read(self, r: File) -> str:
         uri = self.get_absolute_uri(r)
         self.logger.debug("get %s", uri.geturl())
@@ -204,7 +445,33 @@ class WebDAVWorkspace(Workspace):
     def write(self, r: File, content: str) -> None:
         uri = self.get_absolute_uri(r)
         self.logger.debug("put %s", uri.geturl())
-        resp = self.session.request("PUT", uri.geturl(), data=content)
+        # server may respond after whole body is stored
+        timeout = (defaults.VIDEO_CONNECT_TIMEOUT,
+                   defaults.VIDEO_UPLOAD_TIMEOUT,)
+        resp = self.session.request("PUT", uri.geturl(), data=content,
+                                    timeout=timeout)
+        resp.raise_for_status()
+
+    def read_stream(self, r: File) -> Iterator[bytes]:
+        uri = self.get_absolute_uri(r)
+        self.logger.debug("get %s", uri.geturl())
+        timeout = (defaults.VIDEO_CONNECT_TIMEOUT,
+                   defaults.VIDEO_REQUEST_TIMEOUT,)
+        with self.session.request("GET", uri.geturl(), timeout=timeout,
+                                  stream=True) as resp:
+            resp.raise_for_status()
+            yield from resp.iter_content(STREAM_CHUNK_SIZE)
+
+    def write_stream(self, r: File, stream: IO[bytes]) -> None:
+        uri = self.get_absolute_uri(r)
+        self.logger.debug("put %s", uri.geturl())
+        # server may respond after whole body is stored
+        timeout = (defaults.VIDEO_CONNECT_TIMEOUT,
+                   defaults.VIDEO_UPLOAD_TIMEOUT,)
+        # requests sends file-like body by chunks, seekable streams are
+        # rewound on retry
+        resp = self.session.request("PUT", uri.geturl(), data=stream,
+                                    timeout=timeout)
         resp.raise_for_status()
 
     def _mkcol(self, c: Collection) -> None:
@@ -221,6 +488,532 @@ class WebDAVWorkspace(Workspace):
             resp.raise_for_status()
 
 
+@lru_cache(maxsize=None)
+def get_s3_client() -> Any:
+    """
+    Returns S3 client shared between all S3 workspaces.
+
+    Client is thread-safe and keeps a pool of HTTP connections.
+    """
+    try:
+        import boto3
+        from botocore.config import Config
+    except ImportError:  # pragma: no cover
+        raise RuntimeError("boto3 is required for s3:// workspaces")
+    config = Config(
+        connect_timeout=defaults.VIDEO_CONNECT_TIMEOUT,
+        read_timeout=defaults.VIDEO_REQUEST_TIMEOUT,
+        max_pool_connections=defaults.VIDEO_S3_MAX_POOL_CONNECTIONS,
+        retries={'max_attempts': 3, 'mode': 'standard'},
+        # presigned URLs are signed with SigV4 in all regions
+        signature_version='s3v4',
+    )
+    return boto3.client('s3',
+                        endpoint_url=defaults.VIDEO_S3_ENDPOINT_URL,
+                        config=config)
+
+
+class S3Workspace(Workspace):
+    """
+    Workspace at S3-compatible object storage.
+
+    Collections are key prefixes, so they don't need to be created. Absolute
+    URIs are path-style HTTP links at `VIDEO_S3_ENDPOINT_URL`.
+
+    ffmpeg reads files with presigned URLs and writes them to a local
+    staging directory, files are uploaded with signed requests on commit.
+    """
+    # max number of keys per list and delete request
+    batch_size = 1000
+
+    def __init__(self, base: str, client: Any = None,
+                 staging: Optional[str] = None) -> None:
+        """
+        :param staging: local directory for files written by ffmpeg,
+            `VIDEO_S3_STAGING_DIR` by default.
+        """
+        uri = urlparse(base)
+        self.bucket = uri.netloc
+        endpoint = urlparse(defaults.VIDEO_S3_ENDPOINT_URL)
+        super().__init__(endpoint._replace(path=f'/{self.bucket}{uri.path}'))
+        self.client = client if client is not None else get_s3_client()
+        self.staging = staging or defaults.VIDEO_S3_STAGING_DIR
+
+    def get_key(self, r: Resource) -> str:
+        """
+        :returns: object key (or key prefix for collection) for a resource.
+        """
+        path = self.get_absolute_uri(r).path
+        key = path[len(self.bucket) + 2:]
+        if isinstance(r, Collection) and key and not key.endswith('/'):
+            # prefix without delimiter matches sibling keys too
+            key += '/'
+        return key
+
+    def get_staging_path(self, f: File) -> str:
+        """
+        :returns: local path for a file written by ffmpeg.
+        """
+        return os.path.join(self.staging, self.bucket, self.get_key(f))
+
+    def get_input_uri(self, f: File) -> ParseResult:
+        url = self.client.generate_presigned_url(
+            'get_object',
+            Params={'Bucket': self.bucket, 'Key': self.get_key(f)},
+            ExpiresIn=defaults.VIDEO_S3_PRESIGNED_URL_EXPIRES)
+        return urlparse(url)
+
+    def get_output_uri(self, f: File) -> ParseResult:
+        path = self.get_staging_path(f)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        return urlparse(path, scheme='file')
+
+    def commit(self, f: File) -> None:
+        parts = f.parts[:-1]
+        for path in match_outputs(self.get_staging_path(f)):
+            with open(path, 'rb') as stream:
+                self.write_stream(File(*parts, os.path.basename(path)),
+                                  stream)
+            os.unlink(path)
+
+    def create_collection(self, c: Collection) -> None:
+        # S3 has no directories, keys with common prefix are created on write
+        self.logger.debug("mkcol %s", self.get_absolute_uri(c).geturl())
+
+    def delete_collection(self, c: Collection) -> None:
+        prefix = self.get_key(c)
+        self.logger.debug("delete %s", self.get_absolute_uri(c).geturl())
+        found = False
+        kwargs: Dict[str, Any] = {}
+        while True:
+            # continuation is safe here because deleted keys are
+            # already listed
+            resp = self.client.list_objects_v2(Bucket=self.bucket,
+                                               Prefix=prefix,
+                                               MaxKeys=self.batch_size,
+                                               **kwargs)
+            objects = [{'Key': o['Key']} for o in resp.get('Contents', [])]
+            if objects:
+                found = True
+                self.client.delete_objects(
+                    Bucket=self.bucket,
+                    Delete={'Objects': objects, 'Quiet': True})
+            if not resp.get('IsTruncated'):
+                break
+            kwargs = {'ContinuationToken': resp['NextContinuationToken']}
+        if not found:
+            self.logger.warning("collection not found: %s", prefix)
+
+    def exists(self, r: Resource) -> bool:
+        key = self.get_key(r)
+        self.logger.debug("exists %s", self.get_absolute_uri(r).geturl())
+        # object with exact key is listed first for a prefix
+        resp = self.client.list_objects_v2(Bucket=self.bucket,
+                                           Prefix=key,
+                                           MaxKeys=1)
+        contents = resp.get('Contents', [])
+        if not contents:
+            return False
+        return isinstance(r, Collection) or contents[0]['Key'] == key
+
+    def size(self, f: File) -> Optional[int]:
+        key = self.get_key(f)
+        self.logger.debug("stat %s", self.get_absolute_uri(f).geturl())
+        resp = self.client.list_objects_v2(Bucket=self.bucket,
+                                           Prefix=key,
+                                           MaxKeys=1)
+        contents = resp.get('Contents', [])
+        if not contents or contents[0]['Key'] != key:
+            return None
+        return int(contents[0]['Size'])
+
+    def list_collection(self, c: Collection) -> List[Resource]:
+        prefix = self.get_key(c)
+        self.logger.debug("list %s", self.get_absolute_uri(c).geturl())
+        result: List[Resource] = []
+        kwargs: Dict[str, Any] = {}
+        while True:
+            resp = self.client.list_objects_v2(Bucket=self.bucket,
+                                               Prefix=prefix,
+                                               Delimiter='/',
+                                               MaxKeys=self.batch_size,
+                                               **kwargs)
+            for p in resp.get('CommonPrefixes', []):
+                name = p['Prefix'][len(prefix):].rstrip('/')
+                result.append(c.collection(name))
+            for o in resp.get('Contents', []):
+                name = o['Key'][len(prefix):]
+                if name:
+                    # skip "directory" placeholder objects
+                    result.append(c.file(name))
+            if not resp.get('IsTruncated'):
+                break
+            kwargs = {'ContinuationToken': resp['NextContinuationToken']}
+        return result
+
+    def read(self, r: File) -> str:
+        self.logger.debug("get %s", self.get_absolute_uri(r).geturl())
+        resp = self.client.get_object(Bucket=self.bucket, Key=self.get_key(r))
+        return resp['Body'].read().decode('utf-8')
+
+    def read_range(self, r: File, start: int, end: Optional[int] = None
+                   ) -> bytes:
+        """
+        Reads a byte range from a file.
+
+        :param r: file to read.
+        :param start: first byte offset.
+        :param end: last byte offset (inclusive), reads till EOF if not set.
+        """
+        byte_range = f'bytes={start}-{"" if end is None else end}'
+        self.logger.debug("get %s %s", self.get_absolute_uri(r).geturl(),
+                          byte_range)
+        resp = self.client.get_object(Bucket=self.bucket,
+                                      Key=self.get_key(r),
+                                      Range=byte_range)
+        return resp['Body'].read()
+
+    def read_stream(self, r: File) -> Iterator[bytes]:
+        self.logger.debug("get %s", self.get_absolute_uri(r).geturl())
+        resp = self.client.get_object(Bucket=self.bucket, Key=self.get_key(r))
+        body = resp['Body']
+        yield from iter(lambda: body.read(STREAM_CHUNK_SIZE), b'')
+
+    def write(self, r: File, content: str) -> None:
+        self.logger.debug("put %s", self.get_absolute_uri(r).geturl())
+        self.client.put_object(Bucket=self.bucket,
+                               Key=self.get_key(r),
+                               Body=content.encode('utf-8'))
+
+    def write_stream(self, r: File, stream: IO[bytes]) -> None:
+        """
+        Uploads file content from a stream.
+
+        Content is uploaded with a single request if it fits in a single
+        `VIDEO_S3_MULTIPART_CHUNK_SIZE` part, otherwise multipart upload is
+        used so whole file is never kept in memory.
+        """
+        key = self.get_key(r)
+        chunk_size = defaults.VIDEO_S3_MULTIPART_CHUNK_SIZE
+        chunk = stream.read(chunk_size)
+        next_chunk = stream.read(chunk_size)
+        if not next_chunk:
+            self.logger.debug("put %s", self.get_absolute_uri(r).geturl())
+            self.client.put_object(Bucket=self.bucket, Key=key, Body=chunk)
+            return
+        self.logger.debug("multipart put %s",
+                          self.get_absolute_uri(r).geturl())
+        upload_id = self.client.create_multipart_upload(
+            Bucket=self.bucket, Key=key)['UploadId']
+        parts: List[Dict[str, Any]] = []
+        try:
+            while chunk:
+                number = len(parts) + 1
+                resp = self.client.upload_part(Bucket=self.bucket,
+                                               Key=key,
+                                               UploadId=upload_id,
+                                               PartNumber=number,
+                                               Body=chunk)
+                parts.append({'PartNumber': number, 'ETag': resp['ETag']})
+                chunk, next_chunk = next_chunk, stream.read(chunk_size)
+            self.client.complete_multipart_upload(
+                Bucket=self.bucket,
+                Key=key,
+                UploadId=upload_id,
+                MultipartUpload={'Parts': parts})
+        except Exception:
+            self.client.abort_multipart_upload(Bucket=self.bucket,
+                                               Key=key,
+                                               UploadId=upload_id)
+            raise
+
+
+class LocalCache(LoggerMixin):
+    """
+    Size-bounded cache for remote files at local disk.
+
+    Files are evicted in least recently used order. File modification time
+    is used as access time, so cache state is shared between worker
+    processes. File sizes are indexed in memory, cache directory is scanned
+    again each `scan_interval` seconds to account files added by other
+    processes.
+    """
+    # seconds between cache directory scans
+    scan_interval = 60.0
+
+    def __init__(self, root: str, max_size: int) -> None:
+        super().__init__()
+        self.root = root
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        # file sizes by path in least recently used order
+        self.index: "OrderedDict[str, int]" = OrderedDict()
+        self.total = 0
+        self.scanned_at: Optional[float] = None
+
+    def get_path(self, uri: ParseResult) -> str:
+        """
+        :returns: local path for a remote file.
+        """
+        return os.path.join(self.root, uri.netloc, uri.path.lstrip('/'))
+
+    def get(self, uri: ParseResult) -> Optional[str]:
+        """
+        :returns: local path for a remote file if it is cached.
+        """
+        path = self.get_path(uri)
+        try:
+            # mark file as recently used
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        with self.lock:
+            if path in self.index:
+                self.index.move_to_end(path)
+        return path
+
+    def prepare(self, uri: ParseResult) -> str:
+        """
+        Removes files left from previous writes to a path.
+
+        :param uri: remote file uri, basename may contain ffmpeg filename
+            fields.
+        :returns: local path to write a remote file copy to.
+        """
+        path = self.get_path(uri)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        for stale in match_outputs(path):
+            self.remove(stale)
+        return path
+
+    def add(self, uri: ParseResult) -> None:
+        """
+        Registers a file written to local path and evicts least recently used
+        files if cache size is exceeded.
+        """
+        keep = self.get_path(uri)
+        try:
+            size = os.stat(keep).st_size
+        except FileNotFoundError:  # pragma: no cover
+            return
+        with self.lock:
+            now = time.monotonic()
+            if (self.scanned_at is None or
+                    now - self.scanned_at > self.scan_interval):
+                self.scan()
+                self.scanned_at = now
+            self.total += size - self.index.pop(keep, 0)
+            self.index[keep] = size
+            for path, evicted in list(self.index.items()):
+                if self.total <= self.max_size:
+                    break
+                if path == keep:
+                    continue
+                self.logger.debug("evict %s", path)
+                with suppress(FileNotFoundError):
+                    os.unlink(path)
+                self.total -= evicted
+                del self.index[path]
+
+    def scan(self) -> None:
+        """
+        Rebuilds file sizes index from cache directory content.
+        """
+        files = []
+        for dirpath, _, filenames in os.walk(self.root):
+            for fn in filenames:
+                path = os.path.join(dirpath, fn)
+                try:
+                    st = os.stat(path)
+                except FileNotFoundError:  # pragma: no cover
+                    continue
+                files.append((st.st_mtime, path, st.st_size))
+        files.sort()
+        self.index = OrderedDict((path, size) for _, path, size in files)
+        self.total = sum(self.index.values())
+
+    def remove(self, path: str) -> None:
+        """
+        Removes a local file and its index entry.
+        """
+        with suppress(FileNotFoundError):
+            os.unlink(path)
+        with self.lock:
+            self.total -= self.index.pop(path, 0)
+
+    def discard(self, uri: ParseResult) -> None:
+        """
+        Removes cached files for a remote file or directory.
+        """
+        path = self.get_path(uri)
+        if os.path.isdir(path):
+            shutil.rmtree(path, ignore_errors=True)
+        else:
+            with suppress(FileNotFoundError):
+                os.unlink(path)
+        prefix = path.rstrip('/')
+        with self.lock:
+            for p in list(self.index):
+                if p == prefix or p.startswith(prefix + '/'):
+                    self.total -= self.index.pop(p)
+
+
+@lru_cache(maxsize=None)
+def get_local_cache() -> LocalCache:
+    """
+    Returns local disk cache configured with VIDEO_LOCAL_CACHE_* settings.
+    """
+    return LocalCache(defaults.VIDEO_LOCAL_CACHE_DIR,
+                      defaults.VIDEO_LOCAL_CACHE_SIZE)
+
+
+class CachedWorkspace(Workspace):
+    """
+    Write-through local disk cache in front of a remote workspace.
+
+    Remote workspace keeps durable copies of all files, so processing can be
+    resumed on another host. Files written via this workspace are also kept
+    at local disk and are read back without network requests.
+
+    Processing may have been resumed on another host since local copy was
+    written by another task, so such copies are used for media inputs only
+    if their size matches remote file, and text files are read from remote
+    workspace.
+    """
+
+    def __init__(self, remote: Workspace, cache: LocalCache) -> None:
+        super().__init__(remote.uri)
+        self.remote = remote
+        self.cache = cache
+        self.lock = threading.Lock()
+        # local paths (or ffmpeg output patterns) of uncommitted outputs
+        self.outputs: Set[str] = set()
+        # local paths known to match remote files
+        self.valid: Set[str] = set()
+
+    def get_absolute_uri(self, r: Resource) -> ParseResult:
+        return self.remote.get_absolute_uri(r)
+
+    def is_output(self, path: str) -> bool:
+        """
+        :returns: True if local file is being written by ffmpeg.
+        """
+        dirname, basename = os.path.split(path)
+        with self.lock:
+            outputs = list(self.outputs)
+        for output in outputs:
+            if os.path.dirname(output) != dirname:
+                continue
+            name = os.path.basename(output)
+            regex = output_regex(name)
+            if name == basename or regex and regex.fullmatch(basename):
+                return True
+        return False
+
+    def get_own_path(self, f: File) -> Optional[str]:
+        """
+        :returns: local path of a file written via this workspace.
+        """
+        path = self.cache.get_path(self.get_absolute_uri(f))
+        with self.lock:
+            valid = path in self.valid
+        if not valid and not self.is_output(path):
+            return None
+        return self.cache.get(self.get_absolute_uri(f))
+
+    def get_local_uri(self, f: File) -> Optional[ParseResult]:
+        """
+        :returns: uri of a local file copy if it is cached and is not stale.
+        """
+        path = self.get_own_path(f)
+        if path is None:
+            path = self.cache.get(self.get_absolute_uri(f))
+            if path is None:
+                return None
+            if os.stat(path).st_size != self.remote.size(f):
+                self.logger.debug("stale %s", path)
+                self.cache.remove(path)
+                return None
+            with self.lock:
+                self.valid.add(path)
+        return urlparse(path, scheme='file')
+
+    def get_input_uri(self, f: File) -> ParseResult:
+        return self.get_local_uri(f) or self.remote.get_input_uri(f)
+
+    def get_output_uri(self, f: File) -> ParseResult:
+        path = self.cache.prepare(self.get_absolute_uri(f))
+        with self.lock:
+            self.outputs.add(path)
+        return urlparse(path, scheme='file')
+
+    def commit(self, f: File) -> None:
+        parts = f.parts[:-1]
+        output = self.cache.get_path(self.get_absolute_uri(f))
+        for path in match_outputs(output):
+            committed = File(*parts, os.path.basename(path))
+            with open(path, 'rb') as stream:
+                self.remote.write_stream(committed, stream)
+            self.cache.add(self.get_absolute_uri(committed))
+            with self.lock:
+                self.valid.add(path)
+        with self.lock:
+            self.outputs.discard(output)
+
+    def create_collection(self, c: Collection) -> None:
+        self.remote.create_collection(c)
+
+    def delete_collection(self, c: Collection) -> None:
+        path = self.cache.get_path(self.get_absolute_uri(c)).rstrip('/')
+        self.cache.discard(self.get_absolute_uri(c))
+        with self.lock:
+            self.valid = {p for p in self.valid
+                          if not p.startswith(path + '/')}
+        self.remote.delete_collection(c)
+
+    def exists(self, r: Resource) -> bool:
+        return self.remote.exists(r)
+
+    def size(self, f: File) -> Optional[int]:
+        return self.remote.size(f)
+
+    def list_collection(self, c: Collection) -> List[Resource]:
+        return self.remote.list_collection(c)
+
+    def read(self, f: File) -> str:
+        path = self.get_own_path(f)
+        if path is None:
+            return self.remote.read(f)
+        self.logger.debug("read cached %s", path)
+        with open(path, 'r') as fd:
+            return fd.read()
+
+    def write(self, f: File, content: str) -> None:
+        self.remote.write(f, content)
+        uri = self.get_absolute_uri(f)
+        path = self.cache.prepare(uri)
+        with open(path, 'w') as fd:
+            fd.write(content)
+        self.cache.add(uri)
+        with self.lock:
+            self.valid.add(path)
+
+    def read_stream(self, f: File) -> Iterator[bytes]:
+        uri = self.get_local_uri(f)
+        if uri is None:
+            yield from self.remote.read_stream(f)
+            return
+        self.logger.debug("read cached %s", uri.path)
+        with open(uri.path, 'rb') as fd:
+            yield from iter(lambda: fd.read(STREAM_CHUNK_SIZE), b'')
+
+    def write_stream(self, f: File, stream: IO[bytes]) -> None:
+        uri = self.get_output_uri(f)
+        with open(uri.path, 'wb') as fd:
+            shutil.copyfileobj(stream, fd)
+        self.commit(f)
+
+
 def init(base: str) -> Workspace:
     uri = urlparse(base)
     if uri.scheme == 'file':
@@ -231,5 +1024,7 @@ def init(base: str) -> Workspace:
     elif uri.scheme == 'davs':
         uri = uri._replace(scheme='https')
         return WebDAVWorkspace(uri.geturl())
+    elif uri.scheme == 's3':
+        return S3Workspace(base)
     else:
         raise ValueError(base)